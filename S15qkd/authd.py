@@ -10,22 +10,65 @@
 # - Forcing 'NULL-SHA256' with SSL_CONTEXT_*.maximum_version = ssl.TLSVersion.TLSv1_2 yields
 #   'ssl.SSLError: [SSL: UNEXPECTED_MESSAGE] unexpected message (_ssl.c:1125)' error.
 #   This is with OpenSSL 1.1.1d (Sep 2019)
+#
+# Relays traffic between local clients and the remote authd over a single TLS link.
+# The link carries several logical channels, each framed with a 'FRAME_HEADER':
+#
+#   CONTROL:   Controller messages, from the local control port (see Transferd.send).
+#   TRANSFERD: Byte stream of transferd, i.e. epoch files and transferd messages.
+#   ERRC:      Error correction packets, relayed between the errcd pipes directly
+#              if '--ecs'/'--ecr' are supplied (transferd is then started without).
+#
+# Frames are scheduled in the order of priority above, and bulk frames are limited
+# to '--chunk_size' bytes, so that control messages are never queued behind more
+# than a single bulk frame.
+#
+# Bulk frames are optionally compressed with '--compression', and marked as such
+# in the frame flags. On every connection, both sides first send a LINK frame
+# listing the codecs they can decode, and frames are only compressed once the
+# remote authd has announced support, so that mixed versions interoperate. Frames
+# that barely compress, e.g. already compressed epoch files, are sent uncompressed
+# for a while before compression is attempted again. Payload and on-wire byte
+# counts are written to '--stats_file' for the controller.
+#
+# All channels are handled by an asyncio event loop, so that a reconnection on one
+# side does not stall the other side. Data received while the other side is
+# disconnected is buffered, up to the high watermark, after which reading pauses
+# until the buffer drains below the low watermark.
+#
+# Frames from the remote authd are handed to their channel without waiting, so
+# that a slow local client, e.g. transferd, never holds up control messages
+# behind it on the link. Instead, each channel is flow controlled with credit:
+# the receiving authd grants the sender a window of bytes per channel in LINK
+# frames, up to the high watermark minus the bytes already buffered, and tops
+# it up once the channel drained below the low watermark. The sender never
+# exceeds the window, so buffers stay below the high watermark without reading
+# the link ever pausing. Only if the remote authd did not announce credit in its
+# first LINK frame, reading the link pauses above the high watermark as before.
 
 import argparse
-import select
+import asyncio
+import collections
+import errno
+import functools
+import json
+import os
 import socket
 import ssl
-import sys
+import struct
+import zlib
 
 # For bookkeeping only
-import json
 import logging
 import time
-import traceback
-from types import SimpleNamespace
 import qkd_globals
 from utils import Process
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s | %(levelname)s | %(message)s",
@@ -41,6 +84,17 @@ parser.add_argument("-P", type=int)  # transferd port
 parser.add_argument("-r")  # remote cert
 parser.add_argument("-c")  # local cert
 parser.add_argument("-k")  # local key
+parser.add_argument("--chunk_size", type=int, default=65536)  # bytes per read
+parser.add_argument("--high_watermark", type=int, default=4194304)  # bytes buffered per direction
+parser.add_argument("--low_watermark", type=int, default=1048576)
+parser.add_argument("--stats_interval", type=float, default=60)  # seconds, 0 to disable
+parser.add_argument("--control_port", type=int)  # controller port, default transferd port + 1
+parser.add_argument("--ecs")  # errcd send pipe, for error correction channel
+parser.add_argument("--ecr")  # errcd receive pipe
+parser.add_argument(
+    "--compression", choices=("none", "zlib", "zstd", "auto"), default="none")
+parser.add_argument("--compression_level", type=int, default=3)
+parser.add_argument("--stats_file")  # link statistics for controller, in JSON
 args = parser.parse_args()
 
 HOSTNAME = args.H if args.H else config.target_hostname
@@ -49,6 +103,30 @@ PORT_TD = args.P if args.P else config.port_transd
 REMOTE_CERT = args.r if args.r else config.remote_cert
 LOCAL_CERT = args.c if args.c else config.local_cert
 LOCAL_KEY = args.k if args.k else config.local_key
+PORT_CONTROL = args.control_port if args.control_port else PORT_TD + 1
+CHUNK_SIZE = args.chunk_size
+HIGH_WATERMARK = args.high_watermark
+LOW_WATERMARK = min(args.low_watermark, args.high_watermark)
+RECONNECT_INTERVAL = 10  # seconds
+PIPE_RETRY_INTERVAL = 1  # seconds
+STATS_FILE_INTERVAL = 1  # seconds
+
+# Logical channels, in order of decreasing priority, and link management
+CONTROL, TRANSFERD, ERRC = 0, 1, 2
+LINK = 255
+CHANNEL_NAMES = {CONTROL: "control", TRANSFERD: "transferd", ERRC: "errc"}
+TCP_NOTSENT_LOWAT = getattr(socket, "TCP_NOTSENT_LOWAT", 25)  # Linux, Python < 3.12
+FRAME_HEADER = struct.Struct("!BBI")  # channel, flags, payload length
+
+# Frame flags, identifying the codec of the payload
+FLAG_ZLIB, FLAG_ZSTD = 1, 2
+CODEC_FLAGS = {"zlib": FLAG_ZLIB, "zstd": FLAG_ZSTD}
+COMPRESSED_CHANNELS = (TRANSFERD, ERRC)  # control messages are too short to gain
+MIN_COMPRESSED_SIZE = 1024  # bytes, smaller frames are sent as is
+BYPASS_RATIO = 0.9  # compressed/payload size above which compression is bypassed
+BYPASS_FRAMES = 32  # frames sent uncompressed before compression is retried
+HELLO_TIMEOUT = 5  # seconds to wait for the LINK frame of the remote authd
+CREDIT_THRESHOLD = max(HIGH_WATERMARK - LOW_WATERMARK, 1)  # bytes, minimum credit granted
 
 SSL_CONTEXT_CLIENT = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
 SSL_CONTEXT_CLIENT.load_verify_locations(cafile=REMOTE_CERT)
@@ -61,147 +139,562 @@ SSL_CONTEXT_SERVER.load_verify_locations(cafile=REMOTE_CERT)
 SSL_CONTEXT_SERVER.load_cert_chain(LOCAL_CERT, LOCAL_KEY)
 SSL_CONTEXT_SERVER.verify_mode = ssl.CERT_REQUIRED
 
-def connect_as_authd_client(hostname, port):
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
-    conn = SSL_CONTEXT_CLIENT.wrap_socket(sock, server_hostname=hostname)
+
+class Channel:
+    """Buffers one direction of a relayed byte stream.
+
+    Received chunks are queued as is and handed to the sink transport without
+    slicing or copying. The number of buffered bytes is bounded by the high
+    watermark, see 'put()'. Channels multiplexed onto the link share the
+    'data_available' event of the link.
+    """
+
+    def __init__(self, name: str, data_available: asyncio.Event = None):
+        self.name = name
+        self.chunks = collections.deque()
+        self.buffered = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.num_paused = 0  # times reading was paused by backpressure
+        self.on_pop = None  # called after data is removed, see 'Link'
+        self._data_available = data_available if data_available else asyncio.Event()
+        self._below_low_watermark = asyncio.Event()
+        self._below_low_watermark.set()
+
+    async def put(self, data: bytes):
+        if self.buffered >= HIGH_WATERMARK:
+            self.num_paused += 1
+            logger.warning(f"Buffer to {self.name} full ({self.buffered} bytes), pausing reads.")
+            await self.drained()
+        self.put_nowait(data)
+
+    def put_nowait(self, data: bytes):
+        """Buffers data regardless of the high watermark."""
+        self.chunks.append(data)
+        self.buffered += len(data)
+        self.bytes_in += len(data)
+        self._data_available.set()
+
+    async def drained(self):
+        """Waits until the buffer drains below the low watermark."""
+        if self.buffered > LOW_WATERMARK:
+            self._below_low_watermark.clear()
+            await self._below_low_watermark.wait()
+
+    def pop(self, limit: int = None):
+        """Returns the next chunk of at most 'limit' bytes, or None if no data is buffered."""
+        if not self.chunks:
+            return None
+        data = self.chunks.popleft()
+        if limit is not None and len(data) > limit:
+            self.chunks.appendleft(data[limit:])
+            data = data[:limit]
+        self.buffered -= len(data)
+        self.bytes_out += len(data)
+        if self.buffered <= LOW_WATERMARK:
+            self._below_low_watermark.set()
+        if self.on_pop:
+            self.on_pop()
+        return data
+
+    async def get(self) -> bytes:
+        while (data := self.pop()) is None:
+            self._data_available.clear()
+            await self._data_available.wait()
+        return data
+
+
+class Link:
+    """Compresses and decompresses frames exchanged with the remote authd.
+
+    The codec used for sending is negotiated anew for every connection: the
+    first codec in the local preference that the remote authd announced in its
+    LINK frame, see 'hello()' and 'negotiate()'. Received frames are decoded
+    according to their flags, independent of the negotiation.
+
+    Sending is also flow controlled per connection, once the remote authd
+    announced credit: frames on a channel are sent only within the credit the
+    remote authd granted, see 'encode()'. Credit for the 'receiving' channels
+    is granted in the first LINK frame and whenever they drain, see 'grant()'.
+    'data_available' is set when the remote authd grants credit, and
+    'negotiated' once the first LINK frame of the connection is received.
+    """
+
+    def __init__(
+            self, compression: str = "none", level: int = 3,
+            data_available: asyncio.Event = None, receiving: dict = None):
+        self.supported = ["zlib"] + (["zstd"] if zstandard else [])
+        if compression == "auto":
+            self.preferred = self.supported[::-1]
+        elif compression == "none":
+            self.preferred = []
+        elif compression in self.supported:
+            self.preferred = [compression]
+        else:
+            logger.warning(f"Compression '{compression}' not available, disabling.")
+            self.preferred = []
+        self.level = level
+        self.codec = None
+        self._compress = {"zlib": lambda data: zlib.compress(data, level)}
+        self._decompress = {FLAG_ZLIB: zlib.decompress}
+        if zstandard:
+            self._compress["zstd"] = zstandard.ZstdCompressor(level=level).compress
+            self._decompress[FLAG_ZSTD] = zstandard.ZstdDecompressor().decompress
+        self._bypass = collections.Counter()  # remaining uncompressed frames per channel
+        self.num_bypassed = 0  # frames sent uncompressed due to poor ratio
+        self.payload_bytes_sent = 0
+        self.wire_bytes_sent = 0  # including frame headers
+        self.payload_bytes_received = 0
+        self.wire_bytes_received = 0
+        self.flow_control = False  # remote authd sends within granted credit
+        self.credit = collections.Counter()  # bytes allowed to be sent per channel
+        self.granted = collections.Counter()  # bytes granted to remote authd per channel
+        self.receiving = receiving if receiving else {}
+        for channel_id, channel in self.receiving.items():
+            channel.on_pop = functools.partial(self.grant, channel_id)
+        self.negotiated = asyncio.Event()
+        self._data_available = data_available if data_available else asyncio.Event()
+        self._writer = None
+
+    @staticmethod
+    def message(data: dict) -> bytes:
+        """Returns a LINK frame holding 'data'."""
+        data = json.dumps(data).encode()
+        return FRAME_HEADER.pack(LINK, 0, len(data)) + data
+
+    def hello(self) -> bytes:
+        """Returns the LINK frame announcing the supported codecs and granting credit."""
+        return Link.message({"compression": self.supported, "credit": self.granted})
+
+    def reset(self, writer):
+        """Holds sending until the new connection is negotiated, see 'negotiate()'."""
+        self.codec = None
+        self.flow_control = False
+        self.credit.clear()
+        self.granted = collections.Counter({
+            channel_id: max(HIGH_WATERMARK - channel.buffered, 0)
+            for channel_id, channel in self.receiving.items()})
+        self.negotiated.clear()
+        self._bypass.clear()
+        self._writer = writer
+        writer.write(self.hello())
+        asyncio.get_running_loop().call_later(HELLO_TIMEOUT, self._hello_timeout, writer)
+
+    def _hello_timeout(self, writer):
+        if writer is self._writer and not self.negotiated.is_set():
+            logger.warning("No LINK frame from remote authd, sending without compression "
+                "and flow control.")
+            self.negotiated.set()
+            self._data_available.set()
+
+    def negotiate(self, data: bytes):
+        try:
+            message = json.loads(data)
+            remote = message.get("compression")
+            credit = {int(k): int(v) for k, v in message.get("credit", {}).items()}
+        except (ValueError, AttributeError, TypeError):
+            logger.warning(f"Ignored malformed link message: {data!r}")
+            return
+        if remote is not None:
+            self.codec = next((c for c in self.preferred if c in remote), None)
+            self.flow_control = "credit" in message
+            logger.info(f"Remote authd supports compression {remote}, "
+                f"sending with {self.codec or 'none'}"
+                f"{' within credit' if self.flow_control else ''}.")
+            self.negotiated.set()
+        self.credit.update(credit)
+        self._data_available.set()
+
+    def _send(self, data: dict):
+        if self._writer is not None and not self._writer.is_closing():
+            self._writer.write(Link.message(data))
+
+    def grant(self, channel_id: int):
+        """Grants credit up to the high watermark, once it reaches 'CREDIT_THRESHOLD'."""
+        if not self.flow_control:
+            return
+        channel = self.receiving[channel_id]
+        credit = HIGH_WATERMARK - channel.buffered - self.granted[channel_id]
+        if credit >= CREDIT_THRESHOLD:
+            self.granted[channel_id] += credit
+            self._send({"credit": {channel_id: credit}})
+
+    def received(self, channel_id: int, length: int):
+        """Accounts data received on the channel against the granted credit."""
+        if length > self.granted[channel_id]:
+            logger.warning(f"Remote authd exceeded credit on "
+                f"{CHANNEL_NAMES.get(channel_id, channel_id)} by "
+                f"{length - self.granted[channel_id]} bytes.")
+        self.granted[channel_id] = max(self.granted[channel_id] - length, 0)
+
+    def encode(self, channel_id: int, data: bytes):
+        """Returns (flags, payload) of the frame to send, deducting its credit."""
+        flags, payload = 0, data
+        self.credit[channel_id] -= len(data)
+        if (
+                self.codec and channel_id in COMPRESSED_CHANNELS
+                and len(data) >= MIN_COMPRESSED_SIZE):
+            if self._bypass[channel_id] > 0:
+                self._bypass[channel_id] -= 1
+                self.num_bypassed += 1
+            else:
+                compressed = self._compress[self.codec](data)
+                if len(compressed) < BYPASS_RATIO * len(data):
+                    flags, payload = CODEC_FLAGS[self.codec], compressed
+                else:
+                    self._bypass[channel_id] = BYPASS_FRAMES
+        self.payload_bytes_sent += len(data)
+        self.wire_bytes_sent += FRAME_HEADER.size + len(payload)
+        return flags, payload
+
+    def decode(self, flags: int, payload: bytes) -> bytes:
+        if flags == 0:
+            data = payload
+        elif flags in self._decompress:
+            data = self._decompress[flags](payload)
+        else:
+            raise ConnectionError(f"Unsupported frame flags {flags} from authd.")
+        self.payload_bytes_received += len(data)
+        self.wire_bytes_received += FRAME_HEADER.size + len(payload)
+        return data
+
+    def statistics(self) -> dict:
+        return {
+            "compression": self.codec or "none",
+            "payload_bytes_sent": self.payload_bytes_sent,
+            "wire_bytes_sent": self.wire_bytes_sent,
+            "payload_bytes_received": self.payload_bytes_received,
+            "wire_bytes_received": self.wire_bytes_received,
+            "bypassed_frames": self.num_bypassed,
+        }
+
+
+class Endpoint:
+    """Holds the currently active connection to one side of the relay.
+
+    'on_attach' is called with the writer of every new connection, before any
+    other data is written to it.
+    """
+
+    def __init__(
+            self, name: str, high_watermark: int = None, low_watermark: int = None,
+            notsent_lowat: int = None, on_attach=None):
+        self.name = name
+        self.notsent_lowat = notsent_lowat
+        self.on_attach = on_attach
+        self.reader = None
+        self.writer = None
+        self.high_watermark = high_watermark if high_watermark else HIGH_WATERMARK
+        self.low_watermark = low_watermark if low_watermark else LOW_WATERMARK
+        self._connected = asyncio.Event()
+
+    def attach(self, reader, writer):
+        if self.writer is not None:
+            logger.warning(f"Replacing existing connection with {self.name}.")
+            self.writer.close()
+        writer.transport.set_write_buffer_limits(self.high_watermark, self.low_watermark)
+        sock = writer.get_extra_info("socket")
+        if self.notsent_lowat and sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, TCP_NOTSENT_LOWAT, self.notsent_lowat)
+        self.reader, self.writer = reader, writer
+        if self.on_attach:
+            self.on_attach(writer)
+        self._connected.set()
+
+    def detach(self, writer):
+        if writer is not self.writer:
+            return  # stale connection already replaced
+        writer.close()
+        self.reader = self.writer = None
+        self._connected.clear()
+
+    async def wait_connected(self):
+        await self._connected.wait()
+        return self.writer
+
+
+async def relay(endpoint: Endpoint, reader, writer, receiver):
+    """Attaches connection to endpoint, and digests it with 'receiver' until it drops."""
+    endpoint.attach(reader, writer)
+    try:
+        await receiver(reader)
+    except asyncio.IncompleteReadError:
+        logger.error(f"{endpoint.name} disconnected.")
+    except (ConnectionError, OSError, ssl.SSLError) as e:
+        logger.error(e)
+    finally:
+        endpoint.detach(writer)
+
+
+def stream_receiver(name: str, channel: Channel):
+    """Returns receiver forwarding raw stream into channel."""
+    async def receiver(reader):
+        while True:
+            data = await reader.read(CHUNK_SIZE)
+            if data == b"":
+                raise ConnectionError(f"{name} disconnected.")
+            await channel.put(data)
+    return receiver
+
+
+def frame_receiver(link: Link, channels: dict):
+    """Returns receiver demultiplexing frames from remote authd into channels.
+
+    Frames are buffered without waiting, since the remote authd sends within
+    the credit granted by 'link'. Only if the remote authd does not support
+    credit, reading the link pauses until a full channel drains.
+    """
+    async def receiver(reader):
+        while True:
+            channel_id, flags, length = FRAME_HEADER.unpack(
+                await reader.readexactly(FRAME_HEADER.size))
+            data = await reader.readexactly(length)
+            if channel_id == LINK:
+                link.negotiate(data)
+                continue
+            try:
+                data = link.decode(flags, data)
+            except (zlib.error, getattr(zstandard, "ZstdError", zlib.error)) as e:
+                raise ConnectionError(f"Failed to decompress frame from authd: {e}")
+            channel = channels.get(channel_id)
+            if channel is None:
+                logger.warning(f"Dropped {length} bytes for unknown channel {channel_id}.")
+                continue
+            if link.flow_control:
+                link.received(channel_id, len(data))
+                channel.put_nowait(data)
+            else:
+                await channel.put(data)
+    return receiver
+
+
+async def send(endpoint: Endpoint, channel: Channel):
+    """Writes channel data to the active connection, waiting for reconnections."""
+    while True:
+        data = await channel.get()
+        writer = await endpoint.wait_connected()
+        try:
+            writer.write(data)
+            await writer.drain()  # respects transport watermarks
+        except (ConnectionError, OSError, ssl.SSLError) as e:
+            logger.error(f"Failed to send {len(data)} bytes to {endpoint.name}: {e}")
+            endpoint.detach(writer)
+
+
+async def send_frames(
+        endpoint: Endpoint, link: Link, channels: dict, data_available: asyncio.Event):
+    """Multiplexes channels onto the link, highest priority (lowest id) first.
+
+    Channels are sent only within the credit granted by the remote authd, if
+    it supports credit.
+    """
+    by_priority = sorted(channels.items())
+    while True:
+        writer = await endpoint.wait_connected()
+        if not link.negotiated.is_set():
+            await link.negotiated.wait()
+            continue  # connection may have been replaced meanwhile
+        for channel_id, channel in by_priority:
+            limit = link.credit[channel_id] if link.flow_control else None
+            if limit is not None and limit <= 0:
+                continue
+            data = channel.pop(limit)
+            if data is not None:
+                break
+        else:
+            data_available.clear()
+            await data_available.wait()
+            continue
+        flags, payload = link.encode(channel_id, data)
+        try:
+            writer.writelines((FRAME_HEADER.pack(channel_id, flags, len(payload)), payload))
+            await writer.drain()
+        except (ConnectionError, OSError, ssl.SSLError) as e:
+            logger.error(f"Failed to send {len(data)} bytes to {endpoint.name}: {e}")
+            endpoint.detach(writer)
+
+
+def describe(writer):
+    host, port, *_ = writer.get_extra_info("peername")
+    cipher = writer.get_extra_info("cipher")
+    return f"{host}:{port}" + (f" with {cipher}" if cipher else "")
+
+
+def handle_connection(endpoint: Endpoint, receiver):
+    """Returns connection callback for 'asyncio.start_server'."""
+    async def callback(reader, writer):
+        logger.info(f"Connected as server to {endpoint.name} at {describe(writer)}.")
+        await relay(endpoint, reader, writer, receiver)
+    return callback
+
+
+async def connect_as_authd_client(hostname, port):
     logger.debug(f"Attempting connection as client to {hostname}:{port}.")
-    conn.connect((hostname, port))
-    conn.setblocking(False)
-    logger.info(f"Connected as client to authd at {hostname}:{port} with {conn.cipher()}.")
-    return conn, sock
-
-def connect_as_authd_server(server_socket):
-    logger.info(f"Waiting for connection with authd...")
-    sock, addr = server_socket.accept()  # blocking
-    conn = SSL_CONTEXT_SERVER.wrap_socket(sock, server_side=True)
-    conn.setblocking(False)
-    logger.info(f"Connected as server to authd at {addr[0]}:{addr[1]} with {conn.cipher()}.")
-    return conn, sock
-
-def connect_as_transferd_server(server_socket):
-    logger.info(f"Waiting for connection with transferd...")
-    conn, addr = server_socket.accept()
-    conn.setblocking(False)
-    logger.info(f"Connected as server to transferd at {addr[0]}:{addr[1]}.")
-    return conn
-
-def listen_as_server(addr: str = "0.0.0.0", port: int = 55555) -> socket.socket:
-    ssock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
-    ssock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # reuse port address
+    reader, writer = await asyncio.open_connection(
+        hostname, port, ssl=SSL_CONTEXT_CLIENT, server_hostname=hostname)
+    logger.info(f"Connected as client to authd at {describe(writer)}.")
+    return reader, writer
+
+
+async def maintain_authd_client(endpoint: Endpoint, receiver, connection):
+    """Relays on the given connection, then reconnects as client whenever it drops."""
+    while True:
+        await relay(endpoint, *connection, receiver)
+        while True:
+            logger.info("Attempting reconnection to authd.")
+            try:
+                connection = await connect_as_authd_client(HOSTNAME, PORT)
+                break
+            except (ConnectionError, OSError) as e:
+                logger.info(f"Failed to connect as client to {HOSTNAME}:{PORT} ({e}). "
+                    f"Trying again after {RECONNECT_INTERVAL} seconds...")
+                await asyncio.sleep(RECONNECT_INTERVAL)
+
+
+async def maintain_errcd_pipes(endpoint: Endpoint, channel: Channel, path_in, path_out):
+    """Relays errcd pipes, reopening the outgoing pipe whenever errcd restarts.
+
+    The incoming pipe is opened read-write, which never signals EOF. The outgoing
+    pipe can only be opened once errcd opened it for reading.
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=CHUNK_SIZE)
+    fd = os.open(path_in, os.O_RDWR | os.O_NONBLOCK)
+    await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(fd, "rb", buffering=0))
+    # Reference to task kept, since the event loop holds only weak references
+    receiving = asyncio.create_task(stream_receiver("errcd", channel)(reader))
+
+    while True:
+        try:
+            fd = os.open(path_out, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+            await asyncio.sleep(PIPE_RETRY_INTERVAL)  # errcd not reading yet
+            continue
+        protocol = asyncio.StreamReaderProtocol(asyncio.StreamReader())
+        transport, _ = await loop.connect_write_pipe(
+            lambda: protocol, os.fdopen(fd, "wb", buffering=0))
+        writer = asyncio.StreamWriter(transport, protocol, None, loop)
+        logger.info(f"Connected to errcd pipe '{path_out}'.")
+        endpoint.attach(None, writer)
+        while not transport.is_closing():
+            await asyncio.sleep(PIPE_RETRY_INTERVAL)
+        logger.error("errcd disconnected.")
+        endpoint.detach(writer)
+
+
+async def listen_as_server(callback, addr: str = "0.0.0.0", port: int = 55555, ssl_context=None):
     try:
-        ssock.bind((addr, port))
+        server = await asyncio.start_server(
+            callback, addr, port, reuse_address=True, ssl=ssl_context)
     except OSError as e:
         logger.error('Failed to bind address: '+ str(e))
         logger.info('Killing any authd orphaned process')
         qkd_globals.kill_process_by_cmdline('authd.py')
-    ssock.listen()
+        raise
     logger.info(f"Listening as server on {port}/tcp for connections...")
-    return ssock
+    return server
 
-# Handle terminating program
-try:
-    ssock_td = ssock = sock = conn_td = conn = None
-    
-    # Listen for incoming ipv4 TCP connections from local transferd
-    ssock_td = listen_as_server("127.0.0.1",port = PORT_TD)
 
-    # Setup connection with remote authd, first as a client,
-    # failing which, listen for connections as server
-    try:
-        is_server = False
-        conn, sock = connect_as_authd_client(HOSTNAME, PORT)
+async def report_statistics(link: Link, channels, interval):
+    """Logs throughput per channel every 'interval' seconds."""
+    previous = {c.name: c.bytes_out for c in channels}
+    previous_time = time.monotonic()
+    while True:
+        await asyncio.sleep(interval)
+        now = time.monotonic()
+        for c in channels:
+            rate = (c.bytes_out - previous[c.name]) / (now - previous_time)
+            previous[c.name] = c.bytes_out
+            logger.info(
+                f"To {c.name}: {c.bytes_out} bytes sent ({rate/1e3:.1f} kB/s), "
+                f"{c.buffered} bytes buffered, paused {c.num_paused} times.")
+        previous_time = now
+        logger.info(
+            f"Link ({link.codec or 'uncompressed'}): "
+            f"{link.payload_bytes_sent} payload / {link.wire_bytes_sent} wire bytes sent, "
+            f"{link.payload_bytes_received} payload / {link.wire_bytes_received} "
+            "wire bytes received.")
 
-    except (ConnectionRefusedError, OSError):
-        is_server = True
-        ssock = listen_as_server(port = PORT)
-        conn, sock = connect_as_authd_server(ssock)
 
-    # Setup connection with local 'transferd'
-    conn_td = connect_as_transferd_server(ssock_td)
+async def write_statistics(path, link: Link, channels, interval=STATS_FILE_INTERVAL):
+    """Periodically replaces 'path' with the link and channel statistics."""
+    tmp_path = f"{path}.tmp"
+    while True:
+        stats = link.statistics()
+        stats["time"] = time.time()
+        stats["channels"] = {
+            c.name: {"bytes": c.bytes_out, "buffered": c.buffered} for c in channels}
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(stats, f)
+            os.replace(tmp_path, path)  # readers never see partial writes
+        except OSError as e:
+            logger.warning(f"Failed to write statistics to '{path}': {e}")
+        await asyncio.sleep(interval)
 
-    # Internal authd buffer, in case of asymmetric transfer rates
-    # See https://stackoverflow.com/a/57748513 for amortized O(1) bytearray pop_front
-    to_remote = bytearray()
-    to_local = bytearray()
 
-    # Main loop, make sure connections stay up
-    while True:
+async def main():
+    # Keep the link transport buffer small, so that queued frames can still be
+    # reordered by priority instead of waiting behind buffered bulk data.
+    # The kernel send buffer is likewise limited with 'TCP_NOTSENT_LOWAT'.
+    link_data_available = asyncio.Event()
+    channel_ids = [CONTROL, TRANSFERD] + ([ERRC] if args.ecs and args.ecr else [])
+    locals_ = {k: Endpoint(CHANNEL_NAMES[k]) for k in channel_ids}
+    to_remote = {
+        k: Channel(f"authd ({CHANNEL_NAMES[k]})", link_data_available) for k in channel_ids}
+    to_local = {k: Channel(CHANNEL_NAMES[k]) for k in channel_ids}
+    link = Link(args.compression, args.compression_level, link_data_available, to_local)
+    remote = Endpoint(
+        "authd", high_watermark=2 * CHUNK_SIZE, low_watermark=CHUNK_SIZE,
+        notsent_lowat=CHUNK_SIZE, on_attach=link.reset)
 
-        # Make sure authd connection is available
-        if conn is None:
-            logger.info("Attempting reconnection to authd.")
-            if is_server:
-                conn, sock = connect_as_authd_server(ssock)
-            else:
-                while True:
-                    try:
-                        conn, sock = connect_as_authd_client(HOSTNAME, PORT)
-                        break
-                    except (ConnectionRefusedError, OSError):
-                        logger.info(f"Failed to connect as client to {HOSTNAME}:{PORT}. "
-                            "Trying again after 10 seconds...")
-                        time.sleep(10)
-
-        # Make sure transferd connection is available
-        if conn_td is None:
-            logger.info("Attempting reconnection to transferd.")
-            conn_td = connect_as_transferd_server(ssock_td)
-
-        # Handle connection error / dropouts
-        try:
-        
-            # All connections available, loop me
-            # TODO: Use separate processes for each pipe, if authd is throttling
-            while True:
-                conn_list = [conn, conn_td]
-                # TODO: Do something with the exceptions from select call
-                readables, writeables, exceptionals = select.select(
-                    conn_list, conn_list, [], 0)
-
-                for c in readables:
-                    if c is conn_td:
-                        msg = c.recv(1023)  # transferd max message length = 1023 bytes
-                        if msg == b"":
-                            conn_td = None
-                            raise IOError("transferd disconnected.")
-                        to_remote += msg
-                    elif c is conn:
-                        try:
-                            msg = c.recv(2048)  # hardcoded
-                        except ssl.SSLWantReadError:
-                            # logger.warning("Problematic SSL handshake. Ignoring.")
-                            continue
-                        if msg == b"":
-                            conn = None
-                            raise IOError("authd disconnected.")
-                        to_local += msg
-
-                for c in writeables:
-                    if c is conn_td and to_local:
-                        msg = to_local[:1023]
-                        del to_local[:1023]
-                        c.send(msg)
-                    elif c is conn and to_remote:
-                        msg = to_remote[:2048]  # hardcoded
-                        del to_remote[:2048]  # hardcoded
-                        c.send(msg)
-                time.sleep(0.001)
-
-        except KeyboardInterrupt:
-            break  # Ignore user-termination
-        except:
-            # Handle connection error / dropouts
-            error = traceback.format_exc().split("\n")[-2]  # get _latest_ error
-            logger.error(error)
-            continue
+    tasks = [asyncio.create_task(send_frames(remote, link, to_remote, link_data_available))]
+    tasks += [asyncio.create_task(send(locals_[k], to_local[k])) for k in channel_ids]
+    channels = [*to_remote.values(), *to_local.values()]
+    if args.stats_interval > 0:
+        tasks.append(asyncio.create_task(
+            report_statistics(link, channels, args.stats_interval)))
+    if args.stats_file:
+        tasks.append(asyncio.create_task(write_statistics(args.stats_file, link, channels)))
+
+    # Listen for incoming ipv4 TCP connections from local transferd and controller
+    servers = []
+    for k, port in ((TRANSFERD, PORT_TD), (CONTROL, PORT_CONTROL)):
+        receiver = stream_receiver(CHANNEL_NAMES[k], to_remote[k])
+        servers.append(await listen_as_server(
+            handle_connection(locals_[k], receiver), "127.0.0.1", port=port))
+    if ERRC in channel_ids:
+        tasks.append(asyncio.create_task(
+            maintain_errcd_pipes(locals_[ERRC], to_remote[ERRC], args.ecs, args.ecr)))
+
+    # Setup connection with remote authd, first as a client,
+    # failing which, listen for connections as server
+    receiver = frame_receiver(link, to_local)
+    try:
+        connection = await connect_as_authd_client(HOSTNAME, PORT)
+        tasks.append(asyncio.create_task(maintain_authd_client(remote, receiver, connection)))
+    except (ConnectionError, OSError):
+        logger.info("Waiting for connection with authd...")
+        servers.append(await listen_as_server(
+            handle_connection(remote, receiver), port=PORT, ssl_context=SSL_CONTEXT_SERVER))
+
+    logger.info("Waiting for connection with transferd...")
+    try:
+        await asyncio.gather(*tasks, *(s.serve_forever() for s in servers))
+    finally:
+        # TODO: Check if need to shutdown socket on other end with 'socket.SHUT_RDWR'
+        for endpoint in (remote, *locals_.values()):
+            if endpoint.writer:
+                endpoint.writer.close()
+        for server in servers:
+            server.close()
 
+
+# Handle terminating program
+try:
+    asyncio.run(main())
 except KeyboardInterrupt:
     pass  # Ignore user-termination
-finally:
-    # Handle terminating program
-    # TODO: Check if need to shutdown socket on other end with 'socket.SHUT_RDWR'
-    if conn_td: conn_td.close()
-    if ssock_td: ssock_td.close()
-    if conn: conn.close()
-    if sock: sock.close()
-    if ssock: ssock.close()
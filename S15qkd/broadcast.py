@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Fans out status changes to any number of viewers as server-sent events.
+
+The controller samples its status once per interval, independent of the
+number of viewers, and publishes it per topic, e.g. 'process_state'. Only
+the keys whose values changed are sent, as a 'delta' event, and each
+event is encoded once and queued for all subscribers. A new subscriber
+first receives a 'snapshot' event with the full state.
+
+A subscriber too slow to keep up, i.e. with 'SUBSCRIBER_QUEUE' events
+pending, is resynchronized with a new snapshot instead of blocking the
+publisher.
+
+Each open stream holds a server thread, so at most 'MAX_SUBSCRIBERS'
+streams are served at once, leaving the remaining threads to other
+requests.
+
+Usage:
+    broadcaster.publish('process_state', {'transferd': True, ...})
+    stream = broadcaster.stream()  # None if too many streams are open
+    for event in stream:  # e.g. as a streamed HTTP response
+        ...
+    stream.close()  # also done by the WSGI server
+
+Copyright (c) 2020 S-Fifteen Instruments Pte. Ltd.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import copy
+import json
+import queue
+import threading
+from typing import Optional
+
+CONTENT_TYPE = 'text/event-stream'
+HEARTBEAT = 15  # seconds between keep-alive comments, also detects closed streams
+SUBSCRIBER_QUEUE = 64  # events pending per subscriber before resynchronizing
+MAX_SUBSCRIBERS = 8  # of the 16 server threads, see 'entrypoint.sh'
+
+
+def _format_event(name: str, version: int, data: dict) -> str:
+    payload = json.dumps(data, default=str)
+    return f'event: {name}\nid: {version}\ndata: {payload}\n\n'
+
+
+class Subscription:
+    """Events pending for a single viewer."""
+
+    def __init__(self):
+        self.queue = queue.Queue(SUBSCRIBER_QUEUE)
+        self.resync = False
+
+    def put(self, event: str):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.resync = True
+
+
+class Stream:
+    """Events of a subscription in the 'text/event-stream' format, until closed.
+
+    The subscription is released on 'close()', which the WSGI server calls
+    even if the response was never iterated.
+    """
+
+    def __init__(self, broadcaster, subscription: Subscription, heartbeat: float):
+        self._broadcaster = broadcaster
+        self._subscription = subscription
+        self._heartbeat = heartbeat
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if self._closed:
+            raise StopIteration
+        return self._broadcaster.next_event(self._subscription, self._heartbeat)
+
+    def close(self):
+        self._closed = True
+        self._broadcaster.unsubscribe(self._subscription)
+
+
+class Broadcaster:
+    """Latest state per topic, and the subscribers to its changes."""
+
+    def __init__(self, max_subscribers: int = MAX_SUBSCRIBERS):
+        self.max_subscribers = max_subscribers
+        self._state = {}  # topic -> dict
+        self._version = 0
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, topic: str, state: dict) -> bool:
+        """Sends the keys of 'state' that changed, returns whether any did."""
+        with self._lock:
+            current = self._state.setdefault(topic, {})
+            delta = {k: v for k, v in state.items() if k not in current or current[k] != v}
+            if not delta:
+                return False
+            current.update(copy.deepcopy(delta))
+            self._version += 1
+            event = _format_event('delta', self._version, {topic: delta})
+            for subscription in self._subscribers:
+                subscription.put(event)
+        return True
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return copy.deepcopy(self._state)
+
+    def _resync(self, subscription: Subscription):
+        """Replaces pending events with a snapshot. Lock held."""
+        while not subscription.queue.empty():
+            subscription.queue.get_nowait()
+        subscription.resync = False
+        subscription.queue.put_nowait(_format_event('snapshot', self._version, self._state))
+
+    def subscribe(self) -> Optional[Subscription]:
+        """Returns a new subscription, or None if 'max_subscribers' are subscribed."""
+        subscription = Subscription()
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            self._resync(subscription)
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def next_event(self, subscription: Subscription, heartbeat: float = HEARTBEAT) -> str:
+        """Waits for the next event of the subscription, or a keep-alive comment."""
+        if subscription.resync:
+            with self._lock:
+                self._resync(subscription)
+        try:
+            return subscription.queue.get(timeout=heartbeat)
+        except queue.Empty:
+            return ': keep-alive\n\n'
+
+    def stream(self, heartbeat: float = HEARTBEAT) -> Optional[Stream]:
+        """Returns a new stream of events, or None if too many streams are open."""
+        subscription = self.subscribe()
+        if subscription is None:
+            return None
+        return Stream(self, subscription, heartbeat)
+
+
+broadcaster = Broadcaster()
@@ -27,12 +27,24 @@ SOFTWARE.
 import time
 
 from .utils import Process
+from .messages import MessageLog, CountsLogMessage
+from .epoch_trace import epoch_trace
+from .metrics import registry
+from .history import history
 from .qkd_globals import logger, PipesQKD, FoldersQKD, config_file
 
+epochs_total = registry.counter(
+    'qkd_epochs_total', 'Epochs reported by chopper/chopper2.', ('process',))
+detector_counts_total = registry.counter(
+    'qkd_detector_counts_total', 'Detector events, from the chopper/chopper2 logs.',
+    ('process', 'detector'))
+counts_history = history.table('counts', ('total', 'd1', 'd2', 'd3', 'd4'))
+
 class Chopper(Process):
 
     def __init__(self, program):
         super().__init__(program)
+        self.t2log = MessageLog(CountsLogMessage)
         self._reset()
 
     def _reset(self):
@@ -85,14 +97,18 @@ class Chopper(Process):
         Watches t2logpipe for new epoch files and writes the epoch name into the transferd cmdpipe.
         Transferd copies the corresponding epoch file to the partnering computer.
         """
-        # message = pipe.readline().decode().rstrip('\n').lstrip('\x00')
-        message = pipe.readline().rstrip('\n').lstrip('\x00')
-        if len(message) == 0:
+        message = self.t2log.readline(pipe)
+        if message is None:
             return
-        
-        self._latest_message_time = time.time()
-        epoch = message.split()[0]
-        self._det_counts = list(map(int,message.split()[1:6]))
+
+        self._latest_message_time = message.time
+        epoch = message.epoch
+        epoch_trace.stamp('chopper', epoch, message.time)
+        self._det_counts = message.det_counts
+        epochs_total.labels('chopper').inc()
+        for detector, counts in enumerate(message.det_counts[1:], 1):
+            detector_counts_total.labels('chopper', detector).inc(counts)
+        counts_history.append(*message.det_counts, timestamp=message.time)
         self._monitor_counts()
         Process.write(PipesQKD.CMD, epoch)
         logger.debug(f'Msg: {message}')
@@ -30,12 +30,24 @@ SOFTWARE.
 import time
 
 from .utils import Process
+from .messages import MessageLog, CountsLogMessage
+from .epoch_trace import epoch_trace
+from .metrics import registry
+from .history import history
 from .qkd_globals import logger, PipesQKD, FoldersQKD, config_file
 
+epochs_total = registry.counter(
+    'qkd_epochs_total', 'Epochs reported by chopper/chopper2.', ('process',))
+detector_counts_total = registry.counter(
+    'qkd_detector_counts_total', 'Detector events, from the chopper/chopper2 logs.',
+    ('process', 'detector'))
+counts_history = history.table('counts', ('total', 'd1', 'd2', 'd3', 'd4'))
+
 class Chopper2(Process):
 
     def __init__(self, program):
         super().__init__(program)
+        self.t1log = MessageLog(CountsLogMessage)
         self._reset()
     
     def _reset(self):
@@ -70,7 +82,7 @@ class Chopper2(Process):
             '-4', # Force four detector option
         ]
         super().start(args, stderr="chopper2error", callback_restart=callback_restart)
-        self.read(PipesQKD.T1LOG, self.digest_t1logpipe, wait=0.1, name="T1LOGPIPE", persist=True)
+        self.read(PipesQKD.T1LOG, self.digest_t1logpipe, name="T1LOGPIPE", persist=True)
         logger.info('Started chopper2.')
         super().start_thread_method(self._no_message_monitor)
 
@@ -80,18 +92,22 @@ class Chopper2(Process):
         Chopper2 runs on the high-count side.
         Also counts the number of epochs recorded by chopper2.
         """
-        # message = pipe.readline().decode().rstrip('\n').lstrip('\x00')
-        message = pipe.readline().rstrip('\n').lstrip('\x00')
-        if len(message) == 0:
+        message = self.t1log.readline(pipe)
+        if message is None:
             return
-        
-        self._latest_message_time = time.time()
+
+        self._latest_message_time = message.time
+        epoch_trace.stamp('chopper2', message.epoch, message.time)
         logger.debug(f'[read msg] {message}')
         if self._t1_epoch_count == 0:
-            self._first_epoch = message.split()[0]
+            self._first_epoch = message.epoch
             logger.info(f'First_epoch: {self._first_epoch}')
         self._t1_epoch_count += 1
-        self._det_counts = list(map(int,message.split()[1:6]))
+        self._det_counts = message.det_counts
+        epochs_total.labels('chopper2').inc()
+        for detector, counts in enumerate(message.det_counts[1:], 1):
+            detector_counts_total.labels('chopper2', detector).inc(counts)
+        counts_history.append(*message.det_counts, timestamp=message.time)
         self._monitor_counts()
 
     @property
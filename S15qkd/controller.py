@@ -31,6 +31,9 @@ SOFTWARE.
 # using Werkzeug hot reloader.
 
 # Built-in/Generic Imports
+import functools
+import json
+import os
 import pathlib
 import sys
 import threading
@@ -46,8 +49,14 @@ from .costream import Costream
 from .splicer import Splicer
 from .readevents import Readevents
 from .pfind import Pfind
-from .utils import Process, read_T2_header, HeadT2, get_current_epoch, epoch_after
+from .utils import Process, read_T2_header, HeadT2, get_current_epoch, epoch_after, apply_scheduling, \
+    requires_sys_nice, has_sys_nice
 from .error_correction import ErrorCorr
+from .epoch_catalog import EpochCatalog
+from .epoch_trace import epoch_trace
+from .metrics import registry
+from .history import history
+from .broadcast import broadcaster
 from .polarization_compensation import PolComp
 from S15qkd.modules.polcomp.paddles.paddlepolcomp import PaddlePolComp
 
@@ -55,6 +64,12 @@ from S15qkd.modules.polcomp.paddles.paddlepolcomp import PaddlePolComp
 from . import qkd_globals
 from .qkd_globals import logger, QKDProtocol, QKDEngineState, FoldersQKD, det_info
 
+# Remote and local epochs required by costream on the high count side
+EPOCH_PAIR_FOLDERS = (FoldersQKD.RECEIVEFILES, FoldersQKD.T1FILES)
+
+pfind_history = history.table(
+    'pfind', ('time_diff', 'freq_diff', 'sig_long', 'sig_short'), capacity=1 << 12)
+
 # TODO(Justin): Rename 'program_root' in config.
 
 class Controller:
@@ -76,18 +91,28 @@ class Controller:
         Process.load_config()
         dir_qcrypto = pathlib.Path(Process.config.program_root)
 
-        # TODO:
-        #   Short-term: Add 'S15qkd' directory to configuration and call authd.py
-        #     relative to imported directory, just like 'dir_qcrypto' above.
-        #   Long-term: Subclass 'authd' as a Process, to use the same logging
-        #     mechanisms.
-        self.authd = Process("python3 /root/code/QKDServer/S15qkd/authd.py")
+        # Scheduling of the controller, inherited by threads and programs started later
+        apply_scheduling(os.getpid(), Process.scheduling_config('controller'), 'controller', all_threads=True)
+
+        # TODO: Subclass 'authd' as a Process, to use the same logging mechanisms.
+        self.authd = Process(f"python3 {pathlib.Path(__file__).parent / 'authd.py'}")
 
-        # Raise readevents process priority if capability added
-        readevents_prog = dir_qcrypto / 'readevents'
+        # Raise readevents process priority if capability added,
+        # unless configured otherwise in 'ENVIRONMENT.scheduling.readevents'
+        self.readevents = Readevents(dir_qcrypto / 'readevents')
         if Process.config.ENVIRONMENT.raise_readevents_priority:
-            readevents_prog = f"nice --adjustment=-10 {readevents_prog}"
-        self.readevents = Readevents(readevents_prog)
+            self.readevents.default_scheduling = {'nice': -10}
+
+        # Raised priorities need '--cap-add=SYS_NICE', added by the Makefile
+        # from 'raise_readevents_priority' and 'ENVIRONMENT.scheduling'
+        scheduling = getattr(Process.config.ENVIRONMENT, 'scheduling', None)
+        settings = {name: Process.scheduling_config(name) for name in vars(scheduling or SimpleNamespace())}
+        settings['readevents'] = {**self.readevents.default_scheduling, **settings.get('readevents', {})}
+        privileged = [name for name, s in settings.items() if requires_sys_nice(s)]
+        if privileged and not has_sys_nice():
+            logger.error(f'Raised scheduling priority configured for {", ".join(privileged)}, '
+                         'but CAP_SYS_NICE is missing: settings will not apply.')
+
         self.transferd = Transferd(dir_qcrypto / 'transferd')
         self.chopper = Chopper(dir_qcrypto / 'chopper')
         self.chopper2 = Chopper2(dir_qcrypto / 'chopper2')
@@ -99,8 +124,24 @@ class Controller:
             self.pfind = Pfind(dir_qcrypto / 'pfind')
         self.errc = ErrorCorr(dir_qcrypto / 'errcd')
 
+        # Process states are served from the supervisor snapshot
+        Process.supervisor.interval = getattr(Process.config, 'process_stats_interval', 2)
+        Process.supervisor.add_callback(self._on_process_states)
+        for name, process in (
+                ('transferd', self.transferd),
+                ('readevents', self.readevents),
+                ('chopper', self.chopper),
+                ('chopper2', self.chopper2),
+                ('costream', self.costream),
+                ('splicer', self.splicer),
+                ('error_correction', self.errc),
+            ):
+            Process.supervisor.track(name, process)
+
         self._clean_orphaned_qcrypto()
         self._initialize_pipes()  # cryptostuff directory needed to allow authd to write to file. Initialize only once to make needed structure and pips.
+        self.epochs = EpochCatalog()
+        self.epochs.start()
         self.restart_authd()
 
         if Process.config.LCR_polarization_compensator_path != "":
@@ -127,6 +168,30 @@ class Controller:
         self._establish_connection()
 
         self._set_symmetry()
+        self._start_status_publisher()
+
+    def _start_status_publisher(self):
+        """Publishes status changes to the viewers subscribed to the broadcaster.
+
+        Status is sampled once per 'status_publish_interval' seconds while there
+        are viewers, independent of their number.
+        """
+        interval = getattr(Process.config, 'status_publish_interval', 1)
+
+        def publisher():
+            while True:
+                time.sleep(interval)
+                if not broadcaster.subscribers:
+                    continue
+                try:
+                    broadcaster.publish('process_state', self.get_process_states())
+                    broadcaster.publish('status_info', self.get_status_info())
+                    broadcaster.publish('errc_info', self.get_error_corr_info())
+                except Exception as e:
+                    logger.error(f'Failed to publish status: {e!r}')
+
+        thread = threading.Thread(target=publisher, name='status_publisher', daemon=True)
+        thread.start()
 
     def stop(self):
         """Stops all processes in response to SIGTERM."""
@@ -140,6 +205,7 @@ class Controller:
         self.splicer.stop()
         self.pfind.stop()
         self.errc.stop()
+        history.flush()
         logger.info("controller successfully terminated.")
         sys.exit(0)
 
@@ -148,9 +214,25 @@ class Controller:
         self._clean_orphaned_qcrypto()
         sys.exit(1)
 
+    @property
+    def authd_stats_file(self):
+        return f"{Process.config.data_root}/authd_stats.json"
+
+    def get_authd_statistics(self):
+        """Returns link statistics last written by authd, or None if unavailable."""
+        try:
+            with open(self.authd_stats_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
     def restart_authd(self):
         config = Process.config
         self.authd.stop()
+        # Relay error correction packets as separate authd channel, instead of via transferd
+        errc_channel = []
+        if getattr(config, "authd_errc_channel", False):
+            errc_channel = ["--ecs", qkd_globals.PipesQKD.ECS, "--ecr", qkd_globals.PipesQKD.ECR]
         self.authd.start([
             "-H", config.target_hostname,
             "-p", config.port_authd,
@@ -158,6 +240,14 @@ class Controller:
             "-r", config.remote_cert,
             "-c", config.local_cert,
             "-k", config.local_key,
+            "--chunk_size", getattr(config, "authd_chunk_size", 65536),
+            "--high_watermark", getattr(config, "authd_high_watermark", 4194304),
+            "--low_watermark", getattr(config, "authd_low_watermark", 1048576),
+            "--control_port", getattr(config, "port_authd_control", config.port_transd + 1),
+            "--compression", getattr(config, "authd_compression", "none"),
+            "--compression_level", getattr(config, "authd_compression_level", 3),
+            "--stats_file", self.authd_stats_file,
+            *errc_channel,
         ],
         stderr="authd.err")
 
@@ -558,7 +648,7 @@ class Controller:
             self.pol_com_walk()
             self.splicer.start(
                 qkd_protocol,
-                lambda msg: self.errc.ec_queue.put(msg),
+                self.errc.queue_epoch,
                 self.send_epoch_notification,
                 self.restart_protocol,
             )
@@ -604,6 +694,7 @@ class Controller:
                 f"Time difference: {self._time_diff}, freq difference: {self._freq_diff} "
                 f"({round(self._freq_diff*1e9)} ppb)"
             )
+            pfind_history.append(self._time_diff, self._freq_diff, self._sig_long, self._sig_short)
             # Try to latch anyway
             if self._freq_diff != 0:
                 self.readevents.update_freqcorr(self._freq_diff)
@@ -663,7 +754,7 @@ class Controller:
             self.chopper.start(qkd_protocol, self.restart_protocol, self.reset_timestamp)
             self.splicer.start(
                 qkd_protocol,
-                lambda msg: self.errc.ec_queue.put(msg),
+                self.errc.queue_epoch,
                 self.send_epoch_notification,
                 self.restart_protocol,
             )
@@ -725,37 +816,41 @@ class Controller:
             logger.debug(f'costream restarted')
 
     def _remote_epoch_arrived(self, epoch: str, timeout: float = 15):
+        """Waits until remote epoch, or a later one, was received by transferd.
+
+        The last epoch received by transferd only increases, unlike the epochs
+        in receivefiles, which are deleted once consumed. Arrivals in the
+        catalog only wake up the check, which is otherwise repeated every epoch
+        in case transferd reports the epoch after it was catalogued.
+        """
+        def arrived():
+            last = self.transferd.last_received_epoch
+            return last is not None and int(last,16) >= int(epoch,16)
+
         end_time = time.time() + timeout
-        while int(self.transferd.last_received_epoch,16) < int(epoch,16):
-            logger.debug(f"remote epoch {epoch} not received yet")
-            time.sleep(qkd_globals.EPOCH_DURATION)
+        while not self.epochs.wait_until(arrived, qkd_globals.EPOCH_DURATION):
             if time.time() > end_time:
                 logger.debug(f"remote epoch {epoch} not received in {timeout} seconds.")
                 raise RuntimeError
         return epoch
 
+    def _remote_epoch_header(self, epoch: str):
+        """Returns T2 header of received epoch, as catalogued on arrival."""
+        record = self.epochs.get(FoldersQKD.RECEIVEFILES, epoch)
+        if record is not None and isinstance(record.header, HeadT2):
+            return record.header
+        return read_T2_header(f'{FoldersQKD.RECEIVEFILES}/{epoch}')
+
     def _epochs_exist(self, epoch: str):
         """Check that epoch exists in both receivedfiles and t1 folders
-        If not wait till it appear
+        If not wait till it appear, otherwise returns the next epoch.
         """
-
-        if (pathlib.Path(FoldersQKD.RECEIVEFILES + '/' + epoch).is_file() and
-                 pathlib.Path(FoldersQKD.T1FILES + '/' + epoch).is_file()):
-            logger.debug(f"Found {epoch} in first try")
+        if self.epochs.wait_for(epoch, EPOCH_PAIR_FOLDERS, timeout=0.5):
+            logger.debug(f"Found {epoch}")
             return epoch
-        else:
-            time.sleep(0.5)
-            if (pathlib.Path(FoldersQKD.RECEIVEFILES + '/' + epoch).is_file() and
-                    pathlib.Path(FoldersQKD.T1FILES + '/' + epoch).is_file()):
-                logger.debug(f"Found {epoch} in second try")
-                return epoch
-            else:
-                epoch = epoch_after(epoch)
-                if (pathlib.Path(FoldersQKD.RECEIVEFILES + '/' + epoch).is_file() and
-                        pathlib.Path(FoldersQKD.T1FILES + '/' + epoch).is_file()):
-                    logger.debug(f"Found {epoch} in last try")
-                    return epoch
-
+        epoch = epoch_after(epoch)
+        if self.epochs.contains(epoch, EPOCH_PAIR_FOLDERS):
+            logger.debug(f"Found next epoch {epoch}")
         return epoch
 
 
@@ -767,10 +862,7 @@ class Controller:
         Performed by high count side.
         """
         epoch = self._remote_epoch_arrived(curr_epoch)
-        file_path = f'{qkd_globals.FoldersQKD.RECEIVEFILES}/{epoch}'
-        logger.debug(f'Filename {file_path}')
-        headt2 = HeadT2(0,0,0,0,0xf,0)
-        headt2 = read_T2_header(file_path)
+        headt2 = self._remote_epoch_header(epoch)
         logger.debug(f'BITS per entry {headt2.base_bits}')
         i = 0
         while headt2.base_bits != 4:
@@ -779,9 +871,7 @@ class Controller:
                 raise RuntimeError
             logger.debug(f'{hex(headt2.epoch)} {headt2.base_bits}')
             epoch = self._remote_epoch_arrived(hex(headt2.epoch+1)[2:])
-            time.sleep(qkd_globals.EPOCH_DURATION)
-            file_path = f'{qkd_globals.FoldersQKD.RECEIVEFILES}/{epoch}'
-            headt2 = read_T2_header(file_path)
+            headt2 = self._remote_epoch_header(epoch)
             i += 1
 
         return epoch
@@ -807,7 +897,7 @@ class Controller:
             self.chopper.start(qkd_protocol, self.restart_protocol, self.reset_timestamp)
             self.splicer.start(
                 qkd_protocol,
-                lambda msg: self.errc.ec_queue.put(msg),
+                self.errc.queue_epoch,
                 self.send_epoch_notification,
                 self.restart_protocol,
             )
@@ -886,10 +976,7 @@ class Controller:
         Performed by high count side.
         """
         epoch = self._remote_epoch_arrived(curr_epoch)
-        file_path = f'{qkd_globals.FoldersQKD.RECEIVEFILES}/{epoch}'
-        logger.debug(f'Filename {file_path}')
-        headt2 = HeadT2(0,0,0,0,0xf,0)
-        headt2 = read_T2_header(file_path)
+        headt2 = self._remote_epoch_header(epoch)
         logger.debug(f'BITS per entry {headt2.base_bits}')
         i = 0
         while headt2.base_bits != 1:
@@ -898,8 +985,7 @@ class Controller:
                 raise RuntimeError
             logger.debug(f'{hex(headt2.epoch)} {headt2.base_bits}')
             epoch = self._remote_epoch_arrived(hex(headt2.epoch+1)[2:])
-            file_path = f'{qkd_globals.FoldersQKD.RECEIVEFILES}/{epoch}'
-            headt2 = read_T2_header(file_path)
+            headt2 = self._remote_epoch_header(epoch)
             i += 1
 
         return epoch
@@ -960,10 +1046,8 @@ class Controller:
         end_time = time.time() + timeout_seconds
 
         while time.time() < end_time:
-            if (pathlib.Path(FoldersQKD.RECEIVEFILES + '/' + epoch).is_file() and
-                pathlib.Path(FoldersQKD.T1FILES + '/' + epoch).is_file()):
+            if self.epochs.wait_for(epoch, EPOCH_PAIR_FOLDERS, timeout=0.5):
                 return epoch, diff_n
-            time.sleep(0.5)
             epoch = epoch_after(epoch)
             diff_n += 1
 
@@ -971,17 +1055,23 @@ class Controller:
         return epoch, diff_n
 
 
-    def get_process_states(self):
-        if not self.transferd.is_running():
+    def _on_process_states(self, snapshot):
+        if not snapshot.states['transferd']:
             self.qkd_engine_state = QKDEngineState.OFF
+
+    def get_process_states(self):
+        """Returns whether each process is running, as of the last supervisor refresh."""
+        return dict(Process.supervisor.snapshot.states)
+
+    def get_process_snapshot(self):
+        """Returns process states with PIDs, CPU and memory usage, and uptime.
+
+        'resources' holds the latest resource accounting sample of processes and
+        pipes, including the flags raised for them.
+        """
         return {
-            'transferd': self.transferd.is_running(),
-            'readevents': self.readevents.is_running(),
-            'chopper': self.chopper.is_running(),
-            'chopper2': self.chopper2.is_running(),
-            'costream': self.costream.is_running(),
-            'splicer': self.splicer.is_running(),
-            'error_correction': self.errc.is_running()
+            **Process.supervisor.snapshot.as_dict(),
+            'resources': Process.supervisor.accounting.report,
         }
 
     def get_status_info(self):
@@ -1011,7 +1101,7 @@ class Controller:
             'pol_dev_info' : pol_info,
             'freq_diff_info' : self.freq_diff if not self.pfind.is_running() else (float(self.freq_diff) + self.pfind.current_freq_diff),
             'local_counts' : local_counts,
-
+            'authd': self.get_authd_statistics(),
         }
 
     def get_error_corr_info(self):
@@ -1025,6 +1115,10 @@ class Controller:
             'key_file_name': self.errc._ec_epoch,
             'total_ec_key_bits': self.errc.total_ec_key_bits,
             'init_QBER': self.errc.init_QBER_info,
+            'dispatch_latency': round(self.errc.ec_dispatch_latency, 4) if self.errc.ec_dispatch_latency is not None else '',
+            'max_inflight_blocks': self.errc.max_inflight_blocks,
+            'inflight_blocks': [b.as_dict() for b in self.errc.ec_inflight_blocks],
+            'completed_blocks': [b.as_dict() for b in self.errc.ec_completed_blocks[-10:]],
         }
 
     @property
@@ -1058,13 +1152,26 @@ Process.load_config()
 controller = Controller()
 controller.identity = Process.config.identity
 
+# Actions on the controller, e.g. from concurrent web requests, run one at a time
+_action_lock = threading.RLock()
+
+def serialized(f):
+    @functools.wraps(f)
+    def helper(*args, **kwargs):
+        with _action_lock:
+            return f(*args, **kwargs)
+    return helper
+
+@serialized
 def start_service_mode():
     """Initiated by QKD controller via the QKD server status page."""
     controller.start_service_mode()  # passthrough
 
+@serialized
 def start_key_generation():
     controller.start_key_generation()
 
+@serialized
 def stop_key_gen():
     """Initiated by QKD controller via the QKD server status page."""
     controller.stop_key_gen()
@@ -1072,6 +1179,7 @@ def stop_key_gen():
     time.sleep(2.5)
     controller.check_alive_threads()
 
+@serialized
 def service_to_BBM92():
     return controller.service_to_BBM92()
 
@@ -1081,18 +1189,44 @@ def get_status_info():
 def get_process_states():
     return controller.get_process_states()
 
+def get_process_snapshot():
+    return controller.get_process_snapshot()
+
 def get_error_corr_info():
     return controller.get_error_corr_info()
 
+def get_epoch_trace(epoch):
+    return epoch_trace.trace(epoch)
+
+def get_epoch_latencies():
+    return epoch_trace.latencies()
+
+def get_metrics():
+    return registry.render()
+
+def get_history(table, **query):
+    return history.query(table, **query)
+
+def get_history_tables():
+    return history.tables()
+
+def stream_status():
+    """Returns a stream of status events, or None if too many are open."""
+    return broadcaster.stream()
+
+@serialized
 def restart_transferd():
     return controller.restart_transferd()
 
+@serialized
 def restart_connection():
     return controller.restart_connection()
 
+@serialized
 def reload_configuration(conn_id):
     return controller.reload_configuration(conn_id)
 
+# Not serialized, so that shutdown is not held up by a running action
 def stop():
     return controller.stop()
 
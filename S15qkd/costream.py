@@ -30,12 +30,26 @@ import pathlib
 import time
 
 from .utils import Process
+from .messages import MessageLog, GenlogMessage
+from .epoch_trace import epoch_trace
+from .metrics import registry
+from .history import history
 from .qkd_globals import logger, QKDProtocol, PipesQKD, FoldersQKD
 
+raw_events_total = registry.counter('qkd_raw_events_total', 'Events received by costream.')
+sent_events_total = registry.counter('qkd_sent_events_total', 'Events sent back by costream.')
+coincidences_total = registry.counter('qkd_coincidences_total', 'Coincidences found by costream.')
+accidentals_total = registry.counter('qkd_accidentals_total', 'Accidental coincidences estimated by costream.')
+pairs_over_accidentals_avg = registry.gauge(
+    'qkd_pairs_over_accidentals', 'Running average of coincidences over accidentals.')
+genlog_history = history.table(
+    'genlog', ('raw_events', 'sent_events', 'coincidences', 'accidentals', 'deltat'))
+
 class Costream(Process):
 
     def __init__(self, process):
         super().__init__(process)
+        self.genlog = MessageLog(GenlogMessage)
         self._reset()  # for initial display on status page
 
     def _reset(self):
@@ -101,30 +115,35 @@ class Costream(Process):
 
     def digest_genlog(self, pipe):
         """Digests the genlog pipe written by costream."""
-        # message = pipe.readline().decode().rstrip('\n').lstrip('\x00')
-        message = pipe.readline().rstrip('\n').lstrip('\x00')
-        if len(message) == 0:
+        message = self.genlog.readline(pipe)
+        if message is None:
             return
 
-        self._latest_message_time = time.time()
+        self._latest_message_time = message.time
+        epoch_trace.stamp('genlog', message.epoch, message.time)
         logger.debug(message)
         self._previous_latest_outepoch = self._latest_outepoch
         self._previous_latest_deltat = self._latest_deltat
-        (
-            self._latest_outepoch,
-            self._latest_rawevents,
-            self._latest_sentevents,
-            self._latest_compress,
-            self._latest_deltat,
-            self._latest_accidentals,
-            self._latest_coincidences,
-            *_,
-         ) = message.split()  # costream_info
+        self._latest_outepoch = message.epoch
+        self._latest_rawevents = message.raw_events
+        self._latest_sentevents = message.sent_events
+        self._latest_compress = message.compress
+        self._latest_deltat = message.deltat
+        self._latest_accidentals = message.accidentals
+        self._latest_coincidences = message.coincidences
+        raw_events_total.inc(message.raw_events)
+        sent_events_total.inc(message.sent_events)
+        coincidences_total.inc(message.coincidences)
+        accidentals_total.inc(message.accidentals)
+        genlog_history.append(
+            message.raw_events, message.sent_events, message.coincidences,
+            message.accidentals, message.deltat, timestamp=message.time)
 
         # restart time difference finder if pairs to accidentals is too low
-        pairs_over_accidentals = int(self._latest_coincidences) / (int(self._latest_accidentals) + 1) #incase of divide by zero
+        pairs_over_accidentals = self._latest_coincidences / (self._latest_accidentals + 1) #incase of divide by zero
         avg_num = 5
         self._pairs_over_accidentals_avg = (self._pairs_over_accidentals_avg * (avg_num - 1) + pairs_over_accidentals) / avg_num
+        pairs_over_accidentals_avg.set(self._pairs_over_accidentals_avg)
         if self._pairs_over_accidentals_avg < 2.5:
             logger.error(
                 f'Pairs to accidental ratio bad: avg(p/a) = {self._pairs_over_accidentals_avg:.2f}'
@@ -137,7 +156,7 @@ class Costream(Process):
             return
 
         if self._callback_notify:
-            self._callback_notify(self._latest_outepoch, int(self._latest_deltat))
+            self._callback_notify(self._latest_outepoch, self._latest_deltat)
 
     def _no_message_monitor(self, stop_event):
         """ Monitor restarts the engine if costream is started and receives no updates in timeout seconds.
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+In-memory catalog of the epoch files in the 'FoldersQKD' directories.
+
+The catalog is fed by inotify, and records for every epoch file its size,
+arrival time and parsed header (T1/T2/T3/T4, identified by the header tag).
+Files are only catalogued once closed after writing, or moved in, so that a
+catalogued file is never partially written. Callers wait on a condition
+instead of polling the file system:
+
+    catalog = EpochCatalog()
+    catalog.start()
+    if catalog.wait_for('b0000000', [FoldersQKD.RECEIVEFILES, FoldersQKD.T1FILES], 1):
+        catalog.get(FoldersQKD.RECEIVEFILES, 'b0000000').header.base_bits
+
+If inotify is not available, the folders are rescanned periodically instead.
+
+Copyright (c) 2020 S-Fifteen Instruments Pte. Ltd.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import collections
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+from typing import Callable, Iterable, NamedTuple, Optional
+
+from .qkd_globals import logger, FoldersQKD
+from .streams import read_header
+
+CATALOGUED_FOLDERS = (
+    FoldersQKD.SENDFILES,
+    FoldersQKD.RECEIVEFILES,
+    FoldersQKD.T1FILES,
+    FoldersQKD.T3FILES,
+    FoldersQKD.RAWKEYS,
+)
+MAX_RECORDS = 4096  # per folder, oldest arrivals are dropped first
+POLL_INTERVAL = 0.1  # seconds, only if inotify is unavailable
+
+# See 'man 7 inotify'
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CLOSE_WRITE = 0x00000008
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_DELETE_SELF
+INOTIFY_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len, followed by name
+
+
+class EpochRecord(NamedTuple):
+    epoch: str          # file name, i.e. epoch in hex
+    folder: str
+    size: int           # bytes
+    arrival_time: float  # seconds since epoch
+    header: Optional[NamedTuple]  # None if unrecognized
+
+
+def is_epoch(name: str) -> bool:
+    try:
+        int(name, 16)
+    except ValueError:
+        return False
+    return True
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch  # raises if unavailable
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class EpochCatalog:
+    """Tracks epoch files in a set of folders, see module docstring.
+
+    All methods are thread-safe. The catalog is updated by a single daemon
+    thread, and waiting callers are woken on every change.
+    """
+
+    def __init__(self, folders: Iterable[str] = CATALOGUED_FOLDERS):
+        self.folders = [str(folder) for folder in folders]
+        self._records = {folder: collections.OrderedDict() for folder in self.folders}
+        self._changed = threading.Condition()
+        self._thread = None
+        self._stop = threading.Event()
+        self._wakeup = None
+        self._fd = None
+        self._watches = {}  # watch descriptor -> folder
+        self.num_events = 0
+
+    # Catalog updates
+
+    def _add(self, folder: str, epoch: str):
+        if not is_epoch(epoch):
+            return  # e.g. temporary files
+        file_name = f'{folder}/{epoch}'
+        try:
+            size = os.stat(file_name).st_size
+            header = read_header(file_name)
+        except OSError:
+            return  # removed in the meantime
+        record = EpochRecord(epoch, folder, size, time.time(), header)
+        with self._changed:
+            records = self._records[folder]
+            records.pop(epoch, None)
+            records[epoch] = record
+            while len(records) > MAX_RECORDS:
+                records.popitem(last=False)
+            self._changed.notify_all()
+
+    def _remove(self, folder: str, epoch: str):
+        with self._changed:
+            self._records[folder].pop(epoch, None)
+            self._changed.notify_all()
+
+    def _scan(self, folder: str):
+        """Synchronizes catalog of folder with its contents."""
+        try:
+            names = set(os.listdir(folder))
+        except OSError:
+            names = set()
+        with self._changed:
+            known = set(self._records[folder])
+        for epoch in known - names:
+            self._remove(folder, epoch)
+        for epoch in sorted(names - known):
+            self._add(folder, epoch)
+
+    # Queries
+
+    def get(self, folder: str, epoch: str) -> Optional[EpochRecord]:
+        with self._changed:
+            return self._records[str(folder)].get(epoch)
+
+    def contains(self, epoch: str, folders: Iterable[str]) -> bool:
+        with self._changed:
+            return all(epoch in self._records[str(folder)] for folder in folders)
+
+    def latest(self, folder: str) -> Optional[EpochRecord]:
+        """Returns the record with the highest epoch in folder."""
+        with self._changed:
+            records = self._records[str(folder)]
+            if not records:
+                return None
+            return records[max(records, key=lambda e: int(e, 16))]
+
+    def epochs(self, folder: str) -> list:
+        """Returns catalogued epochs of folder, in order of arrival."""
+        with self._changed:
+            return list(self._records[str(folder)])
+
+    def wait_until(self, predicate: Callable[[], bool], timeout: Optional[float] = None) -> bool:
+        """Blocks until 'predicate()' holds, re-evaluated on catalog changes.
+
+        The predicate is called with the catalog lock held, and may use the
+        query methods above. Returns False if 'timeout' seconds elapsed.
+        """
+        with self._changed:
+            return self._changed.wait_for(predicate, timeout)
+
+    def wait_for(self, epoch: str, folders: Iterable[str], timeout: Optional[float] = None) -> bool:
+        """Blocks until epoch is present in all folders, see 'wait_until'."""
+        folders = list(folders)
+        return self.wait_until(lambda: self.contains(epoch, folders), timeout)
+
+    # Watching
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        libc = _load_libc()
+        if libc is not None:
+            self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if self._fd < 0:
+                logger.warning(f'inotify unavailable: {os.strerror(ctypes.get_errno())}')
+                self._fd = None
+        if self._fd is not None:
+            self._watches.clear()
+            for folder in self.folders:
+                wd = libc.inotify_add_watch(self._fd, folder.encode(), WATCH_MASK)
+                if wd < 0:
+                    logger.warning(f'Failed to watch {folder}: {os.strerror(ctypes.get_errno())}')
+                    continue
+                self._watches[wd] = folder
+            self._wakeup = os.pipe()
+            target = self._watch
+        else:
+            logger.warning(f'Polling epoch folders every {POLL_INTERVAL}s instead.')
+            target = self._poll
+        # Scan after adding watches, so that no file falls in between
+        for folder in self.folders:
+            self._scan(folder)
+        self._thread = threading.Thread(target=target, name='epoch_catalog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._wakeup is not None:
+            os.write(self._wakeup[1], b'\0')
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for fd in (self._fd, *(self._wakeup or ())):
+            if fd is not None:
+                os.close(fd)
+        self._fd = self._wakeup = None
+
+    def _poll(self):
+        while not self._stop.wait(POLL_INTERVAL):
+            for folder in self.folders:
+                self._scan(folder)
+
+    def _watch(self):
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self._fd, self._wakeup[0]], [], [])
+            if self._fd not in readable:
+                continue
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                continue
+            self._digest_events(data)
+
+    def _digest_events(self, data: bytes):
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            name = data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length]
+            offset += INOTIFY_EVENT.size + length
+            self.num_events += 1
+            if mask & IN_Q_OVERFLOW:
+                logger.warning('inotify queue overflow, rescanning epoch folders.')
+                for folder in self.folders:
+                    self._scan(folder)
+                continue
+            folder = self._watches.get(wd)
+            if folder is None:
+                continue
+            if mask & (IN_DELETE_SELF | IN_IGNORED):
+                logger.warning(f'{folder} removed, no longer catalogued.')
+                del self._watches[wd]
+                self._scan(folder)
+                continue
+            epoch = name.rstrip(b'\0').decode(errors='replace')
+            if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                self._add(folder, epoch)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self._remove(folder, epoch)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+In-memory trace of the time each epoch passes the stages of the pipeline.
+
+The digest callbacks that already see every epoch stamp it with the time of
+the corresponding message:
+
+    chopper      T2LOG, local epoch chopped and sent (low count side)
+    chopper2     T1LOG, local epoch chopped (high count side)
+    transferd    TRANSFERLOG, remote epoch received
+    genlog       splicer/costream genlog, raw key epoch generated
+    ec_queue     raw key epoch queued for error correction
+    ec_dispatch  block containing the epoch sent to errcd via ECCMD
+    ec_complete  ecnote received for the block containing the epoch
+
+Stamps are stored in fixed-size arrays per stage, in the slot given by the
+epoch modulo 'capacity', so the most recent 'capacity' epochs are retained
+without eviction bookkeeping. Each stage is stamped from a single thread
+(the pipe reactor digests each pipe sequentially, and error correction
+dispatches from its own thread), so stamps are written without locks.
+Readers may observe a slot while it is overwritten, in which case the stage
+is reported as missing for that epoch.
+
+Usage:
+    epoch_trace.stamp('chopper', 'b0000000')
+    epoch_trace.trace('b0000000')  # {'chopper': 1700000000.0, ...}
+    epoch_trace.latencies()  # percentiles of time spent before each stage
+
+Copyright (c) 2020 S-Fifteen Instruments Pte. Ltd.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import time
+from typing import Dict, Optional
+
+import numpy as np
+
+STAGES = ('chopper', 'chopper2', 'transferd', 'genlog', 'ec_queue', 'ec_dispatch', 'ec_complete')
+CAPACITY = 4096  # epochs, i.e. about 36 minutes
+PERCENTILES = (50, 90, 99)
+NO_EPOCH = -1
+
+
+class EpochTrace:
+    """Stage timestamps of recent epochs, see module docstring."""
+
+    def __init__(self, capacity: int = CAPACITY):
+        self.capacity = capacity
+        self.clear()
+
+    def clear(self):
+        self._epochs = np.full((len(STAGES), self.capacity), NO_EPOCH, dtype=np.int64)
+        self._times = np.zeros((len(STAGES), self.capacity), dtype=np.float64)
+
+    def stamp(self, stage: str, epoch: str, timestamp: Optional[float] = None):
+        """Records that 'epoch' (in hex) passed 'stage' at 'timestamp', default now."""
+        self.stamp_block(stage, epoch, 1, timestamp)
+
+    def stamp_block(self, stage: str, first_epoch: str, num_epochs: int,
+                    timestamp: Optional[float] = None):
+        """Records 'num_epochs' consecutive epochs passing 'stage' together."""
+        if timestamp is None:
+            timestamp = time.time()
+        try:
+            first = int(first_epoch, 16)
+        except (TypeError, ValueError):
+            return  # not an epoch, e.g. malformed pipe message
+        row = STAGES.index(stage)
+        epochs = np.arange(first, first + max(int(num_epochs), 1))
+        slots = epochs % self.capacity
+        # Slots are invalidated while the time is written, so that readers
+        # comparing the epoch before and after reading the time never pair
+        # an epoch with the time of another, see '_read()'.
+        self._epochs[row, slots] = NO_EPOCH
+        self._times[row, slots] = timestamp
+        self._epochs[row, slots] = epochs
+
+    def _read(self, slots=slice(None)):
+        """Returns (epochs, times) of the slots, NO_EPOCH where written concurrently."""
+        epochs = self._epochs[:, slots].copy()
+        times = self._times[:, slots].copy()
+        epochs[epochs != self._epochs[:, slots]] = NO_EPOCH
+        return epochs, times
+
+    def trace(self, epoch: str) -> Dict[str, float]:
+        """Returns the timestamps of the stages 'epoch' (in hex) has passed."""
+        epoch = int(epoch, 16)
+        epochs, times = self._read(epoch % self.capacity)
+        matches = epochs == epoch
+        return {stage: float(t) for stage, t, m in zip(STAGES, times, matches) if m}
+
+    def _aligned(self) -> np.ndarray:
+        """Returns (capacity, stages) times of the latest epoch in each slot, NaN if missing."""
+        epochs, times = self._read()
+        epochs, times = epochs.T, times.T
+        latest = epochs.max(axis=1, keepdims=True)
+        times[(epochs != latest) | (epochs == NO_EPOCH)] = np.nan
+        return times
+
+    def latencies(self, percentiles=PERCENTILES) -> Dict[str, dict]:
+        """Returns statistics of the time spent before each stage, in seconds.
+
+        The latency of a stage is measured from the preceding stage the epoch
+        passed, since not every epoch passes every stage on a given side.
+        'total' is the time from the first to the last stage passed.
+        """
+        times = self._aligned()
+        previous = np.full(len(times), np.nan)
+        result = {}
+        for column, stage in enumerate(STAGES):
+            result[stage] = _statistics(times[:, column] - previous, percentiles)
+            previous = np.where(np.isnan(times[:, column]), previous, times[:, column])
+        first = np.where(np.isnan(times), np.inf, times).min(axis=1)
+        result['total'] = _statistics(previous - first, percentiles)
+        return result
+
+
+def _statistics(latencies: np.ndarray, percentiles) -> dict:
+    latencies = latencies[np.isfinite(latencies)]
+    stats = {'count': len(latencies)}
+    if len(latencies) == 0:
+        return stats
+    values = np.percentile(latencies, percentiles)
+    stats.update({f'p{p}': float(v) for p, v in zip(percentiles, values)})
+    stats['max'] = float(latencies.max())
+    return stats
+
+
+epoch_trace = EpochTrace()
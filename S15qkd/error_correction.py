@@ -44,21 +44,72 @@ import struct
 import time
 import queue
 import collections
+from dataclasses import dataclass, asdict
 from statistics import mean
+from typing import Optional
 
 # from . import qkd_globals, controller
 from .utils import Process, read_T3_header, HeadT3, epoch_after
+from .messages import MessageLog, EcnoteMessage
+from .epoch_trace import epoch_trace
+from .metrics import registry
+from .history import history
 from .qkd_globals import logger, PipesQKD, FoldersQKD, QKDEngineState
+from S15qkd.modules.errc import block_sizing
 
 EPOCH_DURATION = 0.536  # seconds
 
 proc_error_correction = None
 
+# Blocks not reported by errcd within this time no longer count towards
+# the concurrency window, e.g. when errcd silently drops a block ('-T 1').
+BLOCK_TIMEOUT = 120  # seconds
+
+ec_blocks_total = registry.counter('qkd_ec_blocks_total', 'Blocks completed by errcd.')
+ec_raw_bits_total = registry.counter('qkd_ec_raw_bits_total', 'Raw key bits error corrected.')
+ec_final_bits_total = registry.counter('qkd_ec_final_bits_total', 'Final key bits after privacy amplification.')
+ec_qber = registry.gauge('qkd_ec_qber', 'QBER of the last error corrected block.')
+ec_servoed_qber = registry.gauge('qkd_ec_servoed_qber', 'QBER averaged over recent blocks.')
+ec_key_rate = registry.gauge('qkd_ec_key_rate_bps', 'Final key rate of the last block, in bits per second.')
+ec_block_latency = registry.histogram(
+    'qkd_ec_block_latency_seconds', 'Time from dispatch of a block to errcd until its ecnote.',
+    buckets=(1, 2, 5, 10, 20, 30, 60, 120))
+ec_history = history.table(
+    'ec', ('num_epochs', 'raw_bits', 'final_bits', 'qber', 'servoed_qber', 'key_rate'),
+    capacity=1 << 14)  # blocks span several epochs
+
+
+@dataclass
+class ECBlock:
+    """Raw key block dispatched to errcd, keyed by the first epoch of the block."""
+    first_epoch: str
+    num_epochs: int
+    raw_bits: int
+    qber: float  # servoed QBER sent with the block
+    dispatch_time: float  # epoch seconds
+    completion_time: Optional[float] = None
+    final_bits: Optional[int] = None
+    err_fraction: Optional[float] = None
+
+    @property
+    def latency(self) -> Optional[float]:
+        """Time between dispatch and completion of the block, in seconds."""
+        if self.completion_time is None:
+            return None
+        return self.completion_time - self.dispatch_time
+
+    def as_dict(self) -> dict:
+        return {**asdict(self), 'latency': self.latency}
+
+
 class ErrorCorr(Process):
 
     _total_ec_key_bits = None
+    _ec_raw_bits_history = collections.deque(maxlen=100)
     _ec_err_fraction_history = collections.deque(maxlen=100)
     _ec_err_key_length_history = collections.deque(maxlen=100)
+    _ec_dispatch_latency_history = collections.deque(maxlen=100)
+    _ec_completed_blocks = collections.deque(maxlen=100)
 
     @property
     def total_ec_key_bits(self):
@@ -70,6 +121,7 @@ class ErrorCorr(Process):
 
     def __init__(self, process):
         super().__init__(process)
+        self.ecnote = MessageLog(EcnoteMessage)
         self._reset()
         #self.do_errc = Process(self.do_error_correction)
 
@@ -84,17 +136,33 @@ class ErrorCorr(Process):
         self._ec_key_gen_rate = None
         self._ec_nr_of_epochs = None
         self._ec_thread_on = None
+        self._ec_dispatch_latency = None
         self.ec_queue = queue.Queue()
 
+        # Blocks dispatched to errcd, awaiting the corresponding ecnote
+        self._ec_inflight_blocks = collections.OrderedDict()
+        self._ec_blocks_lock = threading.Lock()
+        error_correction = getattr(Process.config.qcrypto, 'error_correction', None)
+        self.max_inflight_blocks = getattr(error_correction, 'max_inflight_blocks', 0)
+
         self._servoed_QBER = Process.config.default_QBER
         self._servo_blocks = Process.config.servo_blocks
         self.QBER_limit = Process.config.QBER_limit
         self.QBER_servo_history = collections.deque(maxlen=self._servo_blocks)
 
+        # Seed block sizing policy with results from previous runs
+        self.block_sizing = block_sizing.from_config(Process.config)
+        for raw_bits, final_bits, err_fraction in zip(
+                type(self)._ec_raw_bits_history,
+                type(self)._ec_err_key_length_history,
+                type(self)._ec_err_fraction_history):
+            self.block_sizing.update(raw_bits, final_bits, err_fraction, self._servoed_QBER)
+
     def empty(self):
         if self.do_ec_thread.is_alive():
             self._ec_thread_on = False
-            time.sleep(EPOCH_DURATION)
+            self.ec_queue.put(None)  # wake thread to observe termination
+            self.do_ec_thread.join(timeout=EPOCH_DURATION)
             self._servoed_QBER = Process.config.default_QBER
         self.do_ec_thread = threading.Thread(target=self.do_error_correction, args=(), daemon=True, name="errcd")
         self._ec_thread_on = True
@@ -154,25 +222,33 @@ class ErrorCorr(Process):
         # To move to class
         # self.do_errc.start_py_thread()
 
+    def queue_epoch(self, epoch: str):
+        """Queues rawkey epoch announced by splicer/costream for error correction.
+
+        The enqueue time is recorded together with the epoch, to track the
+        latency until the epoch is dispatched to errcd.
+        """
+        epoch_trace.stamp('ec_queue', epoch)
+        self.ec_queue.put((epoch, time.monotonic()))
+
     def ecnotepipe_digest(self, pipe):
         '''
         Digests error correction activities indicated by the 'ecnotepipe' pipe.
         This is getting input from the ec_note_pipe which is updated after an error correction run.
         '''
-        message = pipe.readline().rstrip('\n').lstrip('\x00')
-        if len(message) == 0:
+        message = self.ecnote.readline(pipe)
+        if message is None:
             return
 
         # ECNOTE message intercepted to populate results on web interface
-        logger.info(f'[ecnote] {message}')
-        (
-            self._ec_epoch,
-            self._ec_raw_bits,
-            self._ec_final_bits,
-            self._ec_err_fraction,
-            self._ec_nr_of_epochs,
-            *_,
-        ) = message.split()
+        logger.info(f'[ecnote] {message.epoch} {message.raw_bits} {message.final_bits} '
+                    f'{message.err_fraction} {message.num_epochs}')
+        self._ec_epoch = message.epoch
+        self._ec_raw_bits = message.raw_bits
+        self._ec_final_bits = message.final_bits
+        self._ec_err_fraction = message.err_fraction
+        self._ec_nr_of_epochs = message.num_epochs
+        self._complete_block(self._ec_epoch)
 
         if self.ec_final_bits > 0:
             if self.remote_connection_id:
@@ -180,7 +256,7 @@ class ErrorCorr(Process):
             else:
                 notification = self._ec_epoch
             self.write(self._callback_guardian_note, message=notification)
-            with open("/epoch_files/notified", "a+") as file:
+            with open(FoldersQKD.FINALKEYS + "/notified", "a+") as file:
                 file.write(f"{notification}\n")
             logger.info(f'Sent {notification} to notify.pipe.')
 
@@ -191,10 +267,16 @@ class ErrorCorr(Process):
         if not self.total_ec_key_bits:
             self.total_ec_key_bits = 0
         self.total_ec_key_bits += self.ec_final_bits
+        type(self)._ec_raw_bits_history.append(self.ec_raw_bits)
         type(self)._ec_err_fraction_history.append(self.ec_err_fraction)
         type(self)._ec_err_key_length_history.append(self.ec_final_bits)
         self.QBER_servo_history.append(self.ec_err_fraction)
         self._servoed_QBER = mean(self.QBER_servo_history)
+        ec_blocks_total.inc()
+        ec_raw_bits_total.inc(self.ec_raw_bits)
+        ec_final_bits_total.inc(self.ec_final_bits)
+        ec_qber.set(self.ec_err_fraction)
+        ec_key_rate.set(self.ec_key_gen_rate)
         logger.info(f'Rate is {self.ec_key_gen_rate} bps. Servoed QBER is {self.servoed_QBER}.')
         ###
         # servoing QBER
@@ -216,9 +298,17 @@ class ErrorCorr(Process):
                 epoch = self._ec_epoch
             else:
                 # Report the last epoch in the error correction instead (default)
-                epoch = epoch_after(self._ec_epoch, int(self._ec_nr_of_epochs, 10))
+                epoch = epoch_after(self._ec_epoch, self.ec_nr_of_epochs)
             self._callback_pol_comp(qber=self.ec_err_fraction, epoch=epoch)
 
+        ec_servoed_qber.set(self.servoed_QBER)
+        ec_history.append(
+            self.ec_nr_of_epochs, self.ec_raw_bits, self.ec_final_bits,
+            self.ec_err_fraction, self.servoed_QBER, self.ec_key_gen_rate,
+            timestamp=message.time)
+        self.block_sizing.update(self.ec_raw_bits, self.ec_final_bits, self.ec_err_fraction, self.servoed_QBER)
+        logger.debug(f'Block size set to {self.block_sizing.block_size} raw bits.')
+
         try:
             1+1
         except OSError:
@@ -227,6 +317,46 @@ class ErrorCorr(Process):
             logger.error(a)
         logger.info(f'Thread finished')
 
+    def _dispatch_block(self, first_epoch: str, num_epochs: int, raw_bits: int):
+        """Sends block to errcd and records it in the in-flight block table."""
+        qber = float("{0:.4f}".format(self.servoed_QBER))
+        with self._ec_blocks_lock:
+            self._ec_inflight_blocks[first_epoch] = ECBlock(
+                first_epoch, num_epochs, raw_bits, qber, time.time())
+        self.write(PipesQKD.ECCMD, f'0x{first_epoch} {num_epochs} {qber}')
+        epoch_trace.stamp_block('ec_dispatch', first_epoch, num_epochs)
+
+    def _complete_block(self, first_epoch: str):
+        """Matches ecnote completion against the in-flight block table."""
+        epoch_trace.stamp_block('ec_complete', first_epoch, self._ec_nr_of_epochs)
+        with self._ec_blocks_lock:
+            block = self._ec_inflight_blocks.pop(first_epoch, None)
+        if block is None:
+            logger.warning(f'Completed block {first_epoch} was not dispatched by this process.')
+            return
+        block.completion_time = time.time()
+        block.final_bits = self.ec_final_bits
+        block.err_fraction = self.ec_err_fraction
+        type(self)._ec_completed_blocks.append(block)
+        ec_block_latency.observe(block.latency)
+        logger.info(f'Block {first_epoch} completed with latency {block.latency:.2f} s.')
+
+    def _has_free_slot(self) -> bool:
+        """Checks if another block can be dispatched within the concurrency window.
+
+        Blocks exceeding BLOCK_TIMEOUT are assumed lost and are removed.
+        A window size of 0 or less means no limit.
+        """
+        if self.max_inflight_blocks <= 0:
+            return True
+        now = time.time()
+        with self._ec_blocks_lock:
+            for first_epoch, block in list(self._ec_inflight_blocks.items()):
+                if now - block.dispatch_time > BLOCK_TIMEOUT:
+                    logger.warning(f'Block {first_epoch} timed out in errcd, removing from in-flight blocks.')
+                    del self._ec_inflight_blocks[first_epoch]
+            return len(self._ec_inflight_blocks) < self.max_inflight_blocks
+
     def do_error_correction(self):
         '''
         Executes error correction based on the files in the ec_queue.
@@ -239,16 +369,21 @@ class ErrorCorr(Process):
         undigested_raw_bits = 0
         first_epoch = ''
         undigested_epochs = 0
+        undigested_enqueue_times = []
 
 
         while self.is_running() and self._ec_thread_on :
-            # Attempt get from queue (FIFO). If no item is available, sleep a while
-            # and try again.
+            # Block on queue (FIFO) until the next epoch arrives. The timeout only
+            # serves to periodically check for termination, which is otherwise
+            # signalled immediately by a 'None' item, see 'empty()'.
             try:
-                file_name = self.ec_queue.get_nowait()
+                item = self.ec_queue.get(timeout=EPOCH_DURATION)
             except queue.Empty:
-                time.sleep(EPOCH_DURATION)
                 continue
+            if item is None:
+                self.ec_queue.task_done()
+                continue
+            file_name, enqueue_time = item
 
             logger.debug(f'Attempting to send file_name = {file_name}')
             file_path = f'{FoldersQKD.RAWKEYS}/{file_name}'
@@ -256,26 +391,34 @@ class ErrorCorr(Process):
             headt3 = read_T3_header(file_path)
             if (headt3.bits_per_entry != 1):
                 logger.warning(f'Entry in rawkey consists of more than 1 bit per entry. Discarding epoch')
+                self.ec_queue.task_done()
                 continue
             if undigested_epochs == 0:
                 first_epoch = file_name
                 logger.debug(f'First epoch is {first_epoch}')
             undigested_epochs += 1
             undigested_raw_bits += headt3.length_entry
-            # Execute error correction when enough raw bits are accumulated.
-            # Could be also based on number of epochs.
-            if undigested_raw_bits > Process.config.minimal_block_size:
-                if undigested_epochs % 2 == 1 : # Take odd number of epochs
+            undigested_enqueue_times.append(enqueue_time)
+            # Execute error correction when enough raw bits are accumulated,
+            # as decided by the block sizing policy. Epochs keep accumulating
+            # while errcd has 'max_inflight_blocks' blocks outstanding.
+            if self.block_sizing.should_dispatch(undigested_raw_bits, undigested_epochs) \
+                    and self._has_free_slot():
                 # notify the error correction process about the first epoch, number of epochs, and the servoed QBER
-                    self.write(
-                        PipesQKD.ECCMD, f'0x{first_epoch} {undigested_epochs} {float("{0:.4f}".format(self.servoed_QBER))}')
-                    logger.info(
-                        f'Started error correction for {undigested_epochs} epochs starting with epoch {first_epoch}.')
-                    self._first_epoch_info = first_epoch
-                    self._undigested_epochs_info = undigested_epochs
-                    self._init_QBER_info = self.servoed_QBER
-                    undigested_raw_bits = 0
-                    undigested_epochs = 0
+                self._dispatch_block(first_epoch, undigested_epochs, undigested_raw_bits)
+                dispatch_time = time.monotonic()
+                type(self)._ec_dispatch_latency_history.extend(
+                    dispatch_time - t for t in undigested_enqueue_times)
+                self._ec_dispatch_latency = dispatch_time - enqueue_time
+                logger.info(
+                    f'Started error correction for {undigested_epochs} epochs starting with epoch {first_epoch}. '
+                    f'Dispatch latency: {self._ec_dispatch_latency*1e3:.1f} ms.')
+                self._first_epoch_info = first_epoch
+                self._undigested_epochs_info = undigested_epochs
+                self._init_QBER_info = self.servoed_QBER
+                undigested_raw_bits = 0
+                undigested_epochs = 0
+                undigested_enqueue_times = []
             else:
                 logger.debug(
                     f'Undigested raw bits:{undigested_raw_bits}. Undigested epochs: {undigested_epochs}.')
@@ -304,6 +447,27 @@ class ErrorCorr(Process):
     def ec_err_fraction(self):
         return float(self._ec_err_fraction)
 
+    @property
+    def ec_dispatch_latency(self):
+        """Latency between enqueue and dispatch of the epoch completing the last block, in seconds."""
+        return self._ec_dispatch_latency
+
+    @property
+    def ec_dispatch_latency_history(self):
+        """Enqueue-to-dispatch latencies of recently dispatched epochs, in seconds."""
+        return list(type(self)._ec_dispatch_latency_history)
+
+    @property
+    def ec_inflight_blocks(self):
+        """Blocks dispatched to errcd which have not completed, oldest first."""
+        with self._ec_blocks_lock:
+            return list(self._ec_inflight_blocks.values())
+
+    @property
+    def ec_completed_blocks(self):
+        """Recently completed blocks, oldest first."""
+        return list(type(self)._ec_completed_blocks)
+
     @property
     def servoed_QBER(self):
         return self._servoed_QBER
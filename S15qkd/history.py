@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Append-only time-series history of the status and error correction values.
+
+Each table, e.g. 'counts' or 'ec', holds rows of a timestamp and a fixed
+set of columns, appended by the process that digests the corresponding
+pipe. Recent rows are kept in memory in a NumPy ring buffer of up to
+'capacity' rows per table, sized to the rate of the table, and grown as
+rows are appended, so that tables cost no memory before data exists.
+Every 'spill_rows' rows, the new rows are appended to a compressed file per
+table and UTC day, '<directory>/<table>/<YYYY-MM-DD>.gz'. Each spill is
+written as a separate gzip member of float64 rows, so files are only ever
+appended to, and a member truncated by a crash is dropped on reading.
+
+Range queries read the in-memory rows, and the daily files for older rows,
+and downsample by averaging into at most 'max_points' time bins, so that
+a day of history is returned in a single request.
+
+Usage:
+    ec = history.table('ec', ('raw_bits', 'final_bits', 'qber'), capacity=1 << 14)
+    ec.append(50000, 12000, 0.04)
+    history.query('ec', start=time.time() - 86400)
+    # {'time': [...], 'raw_bits': [...], 'final_bits': [...], 'qber': [...]}
+
+Copyright (c) 2020 S-Fifteen Instruments Pte. Ltd.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import datetime
+import gzip
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from .qkd_globals import logger, history_root
+
+CAPACITY = 1 << 18  # default rows per table in memory, about 39 hours of epochs
+INITIAL_ROWS = 1024  # rows allocated on first append, doubled when full
+SPILL_ROWS = 256  # rows per gzip member, about 2 minutes of epochs
+MAX_POINTS = 1000  # points per column returned by a range query
+DAY = 86400  # seconds
+
+
+def _day(timestamp: float) -> str:
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime('%Y-%m-%d')
+
+
+def _read_members(data: bytes) -> bytes:
+    """Decompresses concatenated gzip members, up to a truncated one."""
+    chunks = []
+    while data:
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        try:
+            chunk = decompressor.decompress(data)
+        except zlib.error:
+            break
+        if not decompressor.eof:
+            break
+        chunks.append(chunk)
+        data = decompressor.unused_data
+    return b''.join(chunks)
+
+
+def downsample(rows: np.ndarray, start: float, end: float, max_points: int) -> np.ndarray:
+    """Averages (columns, n) 'rows' into at most 'max_points' time bins.
+
+    Row 0 holds the timestamps. Missing (NaN) values are ignored, and
+    empty bins are omitted.
+    """
+    if rows.shape[1] <= max_points or end <= start:
+        return rows
+    index = ((rows[0] - start) * (max_points / (end - start))).astype(np.int64)
+    np.clip(index, 0, max_points - 1, out=index)
+    valid = ~np.isnan(rows)
+    counts = np.stack([np.bincount(index, weights=v, minlength=max_points) for v in valid])
+    sums = np.stack([
+        np.bincount(index, weights=np.where(v, column, 0), minlength=max_points)
+        for v, column in zip(valid, rows)
+    ])
+    filled = counts[0] > 0
+    with np.errstate(invalid='ignore'):
+        return sums[:, filled] / counts[:, filled]
+
+
+class Table:
+    """Rows of a timestamp and fixed columns, see module docstring."""
+
+    def __init__(self, name: str, columns: Sequence[str], directory: Optional[str],
+                 capacity: int = CAPACITY, spill_rows: int = SPILL_ROWS):
+        self.name = name
+        self.columns = tuple(columns)
+        self.directory = Path(directory, name) if directory else None
+        self.capacity = capacity
+        self.spill_rows = spill_rows
+        self._data = np.empty((1 + len(self.columns), 0))  # row 0 is time, see '_reserve()'
+        self._count = 0  # rows appended
+        self._spilled = 0  # rows handed to the daily files
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()  # keeps members in order
+
+    def append(self, *values, timestamp: Optional[float] = None):
+        """Appends a row of 'values', in the order of 'columns'."""
+        if len(values) != len(self.columns):
+            raise ValueError(f"Table '{self.name}' expects {self.columns}, got {values}.")
+        if timestamp is None:
+            timestamp = time.time()
+        row = [timestamp] + [np.nan if v is None or v == '' else v for v in values]
+        with self._lock:
+            self._reserve()
+            self._data[:, self._count % self.capacity] = row
+            self._count += 1
+            spill = self._count - self._spilled >= self.spill_rows
+        if spill:
+            self.flush()
+
+    def _reserve(self):
+        """Grows the buffer if full, until it holds 'capacity' rows. Lock held.
+
+        Rows only wrap around once the buffer is at capacity, so the rows
+        appended so far keep their slots.
+        """
+        allocated = self._data.shape[1]
+        if self._count < allocated or allocated == self.capacity:
+            return
+        size = min(max(2 * allocated, INITIAL_ROWS), self.capacity)
+        data = np.full((self._data.shape[0], size), np.nan)
+        data[:, :allocated] = self._data
+        self._data = data
+
+    def _memory_rows(self, first: int, last: int) -> np.ndarray:
+        """Returns rows with indices [first, last), which must be in memory. Lock held."""
+        slots = np.arange(first, last) % self.capacity
+        return self._data[:, slots]
+
+    def flush(self):
+        """Appends rows not yet spilled to the daily files."""
+        if self.directory is None:
+            return
+        with self._spill_lock:
+            with self._lock:
+                first = max(self._spilled, self._count - self.capacity)
+                rows = self._memory_rows(first, self._count)
+                self._spilled = self._count
+            if rows.shape[1] == 0:
+                return
+            days = np.array([_day(t) for t in rows[0]])
+            try:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                for day in np.unique(days):
+                    data = np.ascontiguousarray(rows[:, days == day].T).tobytes()
+                    with open(self.directory / f'{day}.gz', 'ab') as f:
+                        f.write(gzip.compress(data))
+            except OSError as e:
+                logger.error(f"Failed to spill history table '{self.name}': {e}")
+
+    def _disk_rows(self, start: float, end: float) -> np.ndarray:
+        """Returns rows in the daily files between 'start' and 'end'."""
+        parts = []
+        if self.directory is not None and start <= end:
+            day = start - start % DAY
+            while day <= end:
+                path = self.directory / f'{_day(day)}.gz'
+                day += DAY
+                try:
+                    data = _read_members(path.read_bytes())
+                except OSError:
+                    continue
+                row_size = 8 * (1 + len(self.columns))
+                usable = len(data) - len(data) % row_size
+                parts.append(np.frombuffer(data[:usable], dtype=np.float64)
+                             .reshape(-1, 1 + len(self.columns)).T)
+        if not parts:
+            return np.empty((1 + len(self.columns), 0))
+        rows = np.concatenate(parts, axis=1)
+        return rows[:, (rows[0] >= start) & (rows[0] <= end)]
+
+    def query(self, start: Optional[float] = None, end: Optional[float] = None,
+              max_points: int = MAX_POINTS) -> Dict[str, list]:
+        """Returns the rows between 'start' and 'end', downsampled, by column.
+
+        'start' defaults to one day before 'end', which defaults to now.
+        """
+        end = time.time() if end is None else end
+        start = end - DAY if start is None else start
+        with self._lock:
+            memory = self._memory_rows(max(0, self._count - self.capacity), self._count)
+        oldest = memory[0, 0] if memory.shape[1] else np.inf
+        rows = memory[:, (memory[0] >= start) & (memory[0] <= end)]
+        if start < oldest:
+            disk = self._disk_rows(start, min(end, oldest))
+            rows = np.concatenate([disk[:, disk[0] < oldest], rows], axis=1)
+        rows = downsample(rows, start, end, max_points)
+        # NaN is not valid JSON
+        rows = np.where(np.isnan(rows), None, rows)
+        return dict(zip(('time',) + self.columns, rows.tolist()))
+
+
+class HistoryStore:
+    """Tables by name. Without a directory, history is kept in memory only."""
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory
+        self._tables: Dict[str, Table] = {}
+        self._lock = threading.Lock()
+
+    def table(self, name: str, columns: Sequence[str], capacity: int = CAPACITY) -> Table:
+        """Returns table 'name', created on first use with up to 'capacity' rows in memory."""
+        with self._lock:
+            table = self._tables.get(name)
+            if table is None:
+                table = self._tables[name] = Table(name, columns, self.directory, capacity)
+            elif table.columns != tuple(columns):
+                raise ValueError(f"Table '{name}' already has columns {table.columns}.")
+            return table
+
+    def tables(self) -> Dict[str, tuple]:
+        with self._lock:
+            return {name: table.columns for name, table in self._tables.items()}
+
+    def query(self, name: str, start: Optional[float] = None, end: Optional[float] = None,
+              max_points: int = MAX_POINTS) -> Dict[str, list]:
+        with self._lock:
+            table = self._tables[name]
+        return table.query(start, end, max_points)
+
+    def flush(self):
+        with self._lock:
+            tables = list(self._tables.values())
+        for table in tables:
+            table.flush()
+
+
+history = HistoryStore(history_root)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Typed records for the line-based log pipes written by the qcrypto processes.
+
+Each message type declares its fields via '__slots__' and parses a pipe line
+into a record in a single pass, with the field conversions written out per
+type instead of going through a generic schema interpreter. A 'MessageLog'
+reads records from a pipe and keeps the last few in a ring buffer, so that
+status queries can access the history without re-reading logs.
+
+Usage:
+    genlog = MessageLog(GenlogMessage)
+    record = genlog.readline(pipe)  # None if line is empty or malformed
+    genlog.latest.coincidences
+    genlog.history(10)
+
+Copyright (c) 2020 S-Fifteen Instruments Pte. Ltd.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import collections
+import threading
+import time
+from typing import List, Optional
+
+from .qkd_globals import logger
+
+HISTORY_LENGTH = 100  # records kept per pipe
+
+
+class Message:
+    """Base class for pipe messages.
+
+    Subclasses list their fields in '__slots__' and implement 'parse()',
+    which receives the stripped line split on whitespace. Trailing fields
+    beyond the declared ones are ignored, for forward compatibility with
+    the qcrypto log formats.
+    """
+    __slots__ = ('time',)  # receive time, seconds since epoch
+
+    @classmethod
+    def parse(cls, fields: List[str]):
+        raise NotImplementedError
+
+    @classmethod
+    def fields(cls):
+        return tuple(
+            slot for c in reversed(cls.__mro__)
+            for slot in getattr(c, '__slots__', ())
+        )
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name, None) for name in self.fields()}
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.as_dict() == other.as_dict()
+
+    def __repr__(self):
+        args = ', '.join(f'{k}={v!r}' for k, v in self.as_dict().items())
+        return f'{type(self).__name__}({args})'
+
+
+class EpochMessage(Message):
+    """Epoch name only, e.g. splicer genlog."""
+    __slots__ = ('epoch',)
+
+    @classmethod
+    def parse(cls, fields):
+        record = cls()
+        record.epoch = fields[0]
+        return record
+
+
+class GenlogMessage(Message):
+    """Costream genlog in logging mode 2 ('-G 2')."""
+    __slots__ = (
+        'epoch', 'raw_events', 'sent_events', 'compress',
+        'deltat', 'accidentals', 'coincidences',
+    )
+
+    @classmethod
+    def parse(cls, fields):
+        record = cls()
+        (
+            record.epoch,
+            raw_events, sent_events, compress,
+            deltat, accidentals, coincidences,
+        ) = fields[:7]
+        record.raw_events = int(raw_events)
+        record.sent_events = int(sent_events)
+        record.compress = float(compress)
+        record.deltat = int(deltat)
+        record.accidentals = int(accidentals)
+        record.coincidences = int(coincidences)
+        return record
+
+
+class CountsLogMessage(Message):
+    """Chopper t2log and chopper2 t1log, with total and per-detector counts."""
+    __slots__ = ('epoch', 'total_counts', 'd1', 'd2', 'd3', 'd4')
+
+    @classmethod
+    def parse(cls, fields):
+        record = cls()
+        record.epoch = fields[0]
+        (
+            record.total_counts, record.d1, record.d2, record.d3, record.d4,
+        ) = map(int, fields[1:6])
+        return record
+
+    @property
+    def det_counts(self):
+        """Returns [total_counts, d1, d2, d3, d4]."""
+        return [self.total_counts, self.d1, self.d2, self.d3, self.d4]
+
+
+class EcnoteMessage(Message):
+    """Error correction notification written by errcd after each block."""
+    __slots__ = ('epoch', 'raw_bits', 'final_bits', 'err_fraction', 'num_epochs')
+
+    @classmethod
+    def parse(cls, fields):
+        record = cls()
+        record.epoch = fields[0]
+        record.raw_bits = int(fields[1])
+        record.final_bits = int(fields[2])
+        record.err_fraction = float(fields[3])
+        record.num_epochs = int(fields[4])
+        return record
+
+
+class MessageLog:
+    """Parses messages of a single type from a pipe, keeping recent records.
+
+    'readline()' is called from the pipe reader thread, while the history
+    is typically queried from the web server thread.
+    """
+
+    def __init__(self, message_type, maxlen: int = HISTORY_LENGTH):
+        self.message_type = message_type
+        self._records = collections.deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+        self.num_malformed = 0
+
+    def readline(self, pipe) -> Optional[Message]:
+        """Reads and parses one line from pipe.
+
+        Returns None if the line is empty or cannot be parsed. Malformed
+        lines are logged and counted, but not raised, to keep the pipe
+        reader thread alive.
+        """
+        line = pipe.readline().rstrip('\n').lstrip('\x00')
+        if len(line) == 0:
+            return None
+        return self.parse(line)
+
+    def parse(self, line: str) -> Optional[Message]:
+        try:
+            record = self.message_type.parse(line.split())
+        except (ValueError, IndexError):
+            self.num_malformed += 1
+            logger.warning(f"Malformed {self.message_type.__name__}: '{line}'")
+            return None
+        record.time = time.time()
+        with self._lock:
+            self._records.append(record)
+        return record
+
+    @property
+    def latest(self) -> Optional[Message]:
+        with self._lock:
+            return self._records[-1] if self._records else None
+
+    def history(self, n: Optional[int] = None) -> List[Message]:
+        """Returns the last 'n' records (default: all), oldest first."""
+        with self._lock:
+            records = list(self._records)
+        return records if n is None else records[max(len(records) - n, 0):]
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+    def __len__(self):
+        return len(self._records)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""Provides block sizing policies for dispatching raw key blocks to errcd.
+
+A policy decides when the accumulated raw key epochs form a block that
+should be sent for error correction. Policies are fed the results of every
+completed block via 'update()', as reported by the ecnote pipe.
+
+Two policies are available, selectable via the configuration key
+'qcrypto.error_correction.block_sizing.policy':
+
+    static: Dispatches once the raw bits exceed 'minimal_block_size'.
+    adaptive: Sizes blocks such that the finite-size penalty of privacy
+        amplification is a small fraction of the asymptotic key fraction,
+        with the penalty estimated from the history of completed blocks.
+
+Both policies only dispatch an odd number of epochs, as per legacy behaviour.
+"""
+
+import collections
+import math
+from typing import Optional
+
+import numpy as np
+
+# Default parameters for the adaptive policy
+MAXIMUM_BLOCK_SIZE = 1_000_000  # raw bits
+MAXIMUM_BLOCK_EPOCHS = 100  # ~54s of accumulation latency
+FINITE_SIZE_TOLERANCE = 0.05  # relative to asymptotic key fraction
+EC_INEFFICIENCY = 1.16  # leakage relative to Shannon limit
+HISTORY_LENGTH = 100
+
+
+def binary_entropy(p: float) -> float:
+    if p <= 0 or p >= 1:
+        return 0.0
+    return -p * math.log2(p) - (1 - p) * math.log2(1 - p)
+
+
+def asymptotic_key_fraction(qber: float, ec_inefficiency: float = EC_INEFFICIENCY):
+    """Returns the BBM92 key fraction in the infinite-key limit."""
+    return 1 - (1 + ec_inefficiency) * binary_entropy(qber)
+
+
+class StaticBlockSizing:
+    """Dispatches blocks of at least 'minimal_block_size' raw bits."""
+
+    def __init__(self, minimal_block_size: int):
+        self.minimal_block_size = minimal_block_size
+
+    @property
+    def block_size(self) -> int:
+        return self.minimal_block_size
+
+    def should_dispatch(self, raw_bits: int, num_epochs: int) -> bool:
+        return raw_bits > self.block_size and num_epochs % 2 == 1
+
+    def update(self, raw_bits: int, final_bits: int, err_fraction: float, qber: float):
+        pass
+
+
+class AdaptiveBlockSizing(StaticBlockSizing):
+    """Dispatches blocks sized from the measured QBER and key rate.
+
+    The key fraction of a block of 'n' raw bits is modelled as
+    'r(Q) - a/sqrt(n)', where 'r(Q)' is the asymptotic key fraction and
+    the finite-size penalty coefficient 'a' is estimated as the median
+    over the recorded blocks. Blocks are then sized so that the penalty
+    is at most 'finite_size_tolerance' of 'r(Q)', which maximizes the
+    final key throughput without unbounded accumulation latency.
+
+    The block size is bounded below by 'minimal_block_size', and above by
+    'maximum_block_size' and by the raw bits accumulated over
+    'maximum_block_epochs' epochs.
+    """
+
+    def __init__(
+        self,
+        minimal_block_size: int,
+        maximum_block_size: int = MAXIMUM_BLOCK_SIZE,
+        maximum_block_epochs: int = MAXIMUM_BLOCK_EPOCHS,
+        finite_size_tolerance: float = FINITE_SIZE_TOLERANCE,
+        history_length: int = HISTORY_LENGTH,
+    ):
+        super().__init__(minimal_block_size)
+        self.maximum_block_size = maximum_block_size
+        self.maximum_block_epochs = maximum_block_epochs
+        self.finite_size_tolerance = finite_size_tolerance
+        self.raw_bits_history = collections.deque(maxlen=history_length)
+        self.final_bits_history = collections.deque(maxlen=history_length)
+        self.err_fraction_history = collections.deque(maxlen=history_length)
+        self.qber = None
+        self._block_size = minimal_block_size
+
+    @property
+    def block_size(self) -> int:
+        return self._block_size
+
+    def should_dispatch(self, raw_bits: int, num_epochs: int) -> bool:
+        # Cap accumulation latency at low key rates
+        if (
+            num_epochs >= self.maximum_block_epochs
+            and raw_bits > self.minimal_block_size
+        ):
+            return num_epochs % 2 == 1
+        return super().should_dispatch(raw_bits, num_epochs)
+
+    def update(self, raw_bits: int, final_bits: int, err_fraction: float, qber: float):
+        """Records results of a completed block and recomputes the block size.
+
+        Args:
+            raw_bits: Number of raw bits in block.
+            final_bits: Number of final key bits after privacy amplification.
+            err_fraction: Error fraction measured in block.
+            qber: Servoed QBER, used for sizing the next block.
+        """
+        if raw_bits > 0:
+            self.raw_bits_history.append(raw_bits)
+            self.final_bits_history.append(final_bits)
+            self.err_fraction_history.append(err_fraction)
+        self.qber = qber
+        self._block_size = self.compute_block_size(qber)
+
+    def penalty_coefficient(self) -> Optional[float]:
+        """Returns the estimated finite-size penalty coefficient 'a'."""
+        if not self.raw_bits_history:
+            return None
+        n = np.array(self.raw_bits_history, dtype=np.float64)
+        k = np.array(self.final_bits_history, dtype=np.float64) / n
+        r = np.array([asymptotic_key_fraction(q) for q in self.err_fraction_history])
+        valid = r > 0
+        if not np.any(valid):
+            return None
+        a = (r[valid] - k[valid]) * np.sqrt(n[valid])
+        return float(max(np.median(a), 0.0))
+
+    def compute_block_size(self, qber: Optional[float] = None) -> int:
+        """Returns the raw bits per block for the given QBER.
+
+        Falls back to 'minimal_block_size' if there is no usable history,
+        or if no key is expected at this QBER.
+        """
+        if qber is None:
+            qber = self.qber
+        a = self.penalty_coefficient()
+        r = asymptotic_key_fraction(qber) if qber is not None else 0
+        if not a or r <= 0:
+            return self.minimal_block_size
+        size = math.ceil((a / (self.finite_size_tolerance * r)) ** 2)
+        return int(min(max(size, self.minimal_block_size), self.maximum_block_size))
+
+
+def from_config(config) -> StaticBlockSizing:
+    """Returns the block sizing policy specified in the global configuration."""
+    minimal_block_size = config.minimal_block_size
+    error_correction = getattr(config.qcrypto, "error_correction", None)
+    params = getattr(error_correction, "block_sizing", None)
+    policy = getattr(params, "policy", "static")
+    if policy == "static":
+        return StaticBlockSizing(minimal_block_size)
+    if policy == "adaptive":
+        return AdaptiveBlockSizing(
+            minimal_block_size,
+            maximum_block_size=getattr(
+                params, "maximum_block_size", MAXIMUM_BLOCK_SIZE
+            ),
+            maximum_block_epochs=getattr(
+                params, "maximum_block_epochs", MAXIMUM_BLOCK_EPOCHS
+            ),
+            finite_size_tolerance=getattr(
+                params, "finite_size_tolerance", FINITE_SIZE_TOLERANCE
+            ),
+        )
+    raise ValueError(f"Unknown block sizing policy '{policy}'.")
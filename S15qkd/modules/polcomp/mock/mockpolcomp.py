@@ -14,7 +14,7 @@ class MockPolComp:
         self, lcr_path, callback_service_to_BBM92=None
     ):  # Controller.__init__()
         self._callback = callback_service_to_BBM92
-        self.estimator = QberEstimator()
+        self.estimator = QberEstimator.from_config()
         self.qber = self.estimator.qber
         self.qber_threshold = qkd_globals.config["QBER_threshold"]
 
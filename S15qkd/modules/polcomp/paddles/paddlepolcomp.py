@@ -28,7 +28,7 @@ class PaddlePolComp:
 
     def __init__(self, device_path, callback_service_to_BBM92=None):
         self._callback = callback_service_to_BBM92
-        self.estimator = QberEstimator()
+        self.estimator = QberEstimator.from_config()
         self.qber = self.estimator.qber
         self.qber_threshold = qkd_globals.config["QBER_threshold"]
 
@@ -1,14 +1,34 @@
 #!/usr/bin/env python3
 
+import collections
+import math
+from typing import Optional, Tuple
+
 import numpy as np
 
+from S15qkd import qkd_globals
 from S15qkd.qkd_globals import FoldersQKD, logger
 from S15qkd.utils import service_T3
 
+ER_COINC_ID = [0, 5, 10, 15]  # VV, AA, HH, DD
+GD_COINC_ID = [2, 7, 8, 13]  # VH, AD, HV, DA
+
 
 class QberEstimator:
     """Provides an estimation of QBER depending on the available bits.
 
+    Coincidences are accumulated into a running coincidence matrix, so that
+    each epoch is handled in constant time. By default, all epochs since the
+    last committed QBER are accumulated. Alternatively, only the last 'window'
+    epochs can be used, or older epochs can be exponentially down-weighted by
+    a factor 'decay' per epoch. The accumulation is not reset after a QBER is
+    committed in the latter two modes.
+
+    A QBER is committed once the half-width of its Wilson confidence interval
+    falls below 'relative_precision' of the QBER, bounded by MINIMUM_BITS and
+    MAXIMUM_BITS. 'from_config' reads these settings from the
+    'qcrypto.polarization_compensation' section of the configuration.
+
     Note:
         Note that this class is not thread-safe, but should work under the assumption
         that QBER computation should take much less than the epoch separation time, i.e.
@@ -16,13 +36,48 @@ class QberEstimator:
     """
 
     MINIMUM_BITS = 400
-
-    def __init__(self):
+    MAXIMUM_BITS = 4000
+    CONFIDENCE_Z = 1.96  # two-sided 95% confidence
+    RELATIVE_PRECISION = 0.14  # desired confidence half-width, relative to QBER
+
+    def __init__(
+        self,
+        window: Optional[int] = None,
+        decay: Optional[float] = None,
+        relative_precision: float = RELATIVE_PRECISION,
+    ):
+        if window is not None and decay is not None:
+            raise ValueError("Only one of 'window' and 'decay' can be specified.")
+        if window is not None and window < 1:
+            raise ValueError("'window' should be a positive number of epochs.")
+        if decay is not None and not (0 < decay < 1):
+            raise ValueError("'decay' should be within (0, 1).")
+        if relative_precision <= 0:
+            raise ValueError("'relative_precision' should be positive.")
+        self.window = window
+        self.decay = decay
+        self.relative_precision = relative_precision
         self.qber = 1.0
         self.reset()
 
+    @classmethod
+    def from_config(cls) -> "QberEstimator":
+        """Returns an estimator configured by 'qcrypto.polarization_compensation'."""
+        qcrypto = qkd_globals.config.get("qcrypto", {})
+        settings = qcrypto.get("polarization_compensation", {})
+        return cls(
+            window=settings.get("qber_estimator_window"),
+            decay=settings.get("qber_estimator_decay"),
+            relative_precision=settings.get(
+                "qber_estimator_precision", cls.RELATIVE_PRECISION
+            ),
+        )
+
     def reset(self):
-        self.diagnoses = []
+        dtype = np.int64 if self.decay is None else np.float64
+        self.coinc_matrix = np.zeros(16, dtype=dtype)
+        self.num_epochs = 0
+        self._window_matrices = collections.deque()
 
     def handle_epoch(self, epoch) -> float:
         epoch_path = FoldersQKD.RAWKEYS + "/" + epoch
@@ -38,46 +93,83 @@ class QberEstimator:
         Returns 'None' if accumulated bits are insufficient to make a precise
         estimation of QBER, otherwise a float value [0,1] will be returned.
         """
-        self.diagnoses.append(diagnosis)
+        self._accumulate(np.asarray(diagnosis.coinc_matrix))
 
         # Do nothing if insufficient bits
         qber, accumulated_bits = self._calculate_qber()
-        desired_bits = self._get_desired_bits(qber)
-        if accumulated_bits < desired_bits:
+        if not self._is_precise(qber, accumulated_bits):
+            low, high = self.confidence_interval()
             logger.info(
                 "Accumulating more bits for QBER calculation: "
-                f"{accumulated_bits} / {desired_bits}"
+                f"{accumulated_bits:.0f} / ~{self._get_desired_bits(qber)}, "
+                f"QBER within [{low:.3f}, {high:.3f}]"
             )
             return None
         else:
             self.qber = qber  # commit QBER since sufficient bits
-            self.reset()
+            if self.window is None and self.decay is None:
+                self.reset()
             return self.qber
 
-    def _calculate_qber(self) -> float:
-        """Computes QBER from the accumulated set of diagnosis.
+    def confidence_interval(self, z: float = CONFIDENCE_Z) -> Tuple[float, float]:
+        """Returns the Wilson score interval of QBER for accumulated bits."""
+        er_coin, tt_coin = self._count_bits()
+        return wilson_interval(er_coin, tt_coin, z)
+
+    def _accumulate(self, coinc_matrix):
+        self.num_epochs += 1
+        if self.decay is not None:
+            self.coinc_matrix *= self.decay
+        self.coinc_matrix += coinc_matrix
+        if self.window is not None:
+            self._window_matrices.append(coinc_matrix)
+            if len(self._window_matrices) > self.window:
+                self.coinc_matrix -= self._window_matrices.popleft()
+
+    def _count_bits(self):
+        er_coin = self.coinc_matrix[ER_COINC_ID].sum()
+        gd_coin = self.coinc_matrix[GD_COINC_ID].sum()
+        return er_coin, er_coin + gd_coin
 
-        TODO:
-            Integrate this into 'handle_diagnosis()' to avoid aggressive
-            recomputation of QBER. This currently behaves poorly when the
-            number of coincidences per epoch is low.
-        """
-        # Compute QBER from set of diagnosis in each epoch
-        matrices = np.array([d.coinc_matrix for d in self.diagnoses])
-        coinc_matrix = np.sum(matrices, axis=0)
-        er_coin = sum(coinc_matrix[[0, 5, 10, 15]])  # VV, AA, HH, DD
-        gd_coin = sum(coinc_matrix[[2, 7, 8, 13]])  # VH, AD, HV, DA
-        tt_coin = er_coin + gd_coin
-        qber = round(er_coin / tt_coin, 3) if tt_coin != 0 else 1.0
-        logger.info(f"Avg(QBER): {qber:.3f} of the last {tt_coin} bits.")
+    def _calculate_qber(self) -> float:
+        """Computes QBER from the accumulated coincidence matrix."""
+        er_coin, tt_coin = self._count_bits()
+        qber = float(round(er_coin / tt_coin, 3)) if tt_coin != 0 else 1.0
+        logger.info(f"Avg(QBER): {qber:.3f} of the last {tt_coin:.0f} bits.")
         return qber, tt_coin
 
+    def _is_precise(self, qber, bits) -> bool:
+        """Returns whether the QBER confidence interval is narrow enough to commit."""
+        if bits < QberEstimator.MINIMUM_BITS:
+            return False
+        if bits >= QberEstimator.MAXIMUM_BITS:
+            return True
+        low, high = self.confidence_interval()
+        return (high - low) / 2 <= self.relative_precision * qber
+
     def _get_desired_bits(self, qber) -> int:
-        if qber < 0.12:
-            return 4000
-        if qber < 0.15:
-            return 1000
-        if qber < 0.30:
-            return 800
-        else:
-            return QberEstimator.MINIMUM_BITS
+        """Returns the approximate number of bits to reach the desired precision.
+
+        Derived from the normal approximation of the binomial confidence
+        interval, i.e. z * sqrt(qber * (1-qber) / n) <= relative_precision * qber,
+        bounded by MINIMUM_BITS and MAXIMUM_BITS. Only used for reporting
+        progress, see '_is_precise' for the decision.
+        """
+        if qber <= 0:
+            return QberEstimator.MAXIMUM_BITS
+        z = QberEstimator.CONFIDENCE_Z
+        r = self.relative_precision
+        bits = math.ceil(z * z * (1 - qber) / (qber * r * r))
+        return min(max(bits, QberEstimator.MINIMUM_BITS), QberEstimator.MAXIMUM_BITS)
+
+
+def wilson_interval(errors: float, total: float, z: float) -> Tuple[float, float]:
+    """Returns the Wilson score interval for a binomial proportion."""
+    if total <= 0:
+        return 0.0, 1.0
+    p = errors / total
+    denominator = 1 + z * z / total
+    center = (p + z * z / (2 * total)) / denominator
+    halfwidth = z * math.sqrt(p * (1 - p) / total + z * z / (4 * total * total))
+    halfwidth /= denominator
+    return max(0.0, center - halfwidth), min(1.0, center + halfwidth)
@@ -55,13 +55,17 @@ EPOCH_DURATION = 2**32 / 8 * 1e-9
 det_info = ('total', 'v', '-', 'h', '+')
 det_blinding_info = ('total', 'total_b', 'v', '-', 'h', '+', 'v_b', '-_b', 'h_b', '+_b')
 
-config_file = '/root/code/QKDServer/S15qkd/qkd_engine_config.json'
+# Overridable to run several engines on one host, e.g. 'simulate_two_nodes.py'
+config_file = os.environ.get(
+    'QKD_ENGINE_CONFIG', '/root/code/QKDServer/S15qkd/qkd_engine_config.json')
 
 with open(config_file, 'r') as f:
     config = json.load(f)
 
 data_root = config['data_root']
 program_root = config['program_root']
+final_keys_root = config.get('final_keys_root', '/epoch_files')
+history_root = config.get('history_root', '/history')
 
 testing = 0  # CHANGE to 0 if you want to run it with hardware
 if testing == 1:
@@ -193,7 +197,7 @@ class PipesQKD(str, Enum):
 
     # NB: FoldersQKD.prepare_folders *must* be called prior to
     #     pipe initialization, which is done so in controller.start_communication
-    ECNOTE_GUARDIAN = '/epoch_files/notify.pipe'
+    ECNOTE_GUARDIAN = final_keys_root + '/notify.pipe'
 
     @classmethod
     def prepare_pipes(cls):
@@ -251,7 +255,7 @@ class FoldersQKD(str, Enum):
     T3FILES = data_root + '/t3'
     RAWKEYS = data_root + '/rawkey'
     HISTOS = data_root + '/histos'
-    FINALKEYS = '/epoch_files'
+    FINALKEYS = final_keys_root
 
     @classmethod
     def prepare_folders(cls):
@@ -1,100 +1,93 @@
-import math
-import struct
 import subprocess
-import json
 
-from .qkd_globals import config_file
-with open(config_file, 'r') as f:
-    config = json.load(f)
-    prog_diagnosis = config['program_root'] + '/diagnosis'
+import numpy as np
+
+from .qkd_globals import logger, program_root
+from .utils import service_T3
+
+prog_diagnosis = program_root + '/diagnosis'
 
 class RawKeyDiagnosis(object):
     """
     Diagnosis of raw key files produced in service mode.
+
+    The diagnosis is computed in-process by default. The external 'diagnosis'
+    program from qcrypto remains available with 'use_subprocess=True', as a
+    fallback and as a reference for parity checks, see '__main__' below and
+    'tests/test_rawkey_diagnosis.py'.
     """
-    def __init__(self, epoch_file_path: str):
+    def __init__(self, epoch_file_path: str, use_subprocess: bool = False):
+        self.epoch_file_path = epoch_file_path
+        if use_subprocess:
+            results = self.diagnosis_subprocess(epoch_file_path)
+        else:
+            results = self.diagnosis(epoch_file_path)
+        self.results = results
+        self.coincidences_VV = results[0]
+        self.coincidences_VH = results[2]
+        self.coincidences_ADAD = results[5]
+        self.coincidences_ADD = results[7]
+        self.coincidences_HV = results[8]
+        self.coincidences_HH = results[10]
+        self.coincidences_DAD = results[13]
+        self.coincidences_DD = results[15]
+        qber_numerator = self.coincidences_HH + self.coincidences_VV + \
+            self.coincidences_ADAD + self.coincidences_DD
+        qber_denominator = self.coincidences_ADD + self.coincidences_DAD + \
+            self.coincidences_HV + self.coincidences_VH + qber_numerator
+        self.quantum_bit_error = qber_numerator / (qber_denominator + 1)
+        self.total_coincidences = results[16]
+        self.total_counts = results[17]
+
+    def __repr__(self):
+        return f'File: {self.epoch_file_path}, QBER: {self.quantum_bit_error}, Total coincidences: {self.total_coincidences}, Total counts: {self.total_counts}'
+
+    @staticmethod
+    def diagnosis_subprocess(epoch_file_path: str) -> list:
+        """Runs the external 'diagnosis' program on the epoch file."""
         diagnosis_process = subprocess.Popen([prog_diagnosis,
                                               '-q', epoch_file_path],
                                              stdout=subprocess.PIPE,
                                              stderr=subprocess.PIPE)
         data, error = diagnosis_process.communicate()
-        if len(data) != 0:
-            self.epoch_file_path = epoch_file_path
-            results = list(map(int, data.split()))
-            self.coincidences_VV = results[0]
-            self.coincidences_VH = results[2]
-            self.coincidences_ADAD = results[5]
-            self.coincidences_ADD = results[7]
-            self.coincidences_HV = results[8]
-            self.coincidences_HH = results[10]
-            self.coincidences_DAD = results[13]
-            self.coincidences_DD = results[15]
-            qber_numerator = self.coincidences_HH + self.coincidences_VV + \
-                self.coincidences_ADAD + self.coincidences_DD
-            qber_denominator = self.coincidences_ADD + self.coincidences_DAD + \
-                self.coincidences_HV + self.coincidences_VH + qber_numerator
-            self.quantum_bit_error = qber_numerator / (qber_denominator + 1)
-            self.total_coincidences = results[16]
-            self.total_counts = results[17]
-        else:
+        if len(data) == 0:
             raise Exception(error)
+        return list(map(int, data.split()))
 
-    def __repr__(self):
-        return f'File: {self.epoch_file_path}, QBER: {self.quantum_bit_error}, Total coincidences: {self.total_coincidences}, Total counts: {self.total_counts}'
-
-    def diagnosis(self, epoch_file_path: str):
-        """ Replaces diagnosis.c functionality. #TODO: proper handling/return of errors
-        """
-        body = []
-        matrix = [0] * 16
-        garbage1 = 0
-        garbage2 = 0
-        okcount = 0
-        decode = [-1, 0, 1, -1, 2, -1, -1, -1, 3, -1, -1, -1, -1, -1, -1, -1] # translate valid bit values to 4 array index
-        header_info_size = 16 # 16 bytes of T3 header https://qcrypto.readthedocs.io/en/documentation/file%20specification.html
-        with open(epoch_file_path, 'rb') as f:
-            head_info = f.read(header_info_size)
-            word = f.read(4)
-            while word != b"":
-                dat, = struct.unpack('<I', word) # unpacking was done wrongly in original diagnosis.c code.
-                dat_bytes = dat.to_bytes(4,'little')
-                body.append(dat_bytes[3])
-                body.append(dat_bytes[2])
-                body.append(dat_bytes[1])
-                body.append(dat_bytes[0])
-                word = f.read(4)
+    @staticmethod
+    def diagnosis(epoch_file_path: str) -> list:
+        """Replaces diagnosis.c functionality.
 
-        tag, epoc, length_entry, bits_per_entry = struct.unpack('iIIi', head_info) #int, unsigned int, unsigned int, int
-        if (tag != 0x103 and tag != 3) :
-            logger.error(f'{file_name} is not a Type3 header file')
-        if hex(epoc) != ('0x' + file_name.split('/')[-1]):
-            logger.error(f'Epoch in header {hex(epoc)} does not match epoc filename {file_name}')
-        if (bits_per_entry != 8):
-            logger.warning(f'Not a service file with 8 bits per entry')
+        Returns results in the same layout as the output of 'diagnosis -q',
+        i.e. 16 coincidence matrix entries, followed by the number of valid
+        coincidences, number of entries, and garbage counts.
 
-        """ Calculation for number of bytes in original C. multiplication gives total_bits.
-            int((total_bits +7) /8) gives the ceiling of total_bits/8. 16 is the header info which is the total number of bytes in epoch.
-            Data is packed in 32 bits/4 bytes words.
-            int(total bytes/4)+ 1 if (total_bytes & 3) else 0  is another ceiling funciton of total_words/4
-            """
-        #total_bytes = int((length_entry*bits_per_entry + 7)/8) + 16
-        #total_words = int(total_bytes/4) + (1 if (total_bytes & 3) else 0)
-        total_bytes = math.ceil((length_entry*bits_per_entry)/8) + header_info_size
-        total_words = math.ceil(total_bytes/4)
-        if total_words*4 != (len(body) + len(head_info)):
-            logger.error(f'stream 3 size inconsistency')
-        for i in range(length_entry):
-            a = decode[body[i] & 0xf]
-            b = decode[(body[i]>>4) & 0xf]
-            if a < 0:
-                garbage1 += 1
-            if b < 0:
-                garbage2 += 1;
-            if ((a >= 0) and (b >= 0)) :
-                matrix[a * 4 + b] += 1
-                okcount += 1;
-        return matrix, okcount, length_entry, garbage2, garbage1
+        Note:
+            The coincidence matrix in diagnosis.c is indexed by the lower
+            nibble first, i.e. the transpose of 'utils.service_T3'.
+        """
+        service = service_T3(epoch_file_path)
+        matrix = np.array(service.coinc_matrix).reshape(4, 4).T.ravel().tolist()
+        return [
+            *matrix,
+            service.okcount,
+            service.head.length_entry,
+            service.garbage[0],
+            service.garbage[1],
+        ]
 
 if __name__ == "__main__":
-    diag = RawKeyDiagnosis('b2331bef')
-    print(diag.quantum_bit_error)
+    # Parity check of in-process diagnosis against external 'diagnosis' program, e.g.
+    #   python3 -m S15qkd.rawkey_diagnosis /tmp/cryptostuff/rawkey/*
+    import sys
+
+    mismatches = 0
+    for path in sys.argv[1:]:
+        expected = RawKeyDiagnosis.diagnosis_subprocess(path)
+        result = RawKeyDiagnosis.diagnosis(path)
+        if expected != result:
+            mismatches += 1
+            logger.error(f'{path}: diagnosis {expected} != in-process {result}')
+        else:
+            print(RawKeyDiagnosis(path))
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Resource accounting of the qcrypto child processes and the pipes they write.
+
+Sampled by the process supervisor at a fixed rate ('process_stats_interval'),
+and exported to the metrics registry per process:
+
+    qkd_process_cpu_seconds_total{process, mode}           user, system
+    qkd_process_cpu_percent{process}                       of a single core
+    qkd_process_resident_memory_bytes{process}
+    qkd_process_context_switches_total{process, kind}      voluntary, involuntary
+    qkd_process_io_bytes_total{process, direction}         read, write
+    qkd_process_open_fds{process}
+    qkd_pipe_backlog_bytes{pipe}                           written, not yet digested
+
+Stages are flagged when they need attention, e.g. to pin cores or adjust
+nice values:
+
+    cpu_bound       recent CPU usage close to a full core
+    cpu_rising      recent CPU usage well above its longer-term average
+    backlog_rising  pipe backlog increasing over consecutive samples
+
+A process mostly switching voluntarily is blocked on I/O, e.g. pipes,
+while involuntary switches indicate contention for the CPU.
+
+Copyright (c) 2020 S-Fifteen Instruments Pte. Ltd.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import collections
+import time
+from statistics import mean
+from typing import Dict, Mapping, NamedTuple, Optional
+
+import psutil
+
+from S15qkd.metrics import registry
+from S15qkd.qkd_globals import logger
+
+CPU_WINDOW = 30  # samples in the longer-term CPU average
+CPU_RECENT = 5  # samples in the recent CPU average
+CPU_BOUND = 90  # percent of a single core
+CPU_RISING_FACTOR = 1.5
+CPU_RISING_MIN = 20  # percent, below which rises are not flagged
+BACKLOG_SAMPLES = 5  # consecutive increases flagged as rising backlog
+
+cpu_seconds = registry.counter(
+    'qkd_process_cpu_seconds_total', 'CPU time of the process.', ('process', 'mode'))
+cpu_percent = registry.gauge(
+    'qkd_process_cpu_percent', 'CPU usage since the previous sample, in percent of a core.',
+    ('process',))
+resident_memory = registry.gauge(
+    'qkd_process_resident_memory_bytes', 'Resident memory of the process.', ('process',))
+context_switches = registry.counter(
+    'qkd_process_context_switches_total', 'Context switches of the process.', ('process', 'kind'))
+io_bytes = registry.counter(
+    'qkd_process_io_bytes_total', 'Bytes read and written by the process.', ('process', 'direction'))
+open_fds = registry.gauge(
+    'qkd_process_open_fds', 'File descriptors opened by the process.', ('process',))
+process_flag = registry.gauge(
+    'qkd_process_flag', 'Set if the process is flagged, see S15qkd/resources.py.',
+    ('process', 'reason'))
+pipe_backlog = registry.gauge(
+    'qkd_pipe_backlog_bytes', 'Bytes written to the pipe and not yet digested.', ('pipe',))
+pipe_flag = registry.gauge(
+    'qkd_pipe_flag', 'Set if the pipe is flagged, see S15qkd/resources.py.', ('pipe', 'reason'))
+
+
+class Usage(NamedTuple):
+    """Cumulative usage of a process at the time of sampling."""
+    pid: int
+    time: float  # monotonic
+    user: float
+    system: float
+    voluntary: int
+    involuntary: int
+    read_bytes: Optional[int]
+    write_bytes: Optional[int]
+    rss: int
+    fds: int
+
+
+def _usage(process: psutil.Process) -> Optional[Usage]:
+    try:
+        with process.oneshot():
+            cpu = process.cpu_times()
+            ctx = process.num_ctx_switches()
+            rss = process.memory_info().rss
+            fds = process.num_fds()
+            try:
+                io = process.io_counters()
+                read_bytes, write_bytes = io.read_bytes, io.write_bytes
+            except (psutil.AccessDenied, AttributeError):
+                read_bytes = write_bytes = None
+    except psutil.Error:
+        return None
+    return Usage(
+        process.pid, time.monotonic(), cpu.user, cpu.system,
+        ctx.voluntary, ctx.involuntary, read_bytes, write_bytes, rss, fds)
+
+
+class ResourceAccounting:
+    """Samples resource usage, see module docstring.
+
+    'report' holds the latest sample of each process and pipe, and is
+    replaced, not modified, on every sample.
+    """
+
+    def __init__(self):
+        self.report = {'processes': {}, 'pipes': {}}
+        self._previous: Dict[str, Usage] = {}
+        self._cpu = collections.defaultdict(lambda: collections.deque(maxlen=CPU_WINDOW))
+        self._backlog = collections.defaultdict(
+            lambda: collections.deque(maxlen=BACKLOG_SAMPLES + 1))
+        self._flags = collections.defaultdict(frozenset)  # process or pipe -> reasons
+
+    def sample(self, processes: Mapping[str, Optional[psutil.Process]],
+               backlog: Mapping[str, int]) -> dict:
+        """Samples running 'processes' by name, and 'backlog' bytes by pipe name."""
+        report = {'processes': {}, 'pipes': {}}
+        for name, process in processes.items():
+            usage = _usage(process) if process is not None else None
+            report['processes'][name] = self._account(name, usage)
+        for name, pending in backlog.items():
+            report['pipes'][name] = self._account_pipe(name, pending)
+        self.report = report
+        return report
+
+    def _account(self, name: str, usage: Optional[Usage]) -> dict:
+        previous = self._previous.pop(name, None)
+        if usage is None:
+            self._cpu.pop(name, None)
+            resident_memory.labels(name).set(0)
+            open_fds.labels(name).set(0)
+            cpu_percent.labels(name).set(0)
+            self._flag(process_flag, name, frozenset())
+            return {'running': False}
+        self._previous[name] = usage
+        if previous is None or previous.pid != usage.pid:
+            previous = Usage(usage.pid, usage.time, 0, 0, 0, 0, 0, 0, 0, 0)  # new process
+
+        cpu_seconds.labels(name, 'user').inc(max(usage.user - previous.user, 0))
+        cpu_seconds.labels(name, 'system').inc(max(usage.system - previous.system, 0))
+        context_switches.labels(name, 'voluntary').inc(usage.voluntary - previous.voluntary)
+        context_switches.labels(name, 'involuntary').inc(usage.involuntary - previous.involuntary)
+        if usage.read_bytes is not None and previous.read_bytes is not None:
+            io_bytes.labels(name, 'read').inc(usage.read_bytes - previous.read_bytes)
+            io_bytes.labels(name, 'write').inc(usage.write_bytes - previous.write_bytes)
+        resident_memory.labels(name).set(usage.rss)
+        open_fds.labels(name).set(usage.fds)
+
+        elapsed = usage.time - previous.time
+        cpu = None
+        if elapsed > 0:
+            cpu = 100 * (usage.user + usage.system - previous.user - previous.system) / elapsed
+            cpu_percent.labels(name).set(cpu)
+            self._cpu[name].append(cpu)
+
+        history = self._cpu[name]
+        reasons = set()
+        if len(history) >= CPU_RECENT:
+            recent = mean(list(history)[-CPU_RECENT:])
+            if recent >= CPU_BOUND:
+                reasons.add('cpu_bound')
+            if (len(history) >= CPU_WINDOW // 2 and recent >= CPU_RISING_MIN
+                    and recent > CPU_RISING_FACTOR * mean(history)):
+                reasons.add('cpu_rising')
+        self._flag(process_flag, name, frozenset(reasons))
+        return {
+            'running': True,
+            'pid': usage.pid,
+            'cpu_percent': cpu,
+            'cpu_user': usage.user,
+            'cpu_system': usage.system,
+            'ctx_voluntary': usage.voluntary,
+            'ctx_involuntary': usage.involuntary,
+            'read_bytes': usage.read_bytes,
+            'write_bytes': usage.write_bytes,
+            'rss': usage.rss,
+            'fds': usage.fds,
+            'flags': sorted(reasons),
+        }
+
+    def _account_pipe(self, name: str, pending: int) -> dict:
+        pipe_backlog.labels(name).set(pending)
+        history = self._backlog[name]
+        history.append(pending)
+        rising = len(history) == history.maxlen and all(
+            a < b for a, b in zip(history, list(history)[1:]))
+        reasons = frozenset(('backlog_rising',) if rising else ())
+        self._flag(pipe_flag, name, reasons)
+        return {'backlog': pending, 'flags': sorted(reasons)}
+
+    def _flag(self, gauge, name: str, reasons: frozenset):
+        """Updates the flag gauges, logging reasons as they are raised."""
+        previous = self._flags[name]
+        for reason in reasons - previous:
+            logger.warning(f"'{name}' flagged as {reason}.")
+            gauge.labels(name, reason).set(1)
+        for reason in previous - reasons:
+            logger.info(f"'{name}' no longer flagged as {reason}.")
+            gauge.labels(name, reason).set(0)
+        self._flags[name] = reasons
@@ -31,10 +31,16 @@ import pathlib
 import time
 
 from .utils import Process, read_T3_header, HeadT3, read_T4_header, HeadT4
+from .messages import MessageLog, EpochMessage
+from .epoch_trace import epoch_trace
 from .qkd_globals import logger, QKDProtocol, PipesQKD, FoldersQKD, QKDEngineState
 
 class Splicer(Process):
 
+    def __init__(self, process):
+        super().__init__(process)
+        self.genlog = MessageLog(EpochMessage)
+
     def start(
             self,
             qkd_protocol,
@@ -71,12 +77,13 @@ class Splicer(Process):
         super().start_thread_method(self._no_message_monitor)
 
     def digest_splice_outpipe(self, pipe):
-        # message = pipe.readline().decode().rstrip('\n').lstrip('\x00')
-        message = pipe.readline().rstrip('\n').lstrip('\x00')
-        if len(message) == 0:
+        message = self.genlog.readline(pipe)
+        if message is None:
             return
 
-        self._latest_message_time = time.time()
+        self._latest_message_time = message.time
+        epoch_trace.stamp('genlog', message.epoch, message.time)
+        message = message.epoch
         qkd_protocol = self._qkd_protocol
         logger.debug(f'[genlog] {message}')
         if qkd_protocol == QKDProtocol.BBM92:
@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Readers and writers for the qcrypto stream files, using NumPy only.
+
+File bodies are memory-mapped, and decoded with vectorized operations into
+NumPy arrays, so that analysis and simulation tools need neither the
+qcrypto binaries nor Python loops over words. All headers and body words
+are stored as native (little-endian) 32-bit integers. Supported types:
+
+    T1: Timestamps (chopper2 -> costream). Each event is a 64-bit raw event
+        stored as two words, high word first, holding the time in units of
+        1/8 ns in the upper 49 bits and the detector pattern in the lower
+        bits. Returned as a zero-copy structured array ('high', 'low'), see
+        'event_times()' and 'event_patterns()'.
+    T2: Compressed timing (chopper -> remote costream).
+    T4: Compressed timing of coincidences (costream -> remote splicer).
+        Both are bit streams of events, each a time difference to the
+        previous event (the first relative to the epoch start) in 'timeorder'
+        bits, followed by 'basebits' bits of basis/detector value. Time
+        differences that do not fit, and a difference of 1, are escaped as
+        a 1 in 'timeorder' bits followed by the full 32-bit difference.
+        The stream ends with an escape holding a difference of 0. Returned
+        as structured array ('time', 'value'), with 'time' relative to the
+        epoch start.
+    T3: Raw key (chopper/costream -> splicer), entries of 'bits_per_entry'
+        bits. Returned as an integer array of entries.
+    T7: Final key (errcd). Returned as an array of key bits.
+
+Bit streams are packed most significant bit first within each word.
+
+Usage:
+    stream = read_stream('/tmp/cryptostuff/t1/b0000000')
+    times = event_times(stream.data)
+
+Copyright (c) 2020 S-Fifteen Instruments Pte. Ltd.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import struct
+from typing import Any, NamedTuple, Optional
+
+import numpy as np
+
+
+class HeadT1(NamedTuple):
+    tag: int
+    epoch: int
+    length_bits: int
+    bits_per_entry: int
+    base_bits: int
+
+class HeadT2(NamedTuple):
+    tag: int
+    epoch: int
+    length_bits: int
+    timeorder: int
+    base_bits: int
+    protocol: int
+
+class HeadT3(NamedTuple):
+    tag: int
+    epoch: int
+    length_entry: int
+    bits_per_entry: int
+
+class HeadT4(NamedTuple):
+    tag: int
+    epoch: int
+    length_bits: int
+    timeorder: int
+    base_bits: int
+
+class HeadT7(NamedTuple):
+    tag: int
+    epoch: int
+    num_epoch: int
+    length_bits: int
+
+class Stream(NamedTuple):
+    head: Any  # one of the header types above
+    data: np.ndarray
+
+
+# Header layouts by stream type, identified by the lower byte of the tag
+HEADERS = {
+    1: (HeadT1, struct.Struct('<iIIii')),
+    2: (HeadT2, struct.Struct('<iIIiii')),
+    3: (HeadT3, struct.Struct('<iIIi')),
+    4: (HeadT4, struct.Struct('<iIIii')),
+    7: (HeadT7, struct.Struct('<iIIi')),
+}
+HEADER_SIZE = max(layout.size for _, layout in HEADERS.values())
+TAG_OFFSET = 0x100  # tags are written as 0x10N, older files use N
+
+RAW_EVENT = np.dtype([('high', '<u4'), ('low', '<u4')])
+TIMING_EVENT = np.dtype([('time', '<u8'), ('value', 'u1')])
+T1_TIME_SHIFT = 15  # bits below time in raw event
+T1_BITS_PER_ENTRY = 49
+ESCAPE_CODE = 1
+ESCAPE_BITS = 32
+DECODE_BATCH = 65536  # maximum events decoded per vectorized step
+MIN_DECODE_BATCH = 64
+
+
+# Headers
+
+def parse_header(data: bytes):
+    """Returns header parsed from the start of a stream file, or None."""
+    if len(data) < 4:
+        return None
+    (tag,) = struct.unpack_from('<i', data)
+    if tag & 0xff not in HEADERS or tag not in (tag & 0xff, TAG_OFFSET + (tag & 0xff)):
+        return None
+    head_type, layout = HEADERS[tag & 0xff]
+    if len(data) < layout.size:
+        return None
+    return head_type._make(layout.unpack_from(data))
+
+def read_header(file_name: str):
+    """Returns header of a stream file of any type, or None if unrecognized."""
+    with open(file_name, 'rb') as f:
+        return parse_header(f.read(HEADER_SIZE))
+
+def _read_typed_header(file_name: str, stream_type: int):
+    head = read_header(file_name)
+    if not isinstance(head, HEADERS[stream_type][0]):
+        raise ValueError(f"'{file_name}' is not a Type{stream_type} stream file")
+    return head
+
+def _write_header(f, stream_type: int, *fields):
+    f.write(HEADERS[stream_type][1].pack(TAG_OFFSET + stream_type, *fields))
+
+
+# Bit streams
+
+def _map_words(file_name: str, offset: int) -> np.ndarray:
+    """Memory-maps the 32-bit words following the header."""
+    count = (os.path.getsize(file_name) - offset) // 4
+    if count <= 0:
+        return np.empty(0, dtype='<u4')  # empty files cannot be mapped
+    return np.memmap(file_name, dtype='<u4', mode='r', offset=offset, shape=(count,))
+
+def words_to_bits(words: np.ndarray) -> np.ndarray:
+    """Unpacks words into an array of bits, most significant bit first."""
+    return np.unpackbits(np.asarray(words, dtype='<u4').astype('>u4').view(np.uint8))
+
+def bits_to_words(bits: np.ndarray) -> np.ndarray:
+    """Packs bits into words, zero-padding the last word."""
+    bits = np.asarray(bits, dtype=np.uint8)
+    padded = np.zeros(-(-len(bits) // 32) * 32, dtype=np.uint8)
+    padded[:len(bits)] = bits
+    return np.packbits(padded).view('>u4').astype('<u4')
+
+def read_fields(bits: np.ndarray, start: int, count: int, width: int) -> np.ndarray:
+    """Returns 'count' consecutive unsigned fields of 'width' bits from 'start'."""
+    if width == 0:
+        return np.zeros(count, dtype=np.uint64)
+    fields = bits[start:start + count * width].reshape(count, width)
+    weights = np.left_shift(np.uint64(1), np.arange(width - 1, -1, -1, dtype=np.uint64))
+    return fields.astype(np.uint64) @ weights
+
+def fields_to_bits(values: np.ndarray, widths: np.ndarray) -> np.ndarray:
+    """Concatenates fields of the given bit widths (0 to 64) into bits."""
+    values = np.asarray(values, dtype=np.uint64).ravel()
+    widths = np.asarray(widths, dtype=np.int64).ravel()
+    field = np.repeat(np.arange(len(widths)), widths)
+    position = np.arange(len(field)) - np.repeat(np.cumsum(widths) - widths, widths)
+    shift = (widths[field] - 1 - position).astype(np.uint64)
+    return ((values[field] >> shift) & np.uint64(1)).astype(np.uint8)
+
+
+# T1
+
+def read_T1(file_name: str) -> Stream:
+    """Returns raw events, memory-mapped without copying."""
+    head = _read_typed_header(file_name, 1)
+    offset = HEADERS[1][1].size
+    count = min((os.path.getsize(file_name) - offset) // RAW_EVENT.itemsize, head.length_bits)
+    if count <= 0:
+        return Stream(head, np.empty(0, dtype=RAW_EVENT))
+    events = np.memmap(file_name, dtype=RAW_EVENT, mode='r', offset=offset, shape=(count,))
+    return Stream(head, events)
+
+def event_times(events: np.ndarray) -> np.ndarray:
+    """Returns times of raw events, in units of 1/8 ns."""
+    return (
+        (events['high'].astype(np.uint64) << np.uint64(32 - T1_TIME_SHIFT))
+        | (events['low'] >> T1_TIME_SHIFT).astype(np.uint64)
+    )
+
+def event_patterns(events: np.ndarray, base_bits: int = 4) -> np.ndarray:
+    """Returns detector patterns of raw events."""
+    return (events['low'] & ((1 << base_bits) - 1)).astype(np.uint16)
+
+def write_T1(file_name: str, epoch: int, times, patterns, base_bits: int = 4):
+    """Writes raw events, with 'times' in units of 1/8 ns."""
+    times = np.asarray(times, dtype=np.uint64)
+    raw = (times << np.uint64(T1_TIME_SHIFT)) | np.asarray(patterns, dtype=np.uint64)
+    events = np.empty(len(raw), dtype=RAW_EVENT)
+    events['high'] = raw >> np.uint64(32)
+    events['low'] = raw & np.uint64(0xffffffff)
+    with open(file_name, 'wb') as f:
+        _write_header(f, 1, epoch, len(events), T1_BITS_PER_ENTRY, base_bits)
+        f.write(events.tobytes())
+
+
+# T2/T4
+
+def decode_timing(bits: np.ndarray, length: int, timeorder: int, base_bits: int) -> np.ndarray:
+    """Decodes 'length' timing events from a T2/T4 bit stream.
+
+    Events are decoded in batches at the regular width, up to the next
+    escape, which is then decoded on its own. Batches are sized from the
+    preceding run of regular events, so that little work is discarded at
+    an escape, and grow up to 'DECODE_BATCH' events while there are none.
+    """
+    events = np.empty(length, dtype=TIMING_EVENT)
+    width = timeorder + base_bits
+    value_mask = np.uint64((1 << base_bits) - 1)
+    n, position, time = 0, 0, np.uint64(0)
+    batch_size = MIN_DECODE_BATCH
+    while n < length:
+        batch = min(length - n, (len(bits) - position) // width, batch_size)
+        if batch <= 0:
+            raise ValueError(f'Stream truncated after {n} of {length} events')
+        fields = read_fields(bits, position, batch, width)
+        codes = fields >> np.uint64(base_bits)
+        escapes = np.flatnonzero(codes == ESCAPE_CODE)
+        k = int(escapes[0]) if len(escapes) else batch
+        if k:
+            times = time + np.cumsum(codes[:k], dtype=np.uint64)
+            events['time'][n:n + k] = times
+            events['value'][n:n + k] = fields[:k] & value_mask
+            time = times[-1]
+            n += k
+            position += k * width
+        batch_size = min(max(2 * k, MIN_DECODE_BATCH), DECODE_BATCH)
+        if k < batch:
+            position += timeorder
+            (diff,) = read_fields(bits, position, 1, ESCAPE_BITS)
+            if diff == 0:
+                raise ValueError(f'End of stream after {n} of {length} events')
+            (value,) = read_fields(bits, position + ESCAPE_BITS, 1, base_bits)
+            time += diff
+            events[n] = (time, value)
+            n += 1
+            position += ESCAPE_BITS + base_bits
+    return events
+
+def encode_timing(times, values, timeorder: int, base_bits: int) -> np.ndarray:
+    """Encodes timing events into a T2/T4 bit stream with end marker.
+
+    'times' are relative to the epoch start, and must be non-decreasing.
+    """
+    times = np.asarray(times, dtype=np.uint64)
+    diffs = np.diff(times, prepend=np.uint64(0))
+    if len(times) and (np.any(times[1:] < times[:-1]) or diffs.max() >= 1 << ESCAPE_BITS):
+        raise ValueError('Times must be non-decreasing, with differences below 2**32')
+    escaped = (diffs == ESCAPE_CODE) | (diffs >= 1 << timeorder)
+    # Each event is (code, escaped difference, value), with unused fields of zero width
+    values = np.column_stack((
+        np.where(escaped, ESCAPE_CODE, diffs), diffs, np.asarray(values, dtype=np.uint64)))
+    widths = np.column_stack((
+        np.full(len(times), timeorder), np.where(escaped, ESCAPE_BITS, 0),
+        np.full(len(times), base_bits)))
+    end_marker = fields_to_bits([ESCAPE_CODE, 0], [timeorder, ESCAPE_BITS])
+    return np.concatenate((fields_to_bits(values, widths), end_marker))
+
+def read_T2(file_name: str) -> Stream:
+    head = _read_typed_header(file_name, 2)
+    bits = words_to_bits(_map_words(file_name, HEADERS[2][1].size))
+    return Stream(head, decode_timing(bits, head.length_bits, head.timeorder, head.base_bits))
+
+def read_T4(file_name: str) -> Stream:
+    head = _read_typed_header(file_name, 4)
+    bits = words_to_bits(_map_words(file_name, HEADERS[4][1].size))
+    return Stream(head, decode_timing(bits, head.length_bits, head.timeorder, head.base_bits))
+
+def write_T2(
+        file_name: str, epoch: int, times, values,
+        timeorder: int, base_bits: int, protocol: int):
+    words = bits_to_words(encode_timing(times, values, timeorder, base_bits))
+    with open(file_name, 'wb') as f:
+        _write_header(f, 2, epoch, len(times), timeorder, base_bits, protocol)
+        f.write(words.tobytes())
+
+def write_T4(file_name: str, epoch: int, times, values, timeorder: int, base_bits: int):
+    words = bits_to_words(encode_timing(times, values, timeorder, base_bits))
+    with open(file_name, 'wb') as f:
+        _write_header(f, 4, epoch, len(times), timeorder, base_bits)
+        f.write(words.tobytes())
+
+
+# T3
+
+def read_T3(file_name: str) -> Stream:
+    """Returns raw key entries."""
+    head = _read_typed_header(file_name, 3)
+    words = _map_words(file_name, HEADERS[3][1].size)
+    if head.bits_per_entry == 8:  # e.g. service mode, decoded bytewise
+        entries = words.astype('>u4').view(np.uint8)[:head.length_entry]
+    else:
+        bits = words_to_bits(words)
+        entries = read_fields(bits, 0, head.length_entry, head.bits_per_entry)
+    if len(entries) < head.length_entry:
+        raise ValueError(f"'{file_name}' truncated")
+    return Stream(head, entries)
+
+def write_T3(file_name: str, epoch: int, entries, bits_per_entry: int):
+    entries = np.asarray(entries, dtype=np.uint64)
+    bits = fields_to_bits(entries, np.full(len(entries), bits_per_entry))
+    with open(file_name, 'wb') as f:
+        _write_header(f, 3, epoch, len(entries), bits_per_entry)
+        f.write(bits_to_words(bits).tobytes())
+
+
+# T7
+
+def read_T7(file_name: str) -> Stream:
+    """Returns final key bits."""
+    head = _read_typed_header(file_name, 7)
+    bits = words_to_bits(_map_words(file_name, HEADERS[7][1].size))[:head.length_bits]
+    if len(bits) < head.length_bits:
+        raise ValueError(f"'{file_name}' truncated")
+    return Stream(head, bits)
+
+def write_T7(file_name: str, epoch: int, bits, num_epoch: int = 1):
+    bits = np.asarray(bits, dtype=np.uint8)
+    with open(file_name, 'wb') as f:
+        _write_header(f, 7, epoch, num_epoch, len(bits))
+        f.write(bits_to_words(bits).tobytes())
+
+
+READERS = {1: read_T1, 2: read_T2, 3: read_T3, 4: read_T4, 7: read_T7}
+
+def read_stream(file_name: str) -> Optional[Stream]:
+    """Reads a stream file of any type, or returns None if unrecognized."""
+    head = read_header(file_name)
+    if head is None:
+        return None
+    return READERS[head.tag & 0xff](file_name)
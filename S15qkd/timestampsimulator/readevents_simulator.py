@@ -5,7 +5,9 @@ import sys
 import math
 import time
 
-import os
+from timestamp_simulator import stream_chunks, stream_entangled_pair_source
+
+CHUNK_EVENTS = 65536  # events per write
 
 def time_pattern_to_byte_timestamp(time, pattern, dt_units_ps=125):
     """
@@ -40,37 +42,71 @@ def _data_extractor(filename, highres_tscard=False):
         return t, p
 
 
-def write_to_stdout(time_list: list, pattern_list: list):
-    diff_time_list = np.diff(time_list)
-    diff_time_list = np.append(time_list[0], diff_time_list)
-    t_running = 0
+def replay_chunks(time_list, pattern_list, chunk_events=CHUNK_EVENTS):
+    """Yields (times in s, patterns) chunks of the recording, repeated endlessly.
+
+    Each repetition continues after the last event of the previous one.
+    """
+    times = np.asarray(time_list, dtype=np.float64) * 1e-9
+    patterns = np.asarray(pattern_list, dtype=np.uint64)
+    if len(times) == 0:
+        return
+    offset = 0.0
+    while True:
+        for i in range(0, len(times), chunk_events):
+            yield offset + times[i:i + chunk_events], patterns[i:i + chunk_events]
+        offset += times[-1]
+
 
+def write_to_stdout(time_list: list, pattern_list: list, speed: float = 1.0):
+    """Replays events with times in ns to stdout, paced in real time.
+
+    Events are written chunk by chunk, each with a single write once its
+    last event is due.
+    """
     with os.fdopen(sys.stdout.fileno(), "wb", 0, closefd=False) as stdout:
-        while True:
-            for dt, p in zip(diff_time_list, pattern_list):
-                # The sleep slows down the printing. However sleep is not very precies on a micro second scale.
-                # Adjust denominator until it works for you. This is ugly and I know it.
-                t_running += dt
-                time.sleep(dt * 1e-9 / 2.5)
-                stdout.write(time_pattern_to_byte_timestamp(
-                    t_running * 1e3, int(p)))
-                stdout.flush()
-
-
-def main(file_name):
+        stream_chunks(replay_chunks(time_list, pattern_list), stdout, speed=speed)
+
+
+def main(file_name, speed: float = 1.0):
     t, p = _data_extractor(file_name)
-    start = time.time()
-    write_to_stdout(t, p)
-    # print(f'\nRun time: {time.time() - start}')
+    write_to_stdout(t, p, speed)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Optional app description')
     parser.add_argument('-infile', type=str,
                         help='input file which is written to the stdout')
+    parser.add_argument('-speed', type=float, default=1.0,
+                        help='replay speed relative to real time')
+    parser.add_argument('-rate', type=float,
+                        help='simulate entangled pair source at this pair rate (1/s) instead')
+    parser.add_argument('-side', choices=('alice', 'bob'), default='alice',
+                        help='side of simulated pair source to output')
+    parser.add_argument('-nopace', action='store_true',
+                        help='write simulated events as fast as possible')
+    parser.add_argument('-seed', type=int,
+                        help='random seed, must be identical for both sides')
+    parser.add_argument('-start_ns', type=int,
+                        help='common start time of both sides in ns since the Unix epoch, '
+                             'timestamps are absolute if given')
+    parser.add_argument('-qber', type=float, default=0.0,
+                        help='probability of a bit error in matching bases')
+    parser.add_argument('-drift', type=float, default=0.0,
+                        help='relative clock frequency offset of bob')
+    parser.add_argument('-offset', type=float, default=0.0,
+                        help='clock offset of bob in seconds')
+    parser.add_argument('-background', type=float, default=0.0,
+                        help='rate of uncorrelated events per side (1/s)')
     args = parser.parse_args()
-    if args.infile:
-        main(args.infile)
+    if args.rate:
+        with os.fdopen(sys.stdout.fileno(), "wb", 0, closefd=False) as stdout:
+            stream_entangled_pair_source(
+                args.rate, stdout, args.side, pace=not args.nopace,
+                start_ns=args.start_ns, seed=args.seed, qber=args.qber,
+                drift=args.drift, offset=args.offset, background_rate=args.background)
+    elif args.infile:
+        main(args.infile, args.speed)
 
     else:
         main('../data/simulated_timestamps/bob_correlated.ts')
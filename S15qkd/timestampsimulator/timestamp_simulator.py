@@ -2,6 +2,7 @@
 import os
 from random import randint
 import math
+import time
 import numpy as np
 import argparse
 
@@ -26,6 +27,67 @@ def time_pattern_to_byte_timestamp(time, pattern, dt_units_ps=125):
     return ((ts >> 32) + ((ts & 0xFFFFFFFF) << 32)).to_bytes(8, 'little')
 
 
+TIME_MASK = (1 << 49) - 1  # time bits of a 64 bit timestamp
+
+
+def pack_timestamps(times, patterns, dt_units_ps=125, offset=0):
+    """Vectorized 'time_pattern_to_byte_timestamp' for arrays of events.
+
+    :param times: event times in units of ps
+    :param patterns: detector patterns
+    :param offset: integer added to all timestamps, in units of 'dt_units_ps',
+        e.g. an absolute start time too large for float precision. Times
+        wrap around after 49 bits, as on the timestamp card.
+    :returns: uint32 array of shape (N, 2), holding the high word followed by
+        the low word of each event, whose bytes form the timestamp stream
+    """
+    ts = np.ceil(np.asarray(times, dtype=np.float64) / dt_units_ps).astype(np.int64)
+    ts = ((ts + np.int64(offset)) & TIME_MASK).astype(np.uint64)
+    ts = (ts << np.uint64(15)) | np.asarray(patterns, dtype=np.uint64)
+    words = np.empty((len(ts), 2), dtype='<u4')
+    words[:, 0] = ts >> np.uint64(32)
+    words[:, 1] = ts & np.uint64(0xFFFFFFFF)
+    return words
+
+
+def write_timestamps(f, times, patterns):
+    """Writes events with times in seconds into a binary file object."""
+    f.write(pack_timestamps(np.asarray(times) * 1e12, patterns).tobytes())
+
+
+def stream_chunks(chunks, f, pace=True, speed=1.0, start_ns=None):
+    """Writes chunks of (times, patterns), with times in seconds, into 'f'.
+
+    Each chunk is packed and written with a single call. With 'pace', each
+    chunk is held back until its last event is due in real time, scaled by
+    'speed', so the stream is emitted at the simulated event rate.
+
+    With 'start_ns', a wall clock time in ns since the Unix epoch, times are
+    relative to 'start_ns' and timestamps are absolute, like those of a
+    timestamp card synchronized to the host clock. Independent streams
+    sharing 'start_ns' are then aligned in time.
+
+    :returns: number of events written
+    """
+    offset = 0
+    start = time.time()
+    if start_ns is not None:
+        offset = (start_ns * 8) & TIME_MASK  # timestamp units of 1/8 ns
+        start = start_ns * 1e-9
+    num_events = 0
+    for times, patterns in chunks:
+        if len(times) == 0:
+            continue
+        data = pack_timestamps(np.asarray(times) * 1e12, patterns, offset=offset).tobytes()
+        if pace:
+            delay = start + times[-1] / speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        f.write(data)
+        num_events += len(times)
+    return num_events
+
+
 def simulate_pair_source_timestamps(file_name, rate_photon_1, rate_photon_2, rate_pairs, tot_time, pattern_photon_1=int('0001', 2), pattern_photon_2=int('0010', 2), pair_delay=1e-6):
 
     # create photon waiting times from an exponential distribution
@@ -53,8 +115,7 @@ def simulate_pair_source_timestamps(file_name, rate_photon_1, rate_photon_2, rat
 
     # write to file
     with open(file_name, "wb") as f:
-        for row in tmp:
-            f.write(time_pattern_to_byte_timestamp(row[0] * 1e12, int(row[1])))
+        write_timestamps(f, tmp[:, 0], tmp[:, 1].astype(np.uint64))
 
 
 def simulate_pair_source_timestamps_write_into_two_files(file_name_ph1, file_name_ph2,
@@ -94,77 +155,116 @@ def simulate_pair_source_timestamps_write_into_two_files(file_name_ph1, file_nam
 
     # write to file
     with open(file_name_ph1, "wb") as f:
-        for row in time_and_pattern_photon1:
-            f.write(time_pattern_to_byte_timestamp(row[0] * 1e12, int(row[1])))
+        write_timestamps(
+            f, time_and_pattern_photon1[:, 0], time_and_pattern_photon1[:, 1].astype(np.uint64))
 
     with open(file_name_ph2, "wb") as f:
-        for row in time_and_pattern_photon2:
-            f.write(time_pattern_to_byte_timestamp(row[0] * 1e12, int(row[1])))
+        write_timestamps(
+            f, time_and_pattern_photon2[:, 0], time_and_pattern_photon2[:, 1].astype(np.uint64))
+
+
+# Detector patterns indexed by [basis][bit], with basis 1 for H/V and 0 for D/AD
+ALICE_PATTERNS = np.array([[0b1 << 1, 0b1 << 3], [0b1 << 2, 0b1 << 0]], dtype=np.uint64)
+BOB_PATTERNS = np.array([[0b1 << 3, 0b1 << 1], [0b1 << 0, 0b1 << 2]], dtype=np.uint64)
+
+
+def random_patterns(rng, n):
+    """Returns 'n' random single detector patterns."""
+    return np.left_shift(np.uint64(1), rng.integers(0, 4, n).astype(np.uint64))
+
+
+def merge_events(times, patterns, rng, rate, t_range):
+    """Adds uncorrelated events at 'rate' within 't_range', keeping time order."""
+    n = rng.poisson(rate * (t_range[1] - t_range[0]))
+    if n == 0:
+        return times, patterns
+    times = np.concatenate((times, rng.uniform(*t_range, n)))
+    patterns = np.concatenate((patterns, random_patterns(rng, n)))
+    order = np.argsort(times, kind='stable')
+    return times[order], patterns[order]
+
+
+def entangled_pair_chunks(rate_pairs, tot_time=None, chunk_time=0.1, photon_delay=1e-6, rng=None,
+                          qber=0.0, drift=0.0, offset=0.0, background_rate=0.0, seed=None, t_begin=0.0):
+    """Yields events of an entangled pair source, chunk by chunk.
+
+    Pairs are emitted as a Poisson process. Alice and Bob each choose a basis
+    at random, and obtain correlated outcomes if the bases match, otherwise
+    independent random outcomes.
+
+    Link imperfections are emulated on Bob's side: his bit is flipped with
+    probability 'qber' when the bases match, and his clock runs fast by the
+    relative frequency 'drift' and is ahead by 'offset' seconds. Each side
+    also records uncorrelated background events at 'background_rate'.
+
+    With 'seed', each chunk is drawn from its own generator seeded by 'seed'
+    and the chunk index, so that the two sides can be generated by independent
+    processes, which may also resume the source at any time 't_begin'.
+
+    :param tot_time: simulated duration in seconds, endless if None
+    :param chunk_time: simulated duration of each chunk in seconds
+    :param t_begin: simulated time of the first chunk in seconds, rounded down
+        to a chunk boundary
+    :returns: generator of (times_alice, patterns_alice, times_bob, patterns_bob),
+        with times in seconds
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    index = int(t_begin // chunk_time)
+    while tot_time is None or index * chunk_time < tot_time:
+        t_start, t_end = index * chunk_time, (index + 1) * chunk_time
+        if tot_time is not None:
+            t_end = min(t_end, tot_time)
+        if seed is not None:
+            rng = np.random.default_rng((seed, index))
+        n = rng.poisson(rate_pairs * (t_end - t_start))
+        times = np.sort(rng.uniform(t_start, t_end, n))
+        basis_alice = rng.integers(0, 2, n)
+        basis_bob = rng.integers(0, 2, n)
+        bit_alice = rng.integers(0, 2, n)
+        flip = rng.random(n) < qber
+        bit_bob = np.where(basis_alice == basis_bob, bit_alice ^ flip, rng.integers(0, 2, n))
+        times_alice, patterns_alice = times, ALICE_PATTERNS[basis_alice, bit_alice]
+        times_bob, patterns_bob = times + photon_delay, BOB_PATTERNS[basis_bob, bit_bob]
+        if background_rate:
+            times_alice, patterns_alice = merge_events(
+                times_alice, patterns_alice, rng, background_rate, (t_start, t_end))
+            times_bob, patterns_bob = merge_events(  # within same delayed chunk
+                times_bob, patterns_bob, rng, background_rate,
+                (t_start + photon_delay, t_end + photon_delay))
+        yield (times_alice, patterns_alice,
+               times_bob * (1 + drift) + offset, patterns_bob)
+        index += 1
 
 
 def simulated_entangled_pair_source(rate_pairs, tot_time, photon_delay=1e-6, file_alice='alice_entangled.ts', file_bob='bob_entangled.ts'):
-    H_PATTERN_Alice = 0b1 << 2
-    H_PATTERN_Bob = 0b1 << 0
-    V_PATTERN_Alice = 0b1 << 0
-    V_PATTERN_Bob = 0b1 << 2
-    D_PATTERN_Alice = 0b1 << 1
-    D_PATTERN_Bob = 0b1 << 3
-    AD_PATTERN_Alice = 0b1 << 3
-    AD_PATTERN_Bob = 0b1 << 1
-
-    time_stamp_Alice = []
-    time_stamp_Bob = []
-    running_time = 0
-    while running_time < tot_time:
-        running_time += np.random.exponential(1 / rate_pairs, 1)[0]
-        # print(running_time)
-        basis_choice_Alice = np.random.binomial(1, 0.5, 1).astype(bool)
-        basis_choice_Bob = np.random.binomial(1, 0.5, 1).astype(bool)
-        if basis_choice_Alice and basis_choice_Bob:
-            if np.random.binomial(1, 0.5, 1).astype(bool):
-                time_stamp_Alice.append([running_time, H_PATTERN_Alice])
-                time_stamp_Bob.append([running_time, H_PATTERN_Bob])
-            else:
-                time_stamp_Alice.append([running_time, V_PATTERN_Alice])
-                time_stamp_Bob.append([running_time, V_PATTERN_Bob])
-        elif (not basis_choice_Alice) and (not basis_choice_Bob):
-            if np.random.binomial(1, 0.5, 1).astype(bool):
-                time_stamp_Alice.append([running_time, D_PATTERN_Alice])
-                time_stamp_Bob.append([running_time, D_PATTERN_Bob])
-            else:
-                time_stamp_Alice.append([running_time, AD_PATTERN_Alice])
-                time_stamp_Bob.append([running_time, AD_PATTERN_Bob])
-
-        elif basis_choice_Alice and (not basis_choice_Bob):
-            if np.random.binomial(1, 0.5, 1).astype(bool):
-                time_stamp_Alice.append([running_time, H_PATTERN_Alice])
-            else:
-                time_stamp_Alice.append([running_time, V_PATTERN_Alice])
-            if np.random.binomial(1, 0.5, 1).astype(bool):
-                time_stamp_Bob.append([running_time, D_PATTERN_Bob])
-            else:
-                time_stamp_Bob.append([running_time, AD_PATTERN_Bob])
-
-        elif (not basis_choice_Alice) and basis_choice_Bob:
-            if np.random.binomial(1, 0.5, 1).astype(bool):
-                time_stamp_Alice.append([running_time, D_PATTERN_Alice])
-            else:
-                time_stamp_Alice.append([running_time, AD_PATTERN_Alice])
-            if np.random.binomial(1, 0.5, 1).astype(bool):
-                time_stamp_Bob.append([running_time, H_PATTERN_Bob])
-            else:
-                time_stamp_Bob.append([running_time, V_PATTERN_Bob])
-
-
-    with open(file_alice, "wb") as f:
-        for row in time_stamp_Alice:
-            f.write(time_pattern_to_byte_timestamp(row[0] * 1e12, int(row[1])))
-
-    with open(file_bob, "wb") as f:
-        for row in time_stamp_Bob:
-            f.write(time_pattern_to_byte_timestamp((row[0] + photon_delay) * 1e12, int(row[1])))
+    with open(file_alice, "wb") as fa, open(file_bob, "wb") as fb:
+        for times_a, patterns_a, times_b, patterns_b in entangled_pair_chunks(
+                rate_pairs, tot_time, photon_delay=photon_delay):
+            write_timestamps(fa, times_a, patterns_a)
+            write_timestamps(fb, times_b, patterns_b)
+
 
+def stream_entangled_pair_source(rate_pairs, f, side='alice', tot_time=None, pace=True, chunk_time=0.01,
+                                 start_ns=None, seed=None, **link):
+    """Streams one side of an entangled pair source into 'f', e.g. RAWEVENTS.
 
+    Both sides of a link are streamed by separate calls with the same 'seed',
+    'start_ns' and 'link' parameters, see 'entangled_pair_chunks'. With
+    'start_ns' in the past, e.g. when restarted, the source resumes at the
+    current time instead of replaying past events.
+
+    :returns: number of events written
+    """
+    t_begin = 0.0
+    if start_ns is not None:
+        t_begin = max(0.0, (time.time_ns() - start_ns) * 1e-9)
+    chunks = entangled_pair_chunks(rate_pairs, tot_time, chunk_time, seed=seed, t_begin=t_begin, **link)
+    if side == 'alice':
+        events = ((c[0], c[1]) for c in chunks)
+    else:
+        events = ((c[2], c[3]) for c in chunks)
+    return stream_chunks(events, f, pace=pace, start_ns=start_ns)
 
 
 def read_file_write_to_stdout(file_name):
@@ -30,10 +30,13 @@ SOFTWARE.
 
 from enum import Enum, auto, unique
 import os
+import socket
 import subprocess
+import threading
 import time
 
 from .utils import Process
+from .epoch_trace import epoch_trace
 from .qkd_globals import logger, PipesQKD, FoldersQKD, kill_process_by_name
 
 # Almost guaranteed to be connected due to authd
@@ -60,9 +63,15 @@ class SymmetryNegotiationState(int, Enum):
 
 class Transferd(Process):
 
+    CONTROL_RETRY_INTERVAL = 0.5  # seconds between checks of the authd control channel
+
     def __init__(self, program):
         super().__init__(program)
         self._pkill_transferd()
+        self._control = None
+        self._control_reader = None
+        self._control_lock = threading.Lock()
+        self._control_monitor_thread = None
         self._reset()
 
     def _pkill_transferd(self):
@@ -93,6 +102,8 @@ class Transferd(Process):
             return
 
         self._reset()
+        with self._control_lock:
+            self._close_control()
         self._callback_msgout = callback_msgout
         self._callback_localrate = callback_localrate
         
@@ -106,18 +117,20 @@ class Transferd(Process):
             '-M', PipesQKD.MSGOUT,
             '-p', Process.config.port_transd,
             '-k',
-            '-e', PipesQKD.ECS,
-            '-E', PipesQKD.ECR,
             # Non-existent IP to avoid port binding conflict with authd
             '-s', '127.0.0.2', 
         ]
+        # Error correction packets are otherwise relayed by authd directly
+        if not getattr(Process.config, 'authd_errc_channel', False):
+            args += ['-e', PipesQKD.ECS, '-E', PipesQKD.ECR]
         super().start(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
-        self.read(PipesQKD.MSGOUT, self.digest_msgout, wait=0.05, name="transferd.msgout", persist=False)
-        self.read(PipesQKD.TRANSFERLOG, self.digest_transferlog, wait=0.1, name="transferd.transferlog", persist=False)
-        self.read(self.process.stdout, self.digest_stdout, wait=0.1, name="transferd.stdout", persist=False)
-        self.read(self.process.stderr, self.digest_stderr, wait=0.1, name="transferd.stderr", persist=False)
+        self.read(PipesQKD.MSGOUT, self.digest_msgout, name="transferd.msgout", persist=False)
+        self.read(PipesQKD.TRANSFERLOG, self.digest_transferlog, name="transferd.transferlog", persist=False)
+        self.read(self.process.stdout, self.digest_stdout, name="transferd.stdout", persist=False)
+        self.read(self.process.stderr, self.digest_stderr, name="transferd.stderr", persist=False)
 
+        self._control_monitor_thread = super().start_thread_method(self._control_monitor)
         time.sleep(0.2)  # give some time to connect to the partnering computer
 
     
@@ -152,6 +165,7 @@ class Transferd(Process):
             return
         
         self._last_received_epoch = message
+        epoch_trace.stamp('transferd', message)
         logger.debug(f'[read msg] {message}')
         if self._first_received_epoch == None:
             self._first_received_epoch = message
@@ -165,7 +179,16 @@ class Transferd(Process):
         message = pipe.readline().lstrip('\x00').rstrip('\n')
         if len(message) == 0:
             return
-        
+        self._digest_message(message)
+
+    def digest_control(self, pipe):
+        """Digests messages received over the authd control channel, see 'send()'."""
+        message = pipe.readline().rstrip('\n')
+        if len(message) == 0:
+            return
+        self._digest_message(message)
+
+    def _digest_message(self, message: str):
         logger.info(f'[received message] {message}')
         if message.split(':')[0] in {'ne1', 'ne2', 'ne3'}:
             self.negotiate_symmetry(message)
@@ -260,11 +283,78 @@ class Transferd(Process):
             self._negotiating = SymmetryNegotiationState.FINISHED
 
     def send(self, message: str):
-        """Writes to MSGIN pipe, which is forwarded to remote."""
+        """Sends message to remote controller.
+
+        Messages are sent over the authd control channel, which authd schedules
+        ahead of epoch and error correction traffic. Falls back to the MSGIN
+        pipe, which is forwarded by transferd, if the control channel is not
+        connected (yet), see '_control_monitor()'.
+        """
+        with self._control_lock:
+            if self._control is not None and self._control_reader.closed:
+                self._close_control()  # authd closed connection, e.g. on restart
+            if self._control is not None:
+                try:
+                    self._control.sendall(f'{message}\n'.encode())
+                    logger.info(message)
+                    return
+                except OSError as e:
+                    logger.warning(f'authd control channel failed ({e}), reconnecting.')
+                    self._close_control()
         Process.write(PipesQKD.MSGIN, message)
         logger.info(message)
         #time.sleep(1)
 
+    def _control_monitor(self, stop_event):
+        """Keeps the authd control channel connected while transferd runs.
+
+        authd only listens on the control port shortly after it is started,
+        and closes the connection when restarted, so connecting is retried
+        until it succeeds, and again once the reactor sees the connection
+        closed. Messages from the remote controller are only received while
+        connected, regardless of whether this side sends any.
+        """
+        attempts = 0
+        while not stop_event.is_set() and self.is_running() \
+                and threading.current_thread() is self._control_monitor_thread:
+            with self._control_lock:
+                if self._control is not None and self._control_reader.closed:
+                    logger.info('authd control channel closed, reconnecting.')
+                    self._close_control()
+                if self._control is None:
+                    attempts = 0 if self._connect_control(quiet=attempts > 0) else attempts + 1
+            stop_event.wait(Transferd.CONTROL_RETRY_INTERVAL)
+        with self._control_lock:
+            if threading.current_thread() is self._control_monitor_thread:
+                self._close_control()
+
+    def _connect_control(self, quiet: bool = False) -> bool:
+        """Connects to the control port of the local authd. Lock held."""
+        port = getattr(Process.config, 'port_authd_control', Process.config.port_transd + 1)
+        try:
+            sock = socket.create_connection((Process.config.local_authd_ip, port), timeout=1)
+        except OSError as e:
+            log = logger.debug if quiet else logger.warning
+            log(f'authd control channel unavailable ({e}), retrying.')
+            return False
+        sock.settimeout(5)  # also keeps sends safe on the non-blocking descriptor
+        self._control_reader = self.read(
+            sock.makefile('r'), self.digest_control, name='authd.control', persist=False)
+        if self._control_reader is None:
+            sock.close()
+            return False
+        self._control = sock
+        logger.info(f'Connected to authd control channel on port {port}.')
+        return True
+
+    def _close_control(self):
+        """Closes the authd control channel. Lock held."""
+        if self._control is None:
+            return
+        Process.reactor.unregister(self._control_reader)
+        self._control.close()
+        self._control = self._control_reader = None
+
     def is_running(self):
         result = super().is_running()
         # Ported from digest_stdout, marking comms via termination:
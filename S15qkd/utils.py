@@ -1,16 +1,24 @@
 # Abstract away common patterns across the different processes
+import array
+import fcntl
 import json
 import os
 import time
 import io
 import threading
 import math
-from struct import unpack
+import multiprocessing
+import selectors
+import collections
+import termios
+from concurrent.futures import ThreadPoolExecutor
+from struct import unpack_from
 from pathlib import Path
 import subprocess
-from types import SimpleNamespace, FunctionType
-from typing import Union, Optional, NamedTuple
+from types import SimpleNamespace, FunctionType, MappingProxyType
+from typing import Union, Optional, NamedTuple, Mapping
 
+import numpy as np
 import psutil
 
 # Relative import (i.e. 'from . import ...') avoided
@@ -18,6 +26,12 @@ import psutil
 # to load the default configuration (currently not running 'authd.py' as part of package)
 from S15qkd import qkd_globals
 from S15qkd.qkd_globals import QKDProtocol, logger, PipesQKD, FoldersQKD
+from S15qkd.streams import HeadT1, HeadT2, HeadT3, HeadT4  # re-exported
+from S15qkd.metrics import registry
+from S15qkd.resources import ResourceAccounting
+
+process_restarts_total = registry.counter(
+    'qkd_process_restarts_total', 'Restarts triggered by the process monitor.', ('process',))
 
 def class2dict(instance, built_dict={}):
     """Converts nested class items into nested dictionaries
@@ -30,6 +44,465 @@ def class2dict(instance, built_dict={}):
         new_subdic[key] = class2dict(value)
     return new_subdic
 
+class PipeReader:
+    """Line reader attached to a pipe, see 'PipeReactor.register()'."""
+
+    def __init__(self, owner, fd, callback, name, is_text, predicate, file=None):
+        self.owner = owner
+        self.fd = fd
+        self.callback = callback
+        self.name = name
+        self.is_text = is_text
+        self.predicate = predicate
+        self.file = file  # original file object, closed together with fd
+        self.closed = False
+        self._buffer = b''
+        self._lines = collections.deque()
+        self._scheduled = False
+        self._lock = threading.Lock()
+
+    def feed(self, data: bytes) -> bool:
+        """Buffers data and returns True if a dispatch should be scheduled."""
+        *lines, self._buffer = (self._buffer + data).split(b'\n')
+        if not lines:
+            return False
+        with self._lock:
+            self._lines.extend(lines)
+            if self._scheduled:
+                return False
+            self._scheduled = True
+            return True
+
+    def dispatch(self):
+        """Runs callback on buffered lines, in order of arrival.
+
+        The callback receives a file-like object containing a single line,
+        mirroring the previous interface where callbacks read directly from
+        the pipe.
+        """
+        while True:
+            with self._lock:
+                if not self._lines or self.closed:
+                    self._scheduled = False
+                    return
+                line = self._lines.popleft()
+            line += b'\n'
+            if self.is_text:
+                pipe = io.StringIO(line.decode(errors='replace'))
+            else:
+                pipe = io.BytesIO(line)
+            try:
+                self.callback(pipe)
+            except Exception:
+                logger.exception(f"Error while digesting '{self.name}'.")
+
+    def backlog(self) -> int:
+        """Returns bytes written to the pipe but not yet digested."""
+        with self._lock:
+            pending = len(self._buffer) + sum(len(line) + 1 for line in self._lines)
+        try:
+            unread = array.array('i', [0])
+            fcntl.ioctl(self.fd, termios.FIONREAD, unread)
+            pending += unread[0]
+        except OSError:
+            pass
+        return pending
+
+    def close(self):
+        self.closed = True
+        try:
+            if self.file is not None:
+                self.file.close()
+            else:
+                os.close(self.fd)
+        except OSError:
+            pass
+
+
+class PipeReactor:
+    """Watches all pipes read by processes from a single selector thread.
+
+    Lines are dispatched to the callbacks as soon as they arrive, instead of
+    polling each pipe from a dedicated thread. Callbacks run on a shared thread
+    pool, so that a callback blocking on another pipe (e.g. the controller
+    waiting for a transferd message while digesting a costream restart) does
+    not stall the reactor. Lines from the same pipe are always digested
+    sequentially and in order.
+
+    Named pipes are opened read-write and non-blocking, which neither blocks
+    until a writer appears nor signals EOF when the writer closes. Readers are
+    removed when unregistered, or when their predicate no longer holds, which
+    is checked every 'PRUNE_INTERVAL' seconds.
+    """
+
+    PRUNE_INTERVAL = 1  # seconds
+    MAX_WORKERS = 16
+    CHUNK_SIZE = 65536
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._readers = set()
+        self._lock = threading.Lock()
+        self._pending = collections.deque()  # (register, reader)
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._executor = ThreadPoolExecutor(self.MAX_WORKERS, thread_name_prefix='pipe_cb')
+        self._thread = None
+
+    def register(self, owner, pipe, callback, name='', predicate=None) -> PipeReader:
+        """Attaches callback to pipe, which is either a path or an open file object."""
+        if isinstance(pipe, io.IOBase):
+            fd = pipe.fileno()
+            reader = PipeReader(
+                owner, fd, callback, name, isinstance(pipe, io.TextIOBase), predicate, file=pipe)
+        else:
+            fd = os.open(pipe, os.O_RDWR | os.O_NONBLOCK)
+            reader = PipeReader(owner, fd, callback, name, True, predicate)
+        os.set_blocking(fd, False)
+        with self._lock:
+            self._readers.add(reader)
+            self._pending.append((True, reader))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='pipe_reactor', daemon=True)
+                self._thread.start()
+        self._wakeup()
+        logger.info(f"Named pipe '{name}' opened.")
+        return reader
+
+    def unregister(self, reader: PipeReader):
+        """Detaches reader. Lines not yet digested are discarded."""
+        with self._lock:
+            if reader not in self._readers:
+                return
+            self._readers.discard(reader)
+            reader.closed = True
+            self._pending.append((False, reader))
+        self._wakeup()
+
+    def backlog(self) -> dict:
+        """Returns the undigested bytes of each pipe, by pipe name."""
+        with self._lock:
+            readers = list(self._readers)
+        return {reader.name: reader.backlog() for reader in readers if not reader.closed}
+
+    def unregister_owner(self, owner):
+        with self._lock:
+            readers = [r for r in self._readers if r.owner is owner]
+        for reader in readers:
+            self.unregister(reader)
+
+    def _wakeup(self):
+        try:
+            os.write(self._wakeup_w, b'\0')
+        except BlockingIOError:
+            pass  # reactor already pending wakeup
+
+    def _apply_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, collections.deque()
+        for is_register, reader in pending:
+            if is_register:
+                if not reader.closed:
+                    self._selector.register(reader.fd, selectors.EVENT_READ, reader)
+                continue
+            try:
+                self._selector.unregister(reader.fd)
+            except (KeyError, ValueError):
+                pass
+            reader.close()
+            logger.info(f"Named pipe '{reader.name}' closed.")
+
+    def _prune(self):
+        with self._lock:
+            readers = list(self._readers)
+        for reader in readers:
+            if reader.predicate is not None and not reader.predicate():
+                self.unregister(reader)
+
+    def _run(self):
+        last_prune = time.monotonic()
+        while True:
+            self._apply_pending()
+            for key, _ in self._selector.select(timeout=self.PRUNE_INTERVAL):
+                if key.fd == self._wakeup_r:
+                    try:
+                        os.read(self._wakeup_r, self.CHUNK_SIZE)
+                    except BlockingIOError:
+                        pass
+                    continue
+                reader = key.data
+                if reader.closed:
+                    continue
+                try:
+                    data = os.read(reader.fd, self.CHUNK_SIZE)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    data = b''
+                if not data:  # EOF, only for non-FIFO pipes, e.g. stdout
+                    self.unregister(reader)
+                    continue
+                if reader.feed(data):
+                    self._executor.submit(reader.dispatch)
+            if time.monotonic() - last_prune > self.PRUNE_INTERVAL:
+                self._prune()
+                last_prune = time.monotonic()
+
+
+class ProcessInfo(NamedTuple):
+    running: bool
+    pid: Optional[int] = None
+    cpu_percent: Optional[float] = None  # since previous refresh
+    rss: Optional[int] = None  # bytes
+    uptime: Optional[float] = None  # seconds
+
+
+class ProcessSnapshot(NamedTuple):
+    version: int  # incremented when a process starts or stops
+    time: float  # of last refresh, seconds since epoch
+    processes: Mapping[str, ProcessInfo]
+    states: Mapping[str, bool]  # running, by name
+
+    def as_dict(self) -> dict:
+        return {
+            'version': self.version,
+            'time': self.time,
+            'processes': {name: info._asdict() for name, info in self.processes.items()},
+        }
+
+
+class ProcessSupervisor:
+    """Keeps an immutable snapshot of the states of the tracked processes.
+
+    The snapshot is refreshed from a single thread when a process starts or
+    stops (see 'Process.start' and 'Process.stop'), when a process exits,
+    observed through a pidfd becoming readable, and every 'interval' seconds
+    to update the CPU and memory usage. Readers take 'snapshot' without
+    locks and without any system calls. Detailed resource usage of the
+    processes, and the backlog of the pipes, is sampled at the same fixed
+    interval into 'accounting', see 'S15qkd/resources.py'.
+
+    Without pidfd support (Linux < 5.3), exits are observed on the periodic
+    refresh instead.
+    """
+
+    CHUNK_SIZE = 4096
+
+    def __init__(self, interval: float = 2, backlog=dict):
+        self.interval = interval
+        self.accounting = ResourceAccounting()
+        self._backlog = backlog  # returns undigested bytes by pipe name
+        self.snapshot = ProcessSnapshot(0, time.time(), MappingProxyType({}), MappingProxyType({}))
+        self._tracked = {}  # name -> Process
+        self._callbacks = []
+        self._selector = selectors.DefaultSelector()
+        self._pidfds = {}  # pid -> pidfd
+        self._lock = threading.Lock()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._thread = None
+
+    def track(self, name: str, process: 'Process'):
+        """Includes 'process' in the snapshot as 'name', not running until refreshed."""
+        with self._lock:
+            self._tracked[name] = process
+            if name not in self.snapshot.processes:
+                previous = self.snapshot
+                self.snapshot = previous._replace(
+                    processes=MappingProxyType({**previous.processes, name: ProcessInfo(False)}),
+                    states=MappingProxyType({**previous.states, name: False}))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='process_supervisor', daemon=True)
+                self._thread.start()
+        self.notify()
+
+    def add_callback(self, callback):
+        """Calls 'callback(snapshot)' from the supervisor thread on every change."""
+        self._callbacks.append(callback)
+
+    def notify(self):
+        """Requests an immediate refresh, e.g. after a process started."""
+        try:
+            os.write(self._wakeup_w, b'\0')
+        except BlockingIOError:
+            pass  # refresh already pending
+
+    def _watch(self, pid: int):
+        if pid in self._pidfds or not hasattr(os, 'pidfd_open'):
+            return
+        try:
+            pidfd = os.pidfd_open(pid)
+        except OSError:
+            return  # already exited, or pidfd unsupported
+        self._pidfds[pid] = pidfd
+        self._selector.register(pidfd, selectors.EVENT_READ, pid)
+
+    def _unwatch(self, pid: int):
+        pidfd = self._pidfds.pop(pid, None)
+        if pidfd is not None:
+            self._selector.unregister(pidfd)
+            os.close(pidfd)
+
+    @staticmethod
+    def _info(popen, now: float) -> ProcessInfo:
+        if popen is None or popen.poll() is not None:  # poll also reaps the child
+            return ProcessInfo(False)
+        try:
+            with popen.oneshot():
+                return ProcessInfo(
+                    True, popen.pid, popen.cpu_percent(),
+                    popen.memory_info().rss, now - popen.create_time())
+        except psutil.Error:
+            return ProcessInfo(True, popen.pid)
+
+    def _refresh(self):
+        now = time.time()
+        with self._lock:
+            tracked = list(self._tracked.items())
+        processes = {name: self._info(process.process, now) for name, process in tracked}
+        pids = {info.pid for info in processes.values() if info.running}
+        for pid in pids:
+            self._watch(pid)
+        for pid in set(self._pidfds) - pids:
+            self._unwatch(pid)
+
+        previous = self.snapshot
+        states = {name: info.running for name, info in processes.items()}
+        changed = states != previous.states or any(
+            info.pid != previous.processes.get(name, ProcessInfo(False)).pid
+            for name, info in processes.items())
+        self.snapshot = ProcessSnapshot(
+            previous.version + changed, now,
+            MappingProxyType(processes), MappingProxyType(states))
+        if changed:
+            for callback in self._callbacks:
+                try:
+                    callback(self.snapshot)
+                except Exception as e:
+                    logger.error(f'Process state callback failed: {e!r}')
+
+    def _sample(self):
+        with self._lock:
+            tracked = list(self._tracked.items())
+        states = self.snapshot.states
+        processes = {
+            name: process.process if states.get(name) else None
+            for name, process in tracked
+        }
+        try:
+            self.accounting.sample(processes, self._backlog())
+        except Exception as e:
+            logger.error(f'Resource sampling failed: {e!r}')
+
+    def _run(self):
+        last_sample = 0
+        while True:
+            self._refresh()
+            if time.monotonic() - last_sample >= self.interval:
+                last_sample = time.monotonic()
+                self._sample()
+            timeout = max(last_sample + self.interval - time.monotonic(), 0)
+            for key, _ in self._selector.select(timeout=timeout):
+                if key.fd == self._wakeup_r:
+                    try:
+                        os.read(self._wakeup_r, self.CHUNK_SIZE)
+                    except BlockingIOError:
+                        pass
+                # pidfds stay readable after exit, and are unwatched on refresh
+
+
+SCHED_POLICIES = {
+    'other': os.SCHED_OTHER,
+    'batch': os.SCHED_BATCH,
+    'idle': os.SCHED_IDLE,
+    'fifo': os.SCHED_FIFO,
+    'rr': os.SCHED_RR,
+}
+IONICE_CLASSES = {
+    'none': psutil.IOPRIO_CLASS_NONE,
+    'realtime': psutil.IOPRIO_CLASS_RT,
+    'best_effort': psutil.IOPRIO_CLASS_BE,
+    'idle': psutil.IOPRIO_CLASS_IDLE,
+}
+
+CAP_SYS_NICE = 23  # bit in capability sets, see capabilities(7)
+
+
+def requires_sys_nice(settings: dict) -> bool:
+    """Returns True if the scheduling settings raise priority, i.e. require CAP_SYS_NICE."""
+    return (int(settings.get('nice') or 0) < 0
+            or settings.get('policy') in ('fifo', 'rr')
+            or settings.get('ionice_class') == 'realtime')
+
+
+def has_sys_nice() -> bool:
+    """Returns True if the current process has CAP_SYS_NICE in its effective set."""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('CapEff:'):
+                    return bool(int(line.split()[1], 16) >> CAP_SYS_NICE & 1)
+    except (OSError, ValueError):
+        pass
+    return False
+
+
+def _scheduling_steps(settings: dict):
+    """Yields (description, function of tid) for each scheduling setting."""
+    policy = settings.get('policy')
+    if policy is not None:
+        priority = int(settings.get('priority', 0))
+        param = os.sched_param(priority)
+        yield f'policy {policy} {priority}', lambda tid: os.sched_setscheduler(tid, SCHED_POLICIES[policy], param)
+    nice = settings.get('nice')
+    if nice is not None:
+        yield f'nice {nice}', lambda tid: os.setpriority(os.PRIO_PROCESS, tid, int(nice))
+    cpus = settings.get('cpu_affinity')
+    if cpus is not None:
+        yield f'affinity {cpus}', lambda tid: os.sched_setaffinity(tid, cpus)
+    ionice_class = settings.get('ionice_class')
+    if ionice_class is not None:
+        value = settings.get('ionice_value')
+        if ionice_class in ('realtime', 'best_effort'):
+            value = int(value or 0)
+        yield f'ionice {ionice_class} {value}', \
+            lambda tid: psutil.Process(tid).ionice(IONICE_CLASSES[ionice_class], value)
+
+
+def apply_scheduling(pid: int, settings: dict, name: str = '', all_threads: bool = False):
+    """Applies scheduling settings to a running process.
+
+    Settings are keys of the per-program entries of 'ENVIRONMENT.scheduling':
+    'cpu_affinity' (list of CPUs), 'nice', 'policy' (one of 'SCHED_POLICIES')
+    with 'priority' for 'fifo'/'rr', and 'ionice_class' (one of
+    'IONICE_CLASSES') with 'ionice_value'.
+
+    Settings apply per thread on Linux, so 'all_threads' is required for
+    processes with threads already running, e.g. the controller itself.
+    Settings failing, e.g. raising priority without CAP_SYS_NICE (see
+    'requires_sys_nice()'), are logged and skipped.
+    """
+    if not settings:
+        return
+    tids = [pid]
+    if all_threads:
+        try:
+            tids = [thread.id for thread in psutil.Process(pid).threads()]
+        except psutil.Error:
+            pass
+    for description, step in _scheduling_steps(settings):
+        try:
+            for tid in tids:
+                step(tid)
+            logger.debug(f"Applied {description} to '{name}' ({pid}).")
+        except (OSError, ValueError, KeyError, psutil.Error) as e:
+            logger.warning(f"Failed to apply {description} to '{name}' ({pid}): {e!r}")
+
+
 class Process:
     """Represents a single process.
 
@@ -44,15 +517,29 @@ class Process:
 
     # Shared by all processes
     config = None
+    reactor = PipeReactor()
+    supervisor = ProcessSupervisor(backlog=reactor.backlog)
 
     def __init__(self, program):
         self.program = program
         self.process = None
+        self.default_scheduling = {}  # overridden by 'ENVIRONMENT.scheduling.<name>'
         self._persist_read = None  # See read() below.
         self._expect_running = False  # See monitor() below.
         self.stop_event = threading.Event()
         self._internal_threads = []
-        self._read_named_pipes = []
+
+    @property
+    def name(self) -> str:
+        """Name of the program, e.g. 'readevents' or 'authd' for 'python3 authd.py'."""
+        return Path(str(self.program).split(' ')[-1]).stem
+
+    @classmethod
+    def scheduling_config(cls, name: str) -> dict:
+        """Returns the scheduling settings configured for program 'name'."""
+        environment = getattr(cls.config, 'ENVIRONMENT', None)
+        settings = getattr(getattr(environment, 'scheduling', None), name, None)
+        return dict(vars(settings)) if settings is not None else {}
 
     @classmethod
     def load_config(cls, path=None, conn_id: Optional[str] = None):
@@ -98,6 +585,7 @@ class Process:
             stderr: Union[int, str, PipesQKD] = subprocess.DEVNULL,
             callback_restart=None,
             stdin : Union[int, str, PipesQKD] = subprocess.DEVNULL,
+            scheduling: Optional[dict] = None,
         ):
         """Starts the process with specified args and standard streams.
 
@@ -111,6 +599,9 @@ class Process:
             stderr: Standard error stream.
             callback_restart: Callback to controller to perform restart.
             stdin: Standard in stream
+            scheduling: CPU affinity, nice, scheduling policy and ionice settings,
+                see 'apply_scheduling'. Defaults to 'ENVIRONMENT.scheduling.<name>'
+                of the configuration, on top of 'default_scheduling'.
 
         Note:
             An alternative implementation to write to file is previously performed as:
@@ -138,6 +629,9 @@ class Process:
             by adding a one-second interval between process start and monitor start.
 
             [1]: https://docs.python.org/3/library/subprocess.html#:~:text=inheritable%20flag
+
+            Scheduling settings are applied right after spawning instead of in a
+            'preexec_fn', which is unsafe with the threads running in the controller.
         """
         # Parse stdout/stderr strings into file descriptors
         is_stdout_fd = is_stderr_fd = is_stdin_fd =  False
@@ -182,6 +676,10 @@ class Process:
             stdout=stdout, stderr=stderr,  # file descriptors are inherited
         )
         logger.debug(f"Started: {' '.join(map(str, command))}, as {self.process}")
+        if scheduling is None:
+            scheduling = {**self.default_scheduling, **Process.scheduling_config(self.name)}
+        apply_scheduling(self.process.pid, scheduling, self.name)
+        Process.supervisor.notify()
 
         # Close file descriptors
         if is_stdout_fd: os.close(stdout)
@@ -236,44 +734,19 @@ class Process:
         except AttributeError:
             logger.debug(f"Process went missing. ({self.program})")
 
-        for pipe in self._read_named_pipes:
-            pipename = pipe.split('/')[-1]
-            logger.debug(f"Pipe is {pipe}")
-            Process.write(pipe, "", name=pipe)
-        try:
-            for thread in self._internal_threads:
-                if thread.is_alive():
-                    logger.debug(f"{thread.name} is alive")
-                    if 'tm_' in thread.name:
-                        logger.debug(f"stop_event is {self.stop_event.is_set()} ")
-                    else:
-                        for pipe in self._read_named_pipes:
-                            pipename = pipe.split('/')[-1]
-                            if pipename.casefold() in thread.name.casefold():
-                                time.sleep(0.2)
-                                Process.write(pipe, "", name=pipe)
-                                Process.write(pipe, "", name=pipe)
-                                logger.debug(f"Writing new line to {pipe} for {thread.name}")
-                                thread.join(timeout=0.5)
-                                if not thread.is_alive():
-                                    self._read_named_pipes.remove(pipe)
-                                    self._internal_threads.remove(thread)
-                else:
-                    logger.debug(f"{thread.name} is dead")
-                    for pipe in self._read_named_pipes:
-                        pipename = pipe.split('/')[-1]
-                        if pipename.casefold() in thread.name.casefold():
-                            self._read_named_pipes.remove(pipe)
-                    self._internal_threads.remove(thread)
-        except RuntimeError as msg:
-            logger.debug(f"{thread} Thread closed. {msg}")
-        except ValueError as msg:
-            logger.debug(f"{thread} not in list. {msg}")
-
+        # Detach pipe readers, and drop references to terminated threads.
+        # Monitoring threads observe 'stop_event' and terminate on their own.
+        Process.reactor.unregister_owner(self)
+        for thread in list(self._internal_threads):
+            if thread.is_alive():
+                logger.debug(f"{thread.name} is alive")
+            else:
+                logger.debug(f"{thread.name} is dead")
+                self._internal_threads.remove(thread)
 
         self.process = None
-        #self._read_named_pipes.clear()
         self.stop_event.clear()
+        Process.supervisor.notify()
 
     def wait(self):
         self._expect_running = False
@@ -283,75 +756,39 @@ class Process:
         return self.process and self.process.poll() is None
 
     # Helper
-    def read(self, pipe, callback, name='', wait=0.02, persist=False):
-        """TODO
+    def read(self, pipe, callback, name='', wait=None, persist=False):
+        """Attaches callback to pipe, to digest each line written to it.
 
-        If opening any pipes from the same parent thread, ensure that
-        the process itself has been started first. The opened pipe
-        is designed to terminate automatically together with the process.
+        Pipes are watched by the shared 'Process.reactor', which calls the
+        callback with a file-like object holding a single line once the line
+        arrives. Reading stops when the process stops, or for non-persistent
+        reads, when the process is no longer running.
 
-        Notably, some processes cannot start if the pipe is not already there, e.g.
-        chopper, splicer. If persist set to True, a single-valued boolean
-        container (list) will be provided to signal termination.
+        Named pipes are opened without waiting for a writer, so reading can be
+        attached before or after the process is started.
 
         Args:
             pipe: Can be actual opened pipe, or path to pipe in filesystem.
+            callback: Function accepting file-like object, see above.
+            name: Name of pipe for logging.
+            wait: Deprecated. Previously the polling interval, now ignored.
+            persist: If True, reading continues until the process is stopped
+                explicitly, even if the process terminated by itself.
         """
+        if not name:
+            name = str(pipe)
         if persist:
             self._persist_read = True
 
-        def func(pipe, name):
-            # Create pipe if is not already open for reading
-            if not isinstance(pipe, io.IOBase):
-                if not name:
-                    name = pipe
-                # Create file descriptor for read-only non-blocking pipe
-                # TODO(Justin): Why must a single threaded pipe read be non-blocking?
-                self._read_named_pipes.append(pipe) # pipe is still a path here
-                fd = os.open(pipe, os.O_RDONLY)
-                # Open file descriptor with *no* buffer
-                pipe = os.fdopen(fd, 'r')
-
-                # TODO
-                # pipe = os.fdopen(fd, 'rb', 0)
-
-            # Run callback on pipe until termination instruction
-            with pipe:
-                if name:
-                    logger.info(f"Named pipe '{name}' opened.")
-                assert pipe.readable()
-
-                # Swap between parent process or persistence flag
-                predicate = lambda: self.is_running()
-                if self._persist_read is not None:
-                    predicate = lambda: self._persist_read
-
-                while predicate() and not self.stop_event.is_set():
-                    if wait:
-                        time.sleep(wait)
-
-                    # Note that the try-except around pipe to catch OSError is *necessary*,
-                    # observed in Python 3.6, specifically for unbuffered non-blocking pipes.
-                    # A read performed when the pipe (_io.FileIO) has no data, even though
-                    # readable() returns true, raises:
-                    #    OSError: read() should have returned a bytes object, not 'NoneType'
-                    # Possibly related unresolved bug: https://bugs.python.org/issue13322
-                    #
-                    # Implementation ported from old code.
-                    # TODO(Justin): Consider switching to a line buffered pipe.
-                    try:
-                        callback(pipe)
-                    except OSError:
-                        pass
-            if name:
-                logger.info(f"Named pipe '{name}' closed.")
+        # Swap between parent process or persistence flag
+        predicate = lambda: self.is_running() and not self.stop_event.is_set()
+        if self._persist_read is not None:
+            predicate = lambda: self._persist_read and not self.stop_event.is_set()
 
-        thread = threading.Thread(target=func, args=(pipe,name))
-        ThreadName = 'r' + thread.name.split('-')[-1] + '-' + name
-        thread.name = ThreadName
-        thread.start()
-        self._internal_threads.append(thread)
-        return thread
+        try:
+            return Process.reactor.register(self, pipe, callback, name, predicate)
+        except OSError as e:
+            logger.error(f"Named pipe '{name}' could not be opened: {e}")
 
     @staticmethod
     def write(target, message: str, name=''):
@@ -387,6 +824,7 @@ class Process:
             while self._expect_running and not stop_event.is_set():
                 if not self.is_running():
                     logger.debug(f"Activated process monitor for '{self.program}' ('{self.process}')")
+                    process_restarts_total.labels(Path(str(self.program)).name).inc()
                     callback_restart()
                 time.sleep(2)
             logger.debug(f"Terminated process monitor for '{self.program}' ('{self.process}')")
@@ -410,34 +848,6 @@ class Process:
         self._internal_threads.append(thread)
         return thread
 
-class HeadT1(NamedTuple):
-    tag: int
-    epoch: int
-    length_bits: int
-    bits_per_entry: int
-    base_bits: int
-
-class HeadT2(NamedTuple):
-    tag: int
-    epoch: int
-    length_bits: int
-    timeorder: int
-    base_bits: int
-    protocol: int
-
-class HeadT3(NamedTuple):
-    tag: int
-    epoch: int
-    length_entry: int
-    bits_per_entry: int
-
-class HeadT4(NamedTuple):
-    tag: int
-    epoch: int
-    length_bits: int
-    timeorder: int
-    base_bits: int
-
 from dataclasses import dataclass
 
 @dataclass
@@ -448,14 +858,83 @@ class ServiceT3:
     okcount: int
     qber: float
 
+class HeaderCache:
+    """Bounded LRU cache of raw epoch file headers.
+
+    Entries are keyed by file path, i.e. (folder, epoch), and are valid as
+    long as the inode and modification time of the file are unchanged, so
+    that a hit costs a single 'os.stat' instead of open, read and close.
+    Misses read the header with one 'os.pread'. Entries of files that no
+    longer exist, e.g. deleted by the '-k' kill option of the qcrypto
+    programs, are dropped on the next lookup.
+    """
+
+    def __init__(self, maxsize: int = 1024, header_size: int = 24):
+        self.maxsize = maxsize
+        self.header_size = header_size  # largest header, i.e. T2
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()  # path -> (inode, mtime, header)
+        self._lock = threading.Lock()
+
+    def read(self, file_name: str) -> Optional[bytes]:
+        """Returns up to 'header_size' bytes of file, or None if not a file."""
+        file_name = str(file_name)
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            with self._lock:
+                self._entries.pop(file_name, None)
+            return None
+        with self._lock:
+            entry = self._entries.get(file_name)
+            if entry is not None and entry[:2] == (stat.st_ino, stat.st_mtime_ns):
+                self._entries.move_to_end(file_name)
+                self.hits += 1
+                return entry[2]
+        try:
+            fd = os.open(file_name, os.O_RDONLY)
+        except OSError:
+            return None
+        try:
+            stat = os.fstat(fd)  # in case file was replaced since stat
+            header = os.pread(fd, self.header_size, 0)
+        except OSError:
+            return None  # e.g. a directory
+        finally:
+            os.close(fd)
+        with self._lock:
+            self.misses += 1
+            # Headers of files still being written may be incomplete
+            if len(header) == self.header_size:
+                self._entries[file_name] = (stat.st_ino, stat.st_mtime_ns, header)
+                self._entries.move_to_end(file_name)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return header
+
+    def info(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+header_cache = HeaderCache()
+
 def read_T2_header(file_name: str):
-    if Path(file_name).is_file():
-        with open(file_name, 'rb') as f:
-            head_info = f.read(4*6)
-    else:
+    head_info = header_cache.read(file_name)
+    if head_info is None:
         headt2 = HeadT2(2,int(file_name.split('/')[-1],16),0,0,4,0)
         return headt2
-    headt2 = HeadT2._make(unpack('iIIiii', head_info))
+    headt2 = HeadT2._make(unpack_from('iIIiii', head_info))
     if (headt2.tag != 0x102 and headt2.tag != 2) :
         logger.error(f'{file_name} is not a Type2 header file')
     if hex(headt2.epoch) != ('0x' + file_name.split('/')[-1]):
@@ -464,13 +943,12 @@ def read_T2_header(file_name: str):
     return headt2
 
 def read_T3_header(file_name: str) -> Optional[HeadT3]:
-    if Path(file_name).is_file():
-        with open(file_name, 'rb') as f:
-            head_info = f.read(16) # 16 bytes of T3 header https://qcrypto.readthedocs.io/en/documentation/file%20specification.html
-    else:
+    head_info = header_cache.read(file_name)
+    if head_info is None:
         headt3 = HeadT3(3,int(file_name.split('/')[-1],16),0,0)
         return headt3
-    headt3 = HeadT3._make(unpack('iIIi', head_info)) #int, unsigned int, unsigned int, int
+    # 16 bytes of T3 header https://qcrypto.readthedocs.io/en/documentation/file%20specification.html
+    headt3 = HeadT3._make(unpack_from('iIIi', head_info)) #int, unsigned int, unsigned int, int
     if (headt3.tag != 0x103 and headt3.tag != 3) :
         logger.error(f'{file_name} is not a Type3 header file')
     if hex(headt3.epoch) != ('0x' + file_name.split('/')[-1]):
@@ -478,38 +956,46 @@ def read_T3_header(file_name: str) -> Optional[HeadT3]:
     return headt3
 
 def read_T4_header(file_name: str):
-    if Path(file_name).is_file():
-        with open(file_name, 'rb') as f:
-            head_info = f.read(4*5)
-    else:
+    head_info = header_cache.read(file_name)
+    if head_info is None:
         headt4 = HeadT4(4,0,0,0,-1)
         return headt4
-    headt4 = HeadT4._make(unpack('iIIii', head_info))
+    headt4 = HeadT4._make(unpack_from('iIIii', head_info))
     if (headt4.tag != 0x104 and headt4.tag != 4) :
         logger.error(f'{file_name} is not a Type4 header file')
     if hex(headt4.epoch) != ('0x' + file_name.split('/')[-1]):
         logger.error(f'Epoch in header {headt4.epoch} does not match epoc filename {file_name}')
     return headt4
 
+# Lookup tables for service mode T3 decoding, see diagnosis.c in qcrypto.
+# Each 4-bit nibble holds a one-hot detector pattern, which is translated to
+# a basis/value index {0,1,2,3}, otherwise -1 for garbage (multi/no-click).
+_T3_NIBBLE_DECODE = np.array(
+    [-1, 0, 1, -1, 2, -1, -1, -1, 3, -1, -1, -1, -1, -1, -1, -1], dtype=np.int8)
+_T3_BYTE_ALICE = _T3_NIBBLE_DECODE[np.arange(256) >> 4]  # upper nibble
+_T3_BYTE_BOB = _T3_NIBBLE_DECODE[np.arange(256) & 0xf]   # lower nibble
+_T3_BYTE_VALID = (_T3_BYTE_ALICE >= 0) & (_T3_BYTE_BOB >= 0)
+# Coincidence matrix index for each byte value, with the invalid bytes
+# parked in an overflow bin 16 that is discarded after counting.
+_T3_BYTE_COINC = np.where(
+    _T3_BYTE_VALID, _T3_BYTE_ALICE.astype(np.int64) * 4 + _T3_BYTE_BOB, 16)
+
 def service_T3(file_name: str) -> Optional[ServiceT3]:
-    decode = [-1, 0, 1, -1, 2, -1, -1, -1, 3, -1, -1, -1, -1, -1, -1, -1] # translate valid bit values to 4 array index
+    """Decodes a service mode (8 bits per entry) T3 file.
+
+    The body is read in a single call and counted with a byte histogram,
+    which is then folded into the 16-bin coincidence matrix via the lookup
+    tables above. This replaces a per-entry Python loop, and returns the
+    same results as diagnosis.c in qcrypto.
+    """
     er_coinc_id = [0, 5, 10, 15] #VV, ADAD, HH, DD
     gd_coinc_id = [2, 7, 8, 13] #VH, ADD, HV, DAD
-    body = []
     headt3 = read_T3_header(file_name)
     header_info_size = 16
-    with open(file_name,'rb') as f:
-        f.seek(header_info_size)
-        word = f.read(4)
-        while word != b"":
-            dat, = unpack('<I', word) # comma is important to get correct type
-            # unpacking was done wrongly in original diagnosis.c code.
-            dat_bytes = dat.to_bytes(4,'little')
-            body.append(dat_bytes[3])
-            body.append(dat_bytes[2])
-            body.append(dat_bytes[1])
-            body.append(dat_bytes[0])
-            word = f.read(4)
+    words = np.fromfile(file_name, dtype='<u4', offset=header_info_size)
+    # unpacking was done wrongly in original diagnosis.c code:
+    # entries are stored in 32-bit little-endian words, most significant byte first.
+    body = words.byteswap().view(np.uint8)
 
     service = ServiceT3(headt3,[0]*16,[0,0],0,1)
     if (headt3.bits_per_entry !=8):
@@ -518,17 +1004,16 @@ def service_T3(file_name: str) -> Optional[ServiceT3]:
     total_words = math.ceil(total_bytes/4)
     if total_words*4 != (len(body) + header_info_size):
         logger.error(f'stream 3 size inconsistency')
-    for i in range(headt3.length_entry):
-        b = decode[body[i] & 0xf] # Bob
-        a = decode[(body[i]>>4) & 0xf] # Alice
-        if a < 0:
-            service.garbage[0] += 1
-        if b < 0:
-            service.garbage[1] += 1
-        if ((a >= 0) and (b >= 0)) :
-            service.coinc_matrix[a * 4 + b] += 1
-            service.okcount += 1
 
+    byte_counts = np.bincount(body[:headt3.length_entry], minlength=256)
+    coinc_matrix = np.bincount(
+        _T3_BYTE_COINC, weights=byte_counts, minlength=17)[:16].astype(np.int64)
+    service.coinc_matrix = coinc_matrix.tolist()
+    service.garbage = [
+        int(byte_counts[_T3_BYTE_ALICE < 0].sum()),
+        int(byte_counts[_T3_BYTE_BOB < 0].sum()),
+    ]
+    service.okcount = int(coinc_matrix.sum())
 
     er_coin = sum(service.coinc_matrix[i] for i in er_coinc_id)
     gd_coin = sum(service.coinc_matrix[i] for i in gd_coinc_id)
@@ -538,6 +1023,60 @@ def service_T3(file_name: str) -> Optional[ServiceT3]:
     service.qber = float(round(er_coin /(er_coin + gd_coin),3)) #ignore garbage
     return service
 
+class EpochsDiagnosis(NamedTuple):
+    epochs: list              # epochs found, in order
+    coinc_matrices: np.ndarray  # per-epoch coincidence matrices, shape (N,16)
+    garbage: np.ndarray       # per-epoch garbage counts, shape (N,2)
+    coinc_matrix: np.ndarray  # aggregated coincidence matrix, shape (16,)
+    qber: float               # QBER of aggregated coincidence matrix
+
+def _diagnose_epoch_path(file_name: str):
+    """Worker for 'diagnose_epochs', returns None if epoch file is missing."""
+    if not Path(file_name).is_file():
+        return None
+    service = service_T3(file_name)
+    return service.coinc_matrix, service.garbage
+
+def diagnose_epochs(
+        start_epoch: str,
+        count: int,
+        folder: str = FoldersQKD.RAWKEYS,
+        processes: Optional[int] = None,
+    ) -> EpochsDiagnosis:
+    """Diagnoses a range of service mode epochs across a process pool.
+
+    Epochs missing from 'folder' are skipped, and are not listed in the
+    returned 'epochs'. Useful for offline re-evaluation of QBER over many
+    epochs, e.g. after an incident.
+
+    Args:
+        start_epoch: First epoch in hex, e.g. 'b0000000'.
+        count: Number of consecutive epochs to diagnose.
+        folder: Directory holding the T3 files.
+        processes: Size of process pool, defaults to number of CPUs.
+            Epochs are decoded in the current process if set to 1.
+    """
+    epochs = [epoch_after(start_epoch, i) for i in range(count)]
+    paths = [f'{folder}/{epoch}' for epoch in epochs]
+    if processes == 1 or count <= 1:
+        results = list(map(_diagnose_epoch_path, paths))
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            chunksize = max(1, count // (4 * (processes or os.cpu_count() or 1)))
+            results = pool.map(_diagnose_epoch_path, paths, chunksize)
+
+    found = [(e, r) for e, r in zip(epochs, results) if r is not None]
+    if len(found) < count:
+        logger.warning(f'{count - len(found)} of {count} epochs from {start_epoch} not found in {folder}')
+    coinc_matrices = np.array([r[0] for _, r in found], dtype=np.int64).reshape(-1, 16)
+    garbage = np.array([r[1] for _, r in found], dtype=np.int64).reshape(-1, 2)
+    coinc_matrix = coinc_matrices.sum(axis=0)
+    er_coin = coinc_matrix[[0, 5, 10, 15]].sum()  # VV, ADAD, HH, DD
+    gd_coin = coinc_matrix[[2, 7, 8, 13]].sum()  # VH, ADD, HV, DAD
+    qber = float(round(er_coin / (er_coin + gd_coin), 3)) if (er_coin + gd_coin) else 1.0
+    return EpochsDiagnosis(
+        [e for e, _ in found], coinc_matrices, garbage, coinc_matrix, qber)
+
 def epoch_after(epoch: str, added: int = 1) -> str:
     return hex(int(epoch,16) + added)[2:]
 
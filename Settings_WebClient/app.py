@@ -1,8 +1,12 @@
 import signal
+import threading
 
 import dash
 import dash_bootstrap_components as dbc
+from flask import Response, g, request
 import S15qkd.controller as qkd_ctrl
+from S15qkd.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from S15qkd.broadcast import CONTENT_TYPE as STREAM_CONTENT_TYPE
 import time
 
 # app = dash.Dash(__name__, suppress_callback_exceptions=True, external_stylesheets=[dbc.themes.BOOTSTRAP])
@@ -10,6 +14,25 @@ app = dash.Dash(__name__, suppress_callback_exceptions=True, title='S15 QKD', up
 
 server = app.server
 
+# Requests are handled one at a time, as with a single server thread, since the
+# controller and the Dash callbacks are not written for concurrent access. Only
+# status streams, which hold their thread while open, and metrics scrapes, which
+# read the registry only, are served alongside, see 'entrypoint.sh'.
+CONCURRENT_PATHS = ('/status_stream', '/metrics')
+STREAM_RETRY_AFTER = 30  # seconds, when too many status streams are open
+_request_lock = threading.Lock()
+
+@server.before_request
+def serialize_request():
+    if request.path not in CONCURRENT_PATHS:
+        _request_lock.acquire()
+        g.serialized = True
+
+@server.teardown_request
+def release_request(exc):
+    if g.pop('serialized', False):
+        _request_lock.release()
+
 @app.server.route("/status_keygen")
 def keygen_status():
     """
@@ -38,6 +61,11 @@ def status_qkd():
     is_running = status['costream'] or status['splicer']
     return "", 200 if is_running else 404
 
+@app.server.route("/status_processes")
+def status_processes():
+    """Sends the PID, CPU and memory usage, and uptime of each process."""
+    return qkd_ctrl.get_process_snapshot(), 200
+
 @app.server.route("/set_conn/<conn_id>")
 def set_connection(conn_id):
     qkd_ctrl.reload_configuration(conn_id)
@@ -82,5 +110,70 @@ def status_data():
             }
     return json_info, 200
 
+@app.server.route("/epoch_trace")
+def epoch_latencies():
+    """Sends percentiles of the time recent epochs spent before each pipeline stage."""
+    return qkd_ctrl.get_epoch_latencies(), 200
+
+@app.server.route("/epoch_trace/<epoch>")
+def epoch_trace(epoch):
+    """Sends the times the epoch (in hex) passed each pipeline stage.
+
+    Returns status code 404 if the epoch is not among the recently traced.
+    """
+    try:
+        stages = qkd_ctrl.get_epoch_trace(epoch)
+    except ValueError:
+        return "", 400
+    return {'epoch': epoch, 'stages': stages}, 200 if stages else 404
+
+@app.server.route("/metrics")
+def metrics():
+    """Sends counters, gauges and histograms in the Prometheus text format."""
+    return qkd_ctrl.get_metrics(), 200, {'Content-Type': METRICS_CONTENT_TYPE}
+
+@app.server.route("/history")
+def history_tables():
+    """Sends the names and columns of the history tables."""
+    return qkd_ctrl.get_history_tables(), 200
+
+@app.server.route("/history/<table>")
+def history(table):
+    """Sends the history of a table, e.g. /history/ec?start=1700000000&points=500
+
+    Optional 'start' and 'end' are in seconds since epoch, defaulting to the
+    last 24 hours, and 'points' limits the number of (averaged) rows returned.
+    """
+    try:
+        query = {key: float(request.args[key]) for key in ('start', 'end') if key in request.args}
+        if 'points' in request.args:
+            query['max_points'] = int(request.args['points'])
+    except ValueError:
+        return "", 400
+    if query.get('max_points', 1) < 1:
+        return "", 400
+    try:
+        return qkd_ctrl.get_history(table, **query), 200
+    except KeyError:
+        return "", 404
+
+@app.server.route("/status_stream")
+def status_stream():
+    """Streams changes of the status data as server-sent events.
+
+    A 'snapshot' event with the full status is sent first, then 'delta' events
+    with the changed keys of each topic, e.g. {"process_state": {"costream": true}}.
+
+    Note:
+        Each open stream holds one server thread, see 'entrypoint.sh'.
+        Returns status code 503 if too many streams are open.
+    """
+    stream = qkd_ctrl.stream_status()
+    if stream is None:
+        return "", 503, {'Retry-After': str(STREAM_RETRY_AFTER)}
+    return Response(
+        stream, mimetype=STREAM_CONTENT_TYPE,
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 signal.signal(signal.SIGINT, lambda *_: qkd_ctrl.stop())
 signal.signal(signal.SIGTERM, lambda *_: qkd_ctrl.stop())
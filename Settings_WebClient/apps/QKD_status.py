@@ -1,16 +1,26 @@
 from dash import html, dcc
-from dash.dependencies import Input, Output, State
+from dash.dependencies import ClientsideFunction, Input, Output, State
 from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 import plotly.graph_objects as go
 import numpy as np
+import datetime
+import threading
+import time
 
 from app import app
 from S15qkd.controller import controller as qkd_ctrl
+from S15qkd.history import history
 
 # Maximum allowed QBER in percentage (for graphing)
 MAX_ALLOWED_QBER = 12
 
+# Time span of the history graphs, in seconds
+HISTORY_WINDOW = 24 * 60 * 60
+
+# Seconds between history graph updates, queried once for all viewers
+HISTORY_REFRESH = 10
+
 def serve_layout():
     # Process status indicators
     # TODO(Justin): Possibly display process logs, see L49-118 commit b26055ab for partial implementation
@@ -145,6 +155,18 @@ def serve_layout():
         id='proc_status_interval',
         interval=1000,  # in milliseconds
     )
+    history_interval = dcc.Interval(
+        id='history_interval',
+        interval=HISTORY_REFRESH * 1000,  # in milliseconds
+    )
+
+    # Status pushed by the server, see 'assets/status_stream.js'
+    status_stream = dcc.Store(id='status_stream')
+    status_fields = dcc.Store(id='status_fields', data={
+        'processes': process_list,
+        'status_info': raw_keygen_info_list,
+        'errc_info': ec_info_list,
+    })
 
     graph_qber = dcc.Graph(id='live-update-graph-qber')
     graph_final_bits = dcc.Graph(id='live-update-graph-bitrate')
@@ -176,6 +198,9 @@ def serve_layout():
         ]),
         html.Br(),
         proc_status_interval,
+        history_interval,
+        status_stream,
+        status_fields,
     ])
     return layout
 
@@ -190,28 +215,18 @@ process_list = [
     'error_correction',
 ]
 
-@app.callback(
+# Process states and status info are pushed by the server via the
+# 'status_stream' store and rendered client-side, see 'assets/status_stream.js'.
+app.clientside_callback(
+    ClientsideFunction(namespace='status', function_name='process_states'),
     [
         *[Output(proc+'_status', 'children') for proc in process_list],
         *[Output(proc+'_status', 'color') for proc in process_list],
     ],
-    [Input('proc_status_interval', 'n_intervals')],
+    [Input('status_stream', 'data')],
+    [State('status_fields', 'data')],
 )
-def load_process_states(value):
-    proc_status_dict = {proc:'OFF' for proc in process_list}
-    proc_color_dict = {proc:'danger' for proc in process_list}
-    proc_dict = qkd_ctrl.get_process_states()
-    for i in process_list:
-        if proc_dict[i]:
-            proc_status_dict[i] = 'ON'
-            proc_color_dict[i] = 'success'
-    return [*proc_status_dict.values(), *proc_color_dict.values()]
-
-symmetry_matching = {
-    True: 'Low count side',
-    False: 'High count side',
-    None: '',
-}
+
 raw_keygen_info_list = [
     'connection_status',
     'symmetry',
@@ -226,15 +241,12 @@ raw_keygen_info_list = [
     'last_qber',
 ]
 
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace='status', function_name='state_info'),
     [Output(info, 'children') for info in raw_keygen_info_list],
-    [Input('proc_status_interval', 'n_intervals')],
+    [Input('status_stream', 'data')],
+    [State('status_fields', 'data')],
 )
-def load_state_info(n):
-    status_dct = qkd_ctrl.get_status_info()
-    status_dct['symmetry'] = symmetry_matching[status_dct['symmetry']]
-    status_dct['protocol'] = 'BBM92 mode' if status_dct['protocol'] == 1 else 'Service mode'
-    return [status_dct[info] for info in raw_keygen_info_list]
 
 
 ec_info_list = [
@@ -249,13 +261,12 @@ ec_info_list = [
     'ec_key_gen_rate',
 ]
 
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace='status', function_name='error_correction_info'),
     [Output(info, 'children') for info in ec_info_list],
-    [Input('proc_status_interval', 'n_intervals')],
+    [Input('status_stream', 'data')],
+    [State('status_fields', 'data')],
 )
-def load_error_correction_info(n):
-    ec_info_dct = qkd_ctrl.get_error_corr_info()
-    return [ec_info_dct[info] for info in ec_info_list]
 
 @app.callback(
     [Output('blinded-div','style')],
@@ -284,24 +295,44 @@ graph_axis_format = {
     'tickfont': graph_tickfont_format,
 }
 
+_ec_history_lock = threading.Lock()
+_ec_history_cache = {}
+
+def ec_history():
+    """Returns times, time axis range and error correction history to graph.
+
+    The history is queried once per 'HISTORY_REFRESH' seconds and shared by
+    all viewers, since queries beyond the in-memory history decompress the
+    daily history files.
+    """
+    bucket = int(time.time() // HISTORY_REFRESH)
+    with _ec_history_lock:
+        if _ec_history_cache.get('bucket') != bucket:
+            end = bucket * HISTORY_REFRESH
+            ec = history.query('ec', start=end - HISTORY_WINDOW, end=end)
+            x = [datetime.datetime.fromtimestamp(t) for t in ec['time']]
+            xrange = [datetime.datetime.fromtimestamp(t) for t in (end - HISTORY_WINDOW, end)]
+            _ec_history_cache.update(bucket=bucket, result=(x, xrange, ec))
+        return _ec_history_cache['result']
+
 @app.callback(
     Output('live-update-graph-qber', 'figure'),
-    [Input('proc_status_interval', 'n_intervals')],
+    [Input('history_interval', 'n_intervals')],
 )
 def update_graph_qber(n):
-    y = np.array(list(qkd_ctrl.errc._ec_err_fraction_history)) * 100  # convert to percentage
-    x = np.arange(0, len(y), 1)
+    x, xrange, ec = ec_history()
+    y = np.array(ec['qber'], dtype=float) * 100  # convert to percentage
     y_maxqber = np.ones(len(y)) * MAX_ALLOWED_QBER
-    ylim = np.max(y) + 5 if len(y) > 0 else 1
+    ylim = np.nanmax(y) + 5 if len(y) > 0 else 1
 
     fig = go.Figure()
     fig.add_trace(go.Scatter(x=x, y=y, mode='lines+markers', name='QBER'))
     fig.add_trace(go.Scatter(x=x, y=y_maxqber, mode='lines', name='Max. allowed QBER'))
     fig.update_layout(
         title='QBER history',
-        xaxis_title=f'Last {len(x)} key generation runs',
+        xaxis_title='Time (last 24 hours)',
         yaxis_title='Quantum bit error (%)',
-        xaxis={**graph_axis_format, 'range': [0, len(x)-1]},
+        xaxis={**graph_axis_format, 'range': xrange},
         yaxis={**graph_axis_format, 'range': [0, ylim]},
         legend=dict(
             orientation='h',
@@ -314,19 +345,19 @@ def update_graph_qber(n):
 
 @app.callback(
     Output('live-update-graph-bitrate', 'figure'),
-    [Input('proc_status_interval', 'n_intervals')],
+    [Input('history_interval', 'n_intervals')],
 )
 def update_graph_bitrate(n):
-    y = np.array(list(qkd_ctrl.errc._ec_err_key_length_history))
-    x = np.arange(0, len(y), 1)
-    ylim = 1 if len(y) == 0 else np.ceil(np.max(y)/100)*100 + 5  # ensure upper bound (units of 100) is visible
+    x, xrange, ec = ec_history()
+    y = np.array(ec['final_bits'], dtype=float)
+    ylim = 1 if len(y) == 0 else np.ceil(np.nanmax(y)/100)*100 + 5  # ensure upper bound (units of 100) is visible
 
     fig = go.Figure(data=go.Scatter(x=x, y=y, mode='lines+markers'))
     fig.update_layout(
         title='Key length generation history',
-        xaxis_title=f'Last {len(x)} key generation runs',
+        xaxis_title='Time (last 24 hours)',
         yaxis_title='Key length (bits)',
-        xaxis={**graph_axis_format, 'range': [0, len(x)-1]},
+        xaxis={**graph_axis_format, 'range': xrange},
         yaxis={**graph_axis_format, 'range': [0, ylim]},
         plot_bgcolor='white',
     )
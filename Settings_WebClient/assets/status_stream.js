@@ -0,0 +1,68 @@
+// Receives status changes from '/status_stream' (server-sent events), and
+// passes the merged status to the 'status_stream' store of the status page,
+// whose clientside callbacks below update the page without polling.
+
+(function () {
+    var RETRY_INTERVAL = 30000;  // ms, after the stream was refused, e.g. too many open
+    var state = {};
+
+    function update() {
+        try {
+            window.dash_clientside.set_props('status_stream', {data: state});
+        } catch (e) {
+            // Status page not displayed, state is read on its next render
+        }
+    }
+
+    function connect() {
+        var source = new EventSource('/status_stream');  // reconnects by itself once open
+        source.addEventListener('snapshot', function (e) {
+            state = JSON.parse(e.data);
+            update();
+        });
+        source.addEventListener('delta', function (e) {
+            var delta = JSON.parse(e.data);
+            var merged = Object.assign({}, state);
+            Object.keys(delta).forEach(function (topic) {
+                merged[topic] = Object.assign({}, state[topic], delta[topic]);
+            });
+            state = merged;
+            update();
+        });
+        source.addEventListener('error', function () {
+            if (source.readyState === EventSource.CLOSED) {
+                setTimeout(connect, RETRY_INTERVAL);  // refused, not retried by EventSource
+            }
+        });
+    }
+    connect();
+
+    window.qkd_status = {
+        latest: function () { return state; },
+    };
+})();
+
+var SYMMETRY = {'true': 'Low count side', 'false': 'High count side', 'null': ''};
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    status: {
+        // 'fields' holds the names of the displayed fields, see 'apps/QKD_status.py'
+        process_states: function (data, fields) {
+            var processes = fields.processes;
+            var states = window.qkd_status.latest().process_state || {};
+            var on = processes.map(function (p) { return states[p] ? 'ON' : 'OFF'; });
+            var colors = processes.map(function (p) { return states[p] ? 'success' : 'danger'; });
+            return on.concat(colors);
+        },
+        state_info: function (data, fields) {
+            var info = Object.assign({}, window.qkd_status.latest().status_info);
+            info.symmetry = SYMMETRY[String(info.symmetry === undefined ? null : info.symmetry)];
+            info.protocol = info.protocol === 1 ? 'BBM92 mode' : 'Service mode';
+            return fields.status_info.map(function (f) { return info[f] === undefined ? '' : info[f]; });
+        },
+        error_correction_info: function (data, fields) {
+            var info = window.qkd_status.latest().errc_info || {};
+            return fields.errc_info.map(function (f) { return info[f] === undefined ? '' : info[f]; });
+        },
+    },
+});
@@ -0,0 +1,87 @@
+"""Synthetic epoch files and pipe messages for the benchmark scenarios.
+
+All generators take a numpy random generator, so that scenarios are
+reproducible across runs and commits.
+"""
+
+from pathlib import Path
+
+import numpy as np
+
+from S15qkd.streams import write_T3, write_T4
+
+EPOCH_START = 0xB0000000
+ONEHOT = np.array([1, 2, 4, 8], dtype=np.uint8)
+GARBAGE_FRACTION = 0.01
+
+
+def epoch_name(index):
+    return f"{EPOCH_START + index:x}"
+
+
+def service_entries(rng, entries, qber=0.05):
+    """Returns service mode T3 entries, Alice's pattern in the upper nibble.
+
+    Bob's detector is anti-correlated with Alice's within the same basis, and
+    matches with probability 'qber'. A small fraction of entries is replaced
+    by random, typically multi-click, patterns.
+    """
+    alice = rng.integers(0, 4, entries)
+    bob = alice ^ 2
+    is_err = rng.random(entries) < qber
+    bob[is_err] = alice[is_err]
+    body = (ONEHOT[alice] << 4) | ONEHOT[bob]
+    is_garbage = rng.random(entries) < GARBAGE_FRACTION
+    body[is_garbage] = rng.integers(0, 256, is_garbage.sum(), dtype=np.uint8)
+    return body
+
+
+def write_service_epochs(directory, rng, count, entries):
+    """Writes 'count' service mode T3 epochs, returns their paths."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = directory / epoch_name(i)
+        write_T3(path, EPOCH_START + i, service_entries(rng, entries), 8)
+        paths.append(str(path))
+    return paths
+
+
+def write_key_epochs(directory, rng, count, entries):
+    """Writes 'count' pairs of T3 (1 bit per entry) and T4 epochs.
+
+    Returns the T3 and T4 directories, and the epoch names.
+    """
+    t3_dir = Path(directory) / "t3"
+    t4_dir = Path(directory) / "receivefiles"
+    t3_dir.mkdir(parents=True, exist_ok=True)
+    t4_dir.mkdir(parents=True, exist_ok=True)
+    epochs = [epoch_name(i) for i in range(count)]
+    for i, epoch in enumerate(epochs):
+        write_T3(t3_dir / epoch, EPOCH_START + i, rng.integers(0, 2, entries), 1)
+        times = np.cumsum(rng.integers(1, 1 << 12, entries))
+        write_T4(t4_dir / epoch, EPOCH_START + i, times, np.zeros(entries), 12, 0)
+    return str(t3_dir), str(t4_dir), epochs
+
+
+def genlog_lines(rng, count):
+    """Returns costream genlog lines in logging mode 2 ('-G 2')."""
+    lines = []
+    for i in range(count):
+        raw, coincidences = rng.integers(50000, 100000), rng.integers(2000, 4000)
+        lines.append(
+            f"{epoch_name(i)}\t{raw}\t{raw // 4}\t3.2\t"
+            f"{rng.integers(-1000, 1000)}\t{coincidences // 20}\t{coincidences}\n"
+        )
+    return lines
+
+
+def counts_lines(rng, count):
+    """Returns chopper t2log / chopper2 t1log lines, with nonzero counts."""
+    lines = []
+    for i in range(count):
+        detectors = rng.integers(10000, 20000, 4)
+        fields = "\t".join(str(d) for d in detectors)
+        lines.append(f"{epoch_name(i)}\t{detectors.sum()}\t{fields}\n")
+    return lines
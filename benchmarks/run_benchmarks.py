@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""Runs the Python-side pipeline benchmarks, and compares results between commits.
+
+Each scenario in 'benchmarks/scenarios.py' is timed over '--rounds' rounds,
+each calling the scenario enough times to last at least '--min_time'
+seconds. Timings per call are written as JSON together with the commit and
+environment, and can be compared against a previous run with '--compare'.
+A scenario regresses if its median time increased by more than
+'--threshold', in which case the exit status is 1.
+
+Scenarios missing optional dependencies (e.g. scipy for the optimizers,
+S15lib for polarization compensation) are reported as skipped. The status
+endpoint scenarios query a running QKD server given by '--url'. Engine log
+messages below '--log_level' are discarded, so that console output is not
+timed.
+
+Run from the repository root:
+    python3 -m benchmarks.run_benchmarks --output baseline.json
+    python3 -m benchmarks.run_benchmarks --compare baseline.json
+    python3 -m benchmarks.run_benchmarks --filter "headers.*" --rounds 20
+    python3 -m benchmarks.run_benchmarks --filter "status.*" --url http://qkd:8000
+"""
+
+import argparse
+import fnmatch
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.scenarios import SCENARIOS, Skip, context, prepare
+from S15qkd.qkd_globals import logger
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def git(*args):
+    try:
+        result = subprocess.run(
+            ["git", *args], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def environment():
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.node(),
+        "timestamp": time.time(),
+    }
+
+
+def calibrate(func, min_time):
+    """Returns the number of calls lasting at least 'min_time' seconds."""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        if time.perf_counter() - start >= min_time:
+            return number
+        number *= 2
+
+
+def measure(func, args):
+    """Returns statistics of the time per call of 'func', in seconds."""
+    number = calibrate(func, args.min_time)
+    times = []
+    for _ in range(args.rounds):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+    median = statistics.median(times)
+    return {
+        "min": min(times),
+        "median": median,
+        "mean": statistics.mean(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "rounds": args.rounds,
+        "number": number,
+        "ops_per_s": 1 / median,
+    }
+
+
+def run(args, names):
+    results, skipped = {}, {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name in names:
+            ctx = context(Path(tmpdir) / name, args.url, args.seed)
+            try:
+                func, cleanup = prepare(name, ctx)
+            except Skip as e:
+                skipped[name] = str(e)
+                print(f"{name:<32} skipped, {e}")
+                continue
+            try:
+                results[name] = measure(func, args)
+            finally:
+                cleanup()
+            print(
+                f"{name:<32} {results[name]['median'] * 1e6:12.1f} us"
+                f"  (stdev {results[name]['stdev'] * 1e6:.1f} us)"
+            )
+    return results, skipped
+
+
+def compare(results, baseline, threshold):
+    """Prints changes relative to baseline, returns names of regressed scenarios."""
+    regressions = []
+    print(f"\nCompared to {baseline['environment'].get('commit')}:")
+    for name, result in results.items():
+        if name not in baseline["results"]:
+            continue
+        ratio = result["median"] / baseline["results"][name]["median"]
+        status = ""
+        if ratio > 1 + threshold:
+            status = "REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 / (1 + threshold):
+            status = "improved"
+        print(f"{name:<32} {ratio:8.2f}x  {status}")
+    return regressions
+
+
+def main(args):
+    logger.setLevel(args.log_level)
+    names = [n for n in SCENARIOS if fnmatch.fnmatch(n, args.filter)]
+    if args.list:
+        print("\n".join(names))
+        return 0
+
+    results, skipped = run(args, names)
+    report = {"environment": environment(), "results": results, "skipped": skipped}
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.partition("\n")[0])
+    parser.add_argument(
+        "--filter", default="*", help="Glob pattern of scenarios to run"
+    )
+    parser.add_argument("--list", action="store_true", help="List scenarios and exit")
+    parser.add_argument(
+        "--rounds", type=int, default=10, help="Number of timed rounds per scenario"
+    )
+    parser.add_argument(
+        "--min_time", type=float, default=0.05, help="Minimum duration of each round"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of synthetic data")
+    parser.add_argument("--output", help="Write results as JSON to file")
+    parser.add_argument("--compare", help="Compare against results of a previous run")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Relative increase in median time reported as regression",
+    )
+    parser.add_argument("--url", help="Base URL of a running QKD server")
+    parser.add_argument(
+        "--log_level", default="WARNING", help="Level of engine log messages shown"
+    )
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,271 @@
+"""Named benchmark scenarios for the Python-side stages of the QKD pipeline.
+
+Each scenario is a generator registered with '@scenario(name)'. It prepares
+its inputs, yields the function to be timed, and cleans up afterwards:
+
+    @scenario("stage.what")
+    def what(ctx):
+        data = prepare(ctx.tmpdir, ctx.rng)
+        yield lambda: digest(data)
+
+Scenarios that cannot run in the current environment, e.g. due to a missing
+optional dependency or hardware, raise 'Skip' before yielding.
+"""
+
+import importlib
+import io
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+from benchmarks import fixtures
+
+SCENARIOS = {}
+NUM_EPOCHS = 100
+SERVICE_ENTRIES = 100_000
+NUM_LINES = 100  # lines per pipe digest batch
+PIPE_TIMEOUT = 10  # seconds
+LUT_FILE = Path(__file__).resolve().parent.parent / "S15qkd" / "lcvr_callibration.csv"
+
+
+class Skip(Exception):
+    """Raised by a scenario that cannot run in this environment."""
+
+
+def scenario(name):
+    def register(setup):
+        SCENARIOS[name] = setup
+        return setup
+
+    return register
+
+
+def require(module):
+    """Imports 'module', skipping the scenario if it or its dependencies are missing."""
+    try:
+        return importlib.import_module(module)
+    except ImportError as e:
+        raise Skip(f"requires {e.name}") from e
+
+
+# Epoch headers, e.g. splicer gating and epoch catalog
+
+
+@scenario("headers.read_T3_T4.cached")
+def read_headers_cached(ctx):
+    utils = require("S15qkd.utils")
+    t3_dir, t4_dir, epochs = fixtures.write_key_epochs(
+        ctx.tmpdir / "headers", ctx.rng, NUM_EPOCHS, 64
+    )
+    utils.header_cache.clear()
+
+    def gate():
+        for epoch in epochs:
+            utils.read_T3_header(f"{t3_dir}/{epoch}")
+            utils.read_T4_header(f"{t4_dir}/{epoch}")
+
+    yield gate
+
+
+@scenario("headers.read_T3_T4.uncached")
+def read_headers_uncached(ctx):
+    utils = require("S15qkd.utils")
+    t3_dir, t4_dir, epochs = fixtures.write_key_epochs(
+        ctx.tmpdir / "headers", ctx.rng, NUM_EPOCHS, 64
+    )
+
+    def gate():
+        utils.header_cache.clear()
+        for epoch in epochs:
+            utils.read_T3_header(f"{t3_dir}/{epoch}")
+            utils.read_T4_header(f"{t4_dir}/{epoch}")
+
+    yield gate
+
+
+# Service mode, i.e. QBER estimation for polarization compensation
+
+
+@scenario("service_T3.decode")
+def decode_service_T3(ctx):
+    utils = require("S15qkd.utils")
+    paths = fixtures.write_service_epochs(
+        ctx.tmpdir / "service", ctx.rng, 1, SERVICE_ENTRIES
+    )
+    yield lambda: utils.service_T3(paths[0])
+
+
+@scenario("qber.handle_diagnosis")
+def estimate_qber(ctx):
+    utils = require("S15qkd.utils")
+    estimator = require("S15qkd.modules.polcomp.qber_estimator")
+    paths = fixtures.write_service_epochs(
+        ctx.tmpdir / "service", ctx.rng, 1, SERVICE_ENTRIES
+    )
+    diagnosis = utils.service_T3(paths[0])
+    qber = estimator.QberEstimator(window=10)
+    yield lambda: qber.handle_diagnosis(diagnosis)
+
+
+@scenario("qber.handle_epoch_path")
+def decode_and_estimate_qber(ctx):
+    estimator = require("S15qkd.modules.polcomp.qber_estimator")
+    paths = fixtures.write_service_epochs(
+        ctx.tmpdir / "service", ctx.rng, 1, SERVICE_ENTRIES
+    )
+    qber = estimator.QberEstimator(window=10)
+    yield lambda: qber.handle_epoch_path(paths[0])
+
+
+# Pipe digest callbacks, through the shared pipe reactor
+
+
+def digest_batches(process, digest, lines):
+    """Yields a function writing 'lines' into a pipe digested by 'process'."""
+    utils = require("S15qkd.utils")
+    remaining = [0]
+    done = threading.Event()
+
+    def callback(pipe):
+        digest(pipe)
+        remaining[0] -= 1
+        if remaining[0] == 0:
+            done.set()
+
+    r, w = os.pipe()
+    reader = process.read(os.fdopen(r, "r"), callback, name="benchmark", persist=True)
+    data = "".join(lines).encode()
+
+    def run():
+        done.clear()
+        remaining[0] = len(lines)
+        os.write(w, data)
+        if not done.wait(PIPE_TIMEOUT):
+            raise TimeoutError("Pipe digest timed out")
+
+    try:
+        yield run
+    finally:
+        utils.Process.reactor.unregister(reader)
+        os.close(w)
+
+
+@scenario("pipes.costream_genlog")
+def digest_genlog(ctx):
+    costream = require("S15qkd.costream").Costream("costream")
+    costream._pairs_over_accidentals_avg = 10
+    costream._callback_notify = None
+    costream._callback_restart = lambda: None
+    lines = fixtures.genlog_lines(ctx.rng, NUM_LINES)
+    yield from digest_batches(costream, costream.digest_genlog, lines)
+
+
+@scenario("pipes.chopper2_t1log")
+def digest_t1log(ctx):
+    chopper2 = require("S15qkd.chopper2").Chopper2("chopper2")
+    chopper2._callback_restart = lambda: None
+    lines = fixtures.counts_lines(ctx.rng, NUM_LINES)
+    yield from digest_batches(chopper2, chopper2.digest_t1logpipe, lines)
+
+
+@scenario("messages.parse_genlog")
+def parse_genlog(ctx):
+    messages = require("S15qkd.messages")
+    genlog = messages.MessageLog(messages.GenlogMessage)
+    lines = fixtures.genlog_lines(ctx.rng, NUM_LINES)
+
+    def parse():
+        for line in lines:
+            genlog.readline(io.StringIO(line))
+
+    yield parse
+
+
+# Polarization compensation
+
+
+@scenario("polcomp.voltage_lookup")
+def voltage_lookup(ctx):
+    polcomp = require("S15qkd.polarization_compensation")
+    data = np.genfromtxt(LUT_FILE, delimiter=",", skip_header=1)
+    table = polcomp.PolComp.LookupTab(0, data[:, 0], data[:, 1], data[:, 2])
+    lut = SimpleNamespace(LUT=[table] * 4)  # as loaded by 'PolComp._load_lut'
+    retardances = ctx.rng.uniform(data[:, 1].min(), data[:, 1].max(), 100)
+
+    def lookup():
+        for retardance in retardances:
+            polcomp.PolComp.voltage_lookup(lut, retardance, 0)
+
+    yield lookup
+
+
+def evaluate_forever(f, x0):
+    """Optimizer evaluating 'x0' until stopped, i.e. only the IPC is measured."""
+    try:
+        while True:
+            f(x0)
+    except StopIteration:
+        pass
+
+
+@scenario("optimizers.manual_roundtrip")
+def optimizer_roundtrip(ctx):
+    optimizers = require("S15qkd.modules.polcomp.optimizers")
+    callback = optimizers.run_manual_optimizer(evaluate_forever, args=([0.0] * 3,))
+    try:
+        yield lambda: callback(ctx.rng.random())
+    finally:
+        callback(None)
+
+
+# JSON status endpoints of a running QKD server, see 'Settings_WebClient/app.py'
+
+
+def fetch(url):
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return response.read()
+
+
+@scenario("status.status_data")
+def status_data(ctx):
+    if not ctx.url:
+        raise Skip("requires --url of a running QKD server")
+    url = f"{ctx.url}/status_data"
+    json.loads(fetch(url))  # fail early if unreachable
+    yield lambda: json.loads(fetch(url))
+
+
+@scenario("status.status_keygen")
+def status_keygen(ctx):
+    if not ctx.url:
+        raise Skip("requires --url of a running QKD server")
+    url = f"{ctx.url}/status_keygen"
+
+    def query():
+        try:
+            fetch(url)
+        except urllib.error.HTTPError as e:
+            if e.code != 404:  # not generating keys
+                raise
+
+    query()
+    yield query
+
+
+def prepare(name, ctx):
+    """Starts scenario 'name', returns (function to time, cleanup)."""
+    setup = SCENARIOS[name](ctx)
+    func = next(setup)
+    return func, lambda: next(setup, None)
+
+
+def context(tmpdir, url=None, seed=0):
+    return SimpleNamespace(
+        tmpdir=Path(tmpdir), url=url, rng=np.random.default_rng(seed)
+    )
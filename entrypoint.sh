@@ -19,6 +19,10 @@ fi
 #       override the default 'docker stop --stop-timeout 10'.
 # Note: Defaults '--timeout 30' is a liveness check (restarting worker if not alive),
 #       while '--graceful-timeout 30' is a termination check (SIGKILL sent after SIGTERM).
+# Note: A single worker is used since it owns the QKD controller. Its threads serve requests one
+#       at a time, except for '/status_stream' and '/metrics' (see 'Settings_WebClient/app.py').
+#       Each '/status_stream' viewer holds one thread while the status page is open, and at
+#       most 8 streams are served (see 'S15qkd/broadcast.py'), leaving the other threads free.
 cd /root/code/QKDServer/Settings_WebClient \
-        && exec gunicorn --timeout 30 --graceful-timeout 5 --worker-connections=1 --threads=1 $CERT_FLAGS -b 0.0.0.0:8000 index:server
+        && exec gunicorn --timeout 30 --graceful-timeout 5 --workers=1 --threads=16 $CERT_FLAGS -b 0.0.0.0:8000 index:server
 
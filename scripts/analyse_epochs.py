@@ -1,10 +1,9 @@
-from struct import unpack
 from datetime import datetime
 import os
-from pathlib import Path
-from typing import NamedTuple
 import numpy as np
 
+from S15qkd.streams import HeadT7, read_header
+
 os.chdir('/epoch_files')
 ls = os.listdir()
 ls.remove('notify.pipe')
@@ -14,18 +13,9 @@ try:
 except ValueError:
     print('No saved file yet')
 
-class HeadT7(NamedTuple):
-    tag: int
-    epoch: int
-    num_epoch: int
-    length_bits: int
-
 def read_T7_header(filename: str):
-   if Path(filename).is_file():
-      with open(filename, 'rb') as f:
-         head_info = f.read(16)
-   headt7 = HeadT7._make(unpack('iIIi', head_info))
-   if (headt7.tag != 0x107 and headt7.tag != 7):
+   headt7 = read_header(filename)
+   if not isinstance(headt7, HeadT7):
       print(f'{filename} is not a Type7 file')
    return headt7
 
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""Benchmarks authd relay throughput over loopback with a dummy transferd pair.
+
+Two authd instances are started on localhost with a temporary self-signed
+certificate, the first acting as server and the second as client. A dummy
+transferd connects to each instance, and a fixed amount of data is streamed
+from one side to the other, optionally in both directions simultaneously.
+
+With '--control', messages are additionally sent over the authd control
+channel during the transfer, and their latency is reported. Control messages
+are scheduled ahead of the transferd stream, so the latency should remain low
+under full load. The difference is most visible when the link between the two
+instances is the bottleneck, which can be emulated with '--link_rate'.
+
+With '--compression', the link between the two instances is compressed, and the
+payload and on-wire bytes reported by authd are printed. Random payloads do not
+compress and should be passed through uncompressed; '--payload sparse' emulates
+data with lower entropy.
+
+To compare against another authd implementation, e.g. a previous revision:
+
+    git show <rev>:S15qkd/authd.py > /tmp/authd_legacy.py
+    python3 ./benchmark_authd.py --authd /tmp/authd_legacy.py
+
+Examples:
+    python3 ./benchmark_authd.py --megabytes 64 --bidirectional --control
+    python3 ./benchmark_authd.py --megabytes 8 --control --link_rate 2
+    python3 ./benchmark_authd.py --compression zlib --payload sparse --link_rate 20
+"""
+
+import argparse
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+AUTHD = REPO_ROOT / "S15qkd" / "authd.py"
+BLOCK_SIZE = 65536
+CONTROL_INTERVAL = 0.05  # seconds between control messages
+LINK_BUFFER = 65536  # socket buffer size of emulated link
+
+
+def generate_certificate(directory):
+    """Returns paths to a self-signed certificate and its private key."""
+    cert = Path(directory) / "cert.pem"
+    key = Path(directory) / "key.pem"
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-keyout",
+            key,
+            "-out",
+            cert,
+            "-days",
+            "1",
+            "-subj",
+            "/CN=localhost",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return cert, key
+
+
+def stats_path(cert, port_td):
+    return Path(cert).parent / f"authd_stats_{port_td}.json"
+
+
+def start_authd(args, cert, key, ports, log):
+    """Starts authd relaying between port 'ports[0]' and transferd port 'ports[1]'."""
+    port, port_td = ports
+    env = dict(os.environ)
+    pythonpath = [str(REPO_ROOT), str(REPO_ROOT / "S15qkd"), env.get("PYTHONPATH", "")]
+    env["PYTHONPATH"] = os.pathsep.join(pythonpath)
+    command = [
+        sys.executable,
+        str(args.authd),
+        "-H",
+        "127.0.0.1",
+        "-p",
+        str(port),
+        "-P",
+        str(port_td),
+        "-r",
+        str(cert),
+        "-c",
+        str(cert),
+        "-k",
+        str(key),
+    ]
+    if args.compression:
+        command += ["--compression", args.compression]
+        command += ["--stats_file", str(stats_path(cert, port_td))]
+    return subprocess.Popen(command, stdout=log, stderr=log, env=env)
+
+
+def connect(port, timeout=10):
+    """Connects as dummy transferd, retrying until authd listens."""
+    end = time.monotonic() + timeout
+    while True:
+        try:
+            return socket.create_connection(("127.0.0.1", port))
+        except ConnectionRefusedError:
+            if time.monotonic() > end:
+                raise
+            time.sleep(0.05)
+
+
+def make_payload(kind):
+    if kind == "sparse":
+        return bytes(random.choices(range(16), k=BLOCK_SIZE))  # 4 bits of entropy
+    return os.urandom(BLOCK_SIZE)
+
+
+def transfer(sender, receiver, args, results, key):
+    """Streams 'args.megabytes' from sender to receiver, stores elapsed time."""
+    total = args.megabytes * 1_000_000
+    payload = make_payload(args.payload)
+
+    def send():
+        remaining = total
+        while remaining > 0:
+            n = min(remaining, BLOCK_SIZE)
+            sender.sendall(payload[:n])
+            remaining -= n
+
+    thread = threading.Thread(target=send, daemon=True)
+    start = time.perf_counter()
+    thread.start()
+    received = 0
+    while received < total:
+        data = receiver.recv(BLOCK_SIZE)
+        if not data:
+            raise ConnectionError("Relay closed connection.")
+        received += len(data)
+    results[key] = time.perf_counter() - start
+    thread.join()
+
+
+def pump(src, dst, rate):
+    while data := src.recv(LINK_BUFFER):
+        dst.sendall(data)
+        time.sleep(len(data) / rate)
+
+
+def throttle_link(listen_port, target_port, rate):
+    """Forwards a single connection with throughput limited to 'rate' bytes/s."""
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, LINK_BUFFER)
+    server.bind(("127.0.0.1", listen_port))
+    server.listen()
+
+    def serve():
+        client, _ = server.accept()
+        upstream = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        upstream.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, LINK_BUFFER)
+        upstream.connect(("127.0.0.1", target_port))
+        for src, dst in ((client, upstream), (upstream, client)):
+            threading.Thread(target=pump, args=(src, dst, rate), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+
+
+def wait_relay(a, b, timeout=10):
+    """Blocks until a probe byte passes through the relay in both directions."""
+    a.settimeout(timeout)
+    b.settimeout(timeout)
+    a.sendall(b"\0")
+    b.recv(1)
+    b.sendall(b"\0")
+    a.recv(1)
+    a.settimeout(None)
+    b.settimeout(None)
+
+
+def measure_control(a, b, stop, latencies):
+    """Sends timestamped control messages from a to b until 'stop' is set."""
+    reader = b.makefile("r")
+    while not stop.is_set():
+        a.sendall(f"{time.perf_counter()}\n".encode())
+        sent = float(reader.readline())
+        latencies.append(time.perf_counter() - sent)
+        time.sleep(CONTROL_INTERVAL)
+
+
+def run(args, a, b, controls=None):
+    """Runs transfers between dummy transferd connections 'a' and 'b'.
+
+    Returns (elapsed time per direction, total elapsed time, control latencies).
+    """
+    results = {}
+    threads = [threading.Thread(target=transfer, args=(a, b, args, results, "a->b"))]
+    if args.bidirectional:
+        threads.append(
+            threading.Thread(target=transfer, args=(b, a, args, results, "b->a"))
+        )
+    latencies = []
+    stop = threading.Event()
+    if controls:
+        threads.append(
+            threading.Thread(target=measure_control, args=(*controls, stop, latencies))
+        )
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads[: 2 if args.bidirectional else 1]:
+        t.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for t in threads:
+        t.join()
+    return results, elapsed, latencies
+
+
+def read_link_statistics(args, cert):
+    """Returns statistics of the sending authd, once written after the transfer."""
+    if not args.compression:
+        return None
+    time.sleep(1.5)  # authd writes statistics every second
+    with open(stats_path(cert, args.port + 1)) as f:
+        return json.load(f)
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cert, key = generate_certificate(tmpdir)
+        log = open(Path(tmpdir) / "authd.log", "w")
+        procs = []
+        try:
+            # First instance fails to connect as client, and falls back to server
+            procs.append(start_authd(args, cert, key, (args.port, args.port + 1), log))
+            time.sleep(1)
+            port = args.port
+            if args.link_rate:
+                port = args.port + 5
+                throttle_link(port, args.port, args.link_rate * 1e6)
+            procs.append(start_authd(args, cert, key, (port, args.port + 3), log))
+            a = connect(args.port + 1)
+            b = connect(args.port + 3)
+            wait_relay(a, b)
+            controls = None
+            if args.control:
+                controls = (connect(args.port + 2), connect(args.port + 4))
+                wait_relay(*controls)
+            results, elapsed, latencies = run(args, a, b, controls)
+            link_stats = read_link_statistics(args, cert)
+        finally:
+            for p in procs:
+                p.terminate()
+                p.wait()
+            log.close()
+
+    total = args.megabytes * 1_000_000
+    print(f"Relayed {args.megabytes} MB per direction through {args.authd}:")
+    for direction, duration in sorted(results.items()):
+        print(f"  {direction}: {total / duration / 1e6:9.2f} MB/s")
+    print(f"  total: {total * len(results) / elapsed / 1e6:9.2f} MB/s")
+    if link_stats:
+        payload = link_stats["payload_bytes_sent"]
+        wire = link_stats["wire_bytes_sent"]
+        print(
+            f"Link ({link_stats['compression']}): {payload} payload bytes, "
+            f"{wire} bytes on wire (ratio {wire / max(payload, 1):.3f}), "
+            f"{link_stats['bypassed_frames']} frames bypassed"
+        )
+    if latencies:
+        print(
+            f"Control latency over {len(latencies)} messages: "
+            f"median {statistics.median(latencies) * 1e3:.2f} ms, "
+            f"max {max(latencies) * 1e3:.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.partition("\n")[0])
+    parser.add_argument(
+        "--authd", type=Path, default=AUTHD, help="Path to authd script to benchmark"
+    )
+    parser.add_argument(
+        "--megabytes", type=int, default=16, help="Megabytes to relay per direction"
+    )
+    parser.add_argument(
+        "--bidirectional", action="store_true", help="Relay in both directions at once"
+    )
+    parser.add_argument(
+        "--control",
+        action="store_true",
+        help="Measure control channel latency during transfer",
+    )
+    parser.add_argument(
+        "--link_rate", type=float, help="Limit link between authd instances, in MB/s"
+    )
+    parser.add_argument(
+        "--compression",
+        choices=("none", "zlib", "zstd", "auto"),
+        help="Link compression, not passed to authd if unspecified",
+    )
+    parser.add_argument(
+        "--payload",
+        choices=("random", "sparse"),
+        default="random",
+        help="Relayed data, either incompressible or with 4 bits of entropy per byte",
+    )
+    parser.add_argument(
+        "--port", type=int, default=45555, help="Base port, six consecutive are used"
+    )
+    main(parser.parse_args())
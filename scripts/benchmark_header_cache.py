@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Benchmarks splicer epoch gating with and without the epoch header cache.
+
+Synthetic T3 and T4 epoch files are written into temporary 't3' and
+'receivefiles' directories. Each epoch is then gated as in
+'Splicer.send_splice_inpipe', i.e. both headers are read and their base bits
+compared, using either the legacy uncached header readers or the cached
+readers in 'S15qkd.utils'. Epochs are gated '--repeats' times, to emulate
+retry loops reading the same files.
+
+Examples:
+    python3 ./benchmark_header_cache.py --epochs 1000 --repeats 4
+"""
+
+import argparse
+import struct
+import tempfile
+import time
+from pathlib import Path
+
+from S15qkd.utils import (
+    HeadT3,
+    HeadT4,
+    header_cache,
+    read_T3_header,
+    read_T4_header,
+)
+
+EPOCH_START = 0xB0000000
+BODY_SIZE = 4096  # bytes, headers only are read
+
+
+def generate_epochs(directory, count):
+    """Writes T3 and T4 files for 'count' epochs, returns the epoch names."""
+    t3_dir = Path(directory) / "t3"
+    t4_dir = Path(directory) / "receivefiles"
+    t3_dir.mkdir()
+    t4_dir.mkdir()
+    body = bytes(BODY_SIZE)
+    epochs = []
+    for i in range(count):
+        epoch = EPOCH_START + i
+        name = f"{epoch:x}"
+        (t3_dir / name).write_bytes(struct.pack("iIIi", 0x103, epoch, 1000, 1) + body)
+        (t4_dir / name).write_bytes(
+            struct.pack("iIIii", 0x104, epoch, 1000, 1, 0) + body
+        )
+        epochs.append(name)
+    return str(t3_dir), str(t4_dir), epochs
+
+
+def read_T3_header_legacy(file_name):
+    if not Path(file_name).is_file():
+        return HeadT3(3, int(file_name.split("/")[-1], 16), 0, 0)
+    with open(file_name, "rb") as f:
+        return HeadT3._make(struct.unpack("iIIi", f.read(16)))
+
+
+def read_T4_header_legacy(file_name):
+    if not Path(file_name).is_file():
+        return HeadT4(4, 0, 0, 0, -1)
+    with open(file_name, "rb") as f:
+        return HeadT4._make(struct.unpack("iIIii", f.read(20)))
+
+
+def gate(readers, t3_dir, t4_dir, epochs):
+    """Returns the number of epochs passing the BBM92 base bits check."""
+    read_t3, read_t4 = readers
+    passed = 0
+    for epoch in epochs:
+        headt3 = read_t3(f"{t3_dir}/{epoch}")
+        headt4 = read_t4(f"{t4_dir}/{epoch}")
+        passed += headt3.bits_per_entry == 1 and headt4.base_bits == 0
+    return passed
+
+
+def timeit(readers, args, dirs):
+    start = time.perf_counter()
+    passed = sum(gate(readers, *dirs) for _ in range(args.repeats))
+    return time.perf_counter() - start, passed
+
+
+def main(args):
+    header_cache.maxsize = max(header_cache.maxsize, 2 * args.epochs)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        dirs = generate_epochs(tmpdir, args.epochs)
+        legacy = (read_T3_header_legacy, read_T4_header_legacy)
+        elapsed_legacy, expected = timeit(legacy, args, dirs)
+        header_cache.clear()
+        elapsed, passed = timeit((read_T3_header, read_T4_header), args, dirs)
+        if passed != expected:
+            raise AssertionError(f"Gating mismatch: {passed} != {expected}")
+
+    n = args.epochs * args.repeats
+    info = header_cache.info()
+    print(f"Gated {args.epochs} epochs {args.repeats} times each:")
+    print(f"  legacy: {n / elapsed_legacy:12.0f} epochs/s")
+    print(f"  cached: {n / elapsed:12.0f} epochs/s")
+    print(f"  speedup: {elapsed_legacy / elapsed:11.1f}x")
+    print(f"  cache hits {info['hits']}, misses {info['misses']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.partition("\n")[0])
+    parser.add_argument(
+        "--epochs", type=int, default=1000, help="Number of synthetic epochs"
+    )
+    parser.add_argument(
+        "--repeats", type=int, default=4, help="Number of times each epoch is gated"
+    )
+    main(parser.parse_args())
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""Benchmarks 'S15qkd.utils.service_T3' against the legacy per-entry decoder.
+
+Synthetic service mode T3 epochs (8 bits per entry) are written into a
+temporary directory, then decoded by both implementations. The results are
+checked for equality before timings are reported.
+
+Examples:
+    python3 ./benchmark_service_T3.py --entries 100000 --epochs 20
+"""
+
+import argparse
+import math
+import struct
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from S15qkd.utils import ServiceT3, read_T3_header, service_T3
+
+HEADER_SIZE = 16
+EPOCH_START = 0xB0000000
+GARBAGE_FRACTION = 0.01
+
+
+def generate_service_T3(path, epoch, entries, qber=0.05, rng=None):
+    """Writes a synthetic service mode T3 epoch file and returns its path.
+
+    Each entry holds Alice's detector pattern in the upper nibble and Bob's in
+    the lower nibble. Patterns are one-hot, with a small fraction of entries
+    replaced by random (typically multi-click) patterns.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    onehot = np.array([1, 2, 4, 8], dtype=np.uint8)
+
+    # Alice picks a random detector, Bob matches with error 'qber'
+    alice = rng.integers(0, 4, entries)
+    bob = alice ^ 2  # anti-correlated within the same basis
+    is_err = rng.random(entries) < qber
+    bob[is_err] = alice[is_err]
+    body = (onehot[alice] << 4) | onehot[bob]
+    is_garbage = rng.random(entries) < GARBAGE_FRACTION
+    body[is_garbage] = rng.integers(0, 256, is_garbage.sum(), dtype=np.uint8)
+
+    # Pad to 32-bit words, stored most significant byte first
+    num_words = math.ceil(entries / 4)
+    padded = np.zeros(num_words * 4, dtype=np.uint8)
+    padded[:entries] = body
+    words = padded.view(np.uint32).byteswap()
+
+    file_path = Path(path) / f"{epoch:x}"
+    with open(file_path, "wb") as f:
+        f.write(struct.pack("iIIi", 0x103, epoch, entries, 8))
+        f.write(words.astype("<u4").tobytes())
+    return str(file_path)
+
+
+def service_T3_legacy(file_name):
+    """Per-entry decoder, retained as the reference implementation."""
+    decode = [-1, 0, 1, -1, 2, -1, -1, -1, 3, -1, -1, -1, -1, -1, -1, -1]
+    body = []
+    headt3 = read_T3_header(file_name)
+    with open(file_name, "rb") as f:
+        f.seek(HEADER_SIZE)
+        word = f.read(4)
+        while word != b"":
+            (dat,) = struct.unpack("<I", word)
+            dat_bytes = dat.to_bytes(4, "little")
+            body.append(dat_bytes[3])
+            body.append(dat_bytes[2])
+            body.append(dat_bytes[1])
+            body.append(dat_bytes[0])
+            word = f.read(4)
+
+    service = ServiceT3(headt3, [0] * 16, [0, 0], 0, 1)
+    for i in range(headt3.length_entry):
+        b = decode[body[i] & 0xF]
+        a = decode[(body[i] >> 4) & 0xF]
+        if a < 0:
+            service.garbage[0] += 1
+        if b < 0:
+            service.garbage[1] += 1
+        if (a >= 0) and (b >= 0):
+            service.coinc_matrix[a * 4 + b] += 1
+            service.okcount += 1
+
+    er_coin = sum(service.coinc_matrix[i] for i in [0, 5, 10, 15])
+    gd_coin = sum(service.coinc_matrix[i] for i in [2, 7, 8, 13])
+    if (er_coin + gd_coin) == 0:
+        service.qber = 1.0
+        return service
+    service.qber = float(round(er_coin / (er_coin + gd_coin), 3))
+    return service
+
+
+def timeit(func, paths):
+    start = time.perf_counter()
+    results = [func(path) for path in paths]
+    return time.perf_counter() - start, results
+
+
+def main(args):
+    rng = np.random.default_rng(args.seed)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = [
+            generate_service_T3(tmpdir, EPOCH_START + i, args.entries, rng=rng)
+            for i in range(args.epochs)
+        ]
+
+        elapsed_legacy, expected = timeit(service_T3_legacy, paths)
+        elapsed, results = timeit(service_T3, paths)
+        for path, r, e in zip(paths, results, expected):
+            if r != e:
+                raise AssertionError(f"Decoder mismatch for '{path}': {r} != {e}")
+
+    n = args.epochs
+    print(f"Decoded {n} epochs of {args.entries} entries each:")
+    print(f"  legacy:     {elapsed_legacy / n * 1e3:9.3f} ms/epoch")
+    print(f"  vectorized: {elapsed / n * 1e3:9.3f} ms/epoch")
+    print(f"  speedup:    {elapsed_legacy / elapsed:9.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.partition("\n")[0])
+    parser.add_argument(
+        "--entries",
+        type=int,
+        default=100_000,
+        help="Number of entries per synthetic epoch",
+    )
+    parser.add_argument(
+        "--epochs", type=int, default=20, help="Number of synthetic epochs to decode"
+    )
+    parser.add_argument(
+        "--seed", type=int, help="Sets the initial seed for random number generation"
+    )
+    main(parser.parse_args())
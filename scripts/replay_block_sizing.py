@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""Replays recorded ecnote histories against the error correction block sizing policies.
+
+Lines of the form '[ecnote] EPOCH RAW_BITS FINAL_BITS ERR_FRACTION NUM_EPOCHS'
+are extracted from QKDServer logs, see 'make log-finalkeys'. Each recorded
+block supplies the raw bit rate per epoch and the measured error fraction,
+which are replayed epoch by epoch through each policy. Final key bits of
+the resized blocks are predicted from the finite-size penalties measured in
+the recorded blocks, see 'empirical_model()', independent of the penalty
+model of the adaptive policy.
+
+Examples:
+    python3 ./replay_block_sizing.py logs/20261017_000000.log
+"""
+
+import argparse
+import re
+import statistics
+
+import numpy as np
+
+from S15qkd.modules.errc import block_sizing
+from S15qkd.modules.errc.block_sizing import asymptotic_key_fraction
+
+EPOCH_DURATION = (1 << 29) * 1e-9  # in seconds
+ECNOTE_PATTERN = re.compile(r"\[ecnote\] ([0-9a-f]+) (\d+) (\d+) ([0-9.eE+-]+) (\d+)")
+GROUP_SIZE = 10  # recorded blocks per median of the finite-size penalty
+
+
+def parse_ecnotes(paths):
+    """Returns list of (raw_bits, final_bits, err_fraction, num_epochs)."""
+    records = []
+    for path in paths:
+        with open(path, "r", errors="replace") as f:
+            for line in f:
+                match = ECNOTE_PATTERN.search(line)
+                if match is None:
+                    continue
+                _, raw, final, err, epochs = match.groups()
+                records.append((int(raw), int(final), float(err), int(epochs)))
+    return records
+
+
+def empirical_model(records):
+    """Returns function of (raw_bits, qber) predicting final bits of a block.
+
+    The finite-size penalty of each recorded block, i.e. its asymptotic key
+    fraction minus its final key fraction, is taken as the median over groups
+    of 'GROUP_SIZE' blocks of similar size, and interpolated in the logarithm
+    of the block size. Beyond the recorded block sizes, the penalty of the
+    nearest group is used.
+    """
+    raw = np.array([r[0] for r in records], dtype=np.float64)
+    final = np.array([r[1] for r in records], dtype=np.float64)
+    asymptotic = np.array([asymptotic_key_fraction(r[2]) for r in records])
+    order = np.argsort(raw)
+    log_raw = np.log(raw[order])
+    penalty = (asymptotic - final / raw)[order]
+    groups = np.array_split(np.arange(len(raw)), max(len(raw) // GROUP_SIZE, 1))
+    x = [np.median(log_raw[g]) for g in groups]
+    y = [np.median(penalty[g]) for g in groups]
+
+    def model(n, qber):
+        fraction = asymptotic_key_fraction(qber) - np.interp(np.log(n), x, y)
+        return max(0.0, n * fraction)
+
+    return model
+
+
+def replay(policy, records, model):
+    """Replays recorded blocks epoch-by-epoch through the block sizing policy.
+
+    Returns the list of dispatched blocks as (raw_bits, num_epochs, final_bits).
+    """
+    blocks = []
+    raw_bits = num_epochs = 0
+    for raw, _, err, epochs in records:
+        bits_per_epoch = raw / epochs
+        for _ in range(epochs):
+            raw_bits += bits_per_epoch
+            num_epochs += 1
+            if policy.should_dispatch(raw_bits, num_epochs):
+                final = model(raw_bits, err)
+                blocks.append((raw_bits, num_epochs, final))
+                policy.update(int(raw_bits), int(final), err, err)
+                raw_bits = num_epochs = 0
+    return blocks
+
+
+def main(args):
+    records = parse_ecnotes(args.logs)
+    if not records:
+        raise ValueError("No ecnote records found.")
+
+    model = empirical_model(records)
+    policies = {
+        "static": block_sizing.StaticBlockSizing(args.minimal_block_size),
+        "adaptive": block_sizing.AdaptiveBlockSizing(
+            args.minimal_block_size,
+            maximum_block_epochs=args.maximum_block_epochs,
+            finite_size_tolerance=args.finite_size_tolerance,
+        ),
+    }
+    total_epochs = sum(r[3] for r in records)
+    total_final = sum(r[1] for r in records)
+    print(f"Replayed {len(records)} blocks over {total_epochs} epochs")
+    print(
+        f"  {'recorded':>10}: {total_final / (total_epochs * EPOCH_DURATION):9.1f} bps"
+    )
+    for name, policy in policies.items():
+        blocks = replay(policy, records, model)
+        final = sum(b[2] for b in blocks)
+        latency = (
+            statistics.mean(b[1] for b in blocks) * EPOCH_DURATION if blocks else 0
+        )
+        print(
+            f"  {name:>10}: {final / (total_epochs * EPOCH_DURATION):9.1f} bps, "
+            f"{len(blocks)} blocks, mean accumulation {latency:.1f} s"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.partition("\n")[0])
+    parser.add_argument("logs", nargs="+", help="QKDServer log files")
+    parser.add_argument(
+        "--minimal_block_size",
+        type=int,
+        default=20000,
+        help="Minimal raw bits per block, see 'minimal_block_size' in config",
+    )
+    parser.add_argument(
+        "--maximum_block_epochs",
+        type=int,
+        default=block_sizing.MAXIMUM_BLOCK_EPOCHS,
+        help="Maximum number of epochs per block for adaptive policy",
+    )
+    parser.add_argument(
+        "--finite_size_tolerance",
+        type=float,
+        default=block_sizing.FINITE_SIZE_TOLERANCE,
+        help="Tolerated finite-size penalty relative to asymptotic key fraction",
+    )
+    main(parser.parse_args())
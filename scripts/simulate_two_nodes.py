@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""Runs a two-node key generation simulation on one host and measures its performance.
+
+Two QKD engines, 'alice' and 'bob', are started as separate controller
+processes, each with its own configuration, data root and final key folder in
+the working directory. They are connected through their authd instances over
+loopback. Each node runs in its own PID namespace, so that the cleanup of
+orphaned qcrypto processes in one engine does not kill the other's.
+
+The qcrypto programs (transferd, chopper, chopper2, costream, splicer, pfind,
+errcd, getrate) are taken from an existing build in '--qcrypto', while
+readevents is replaced by the timestamp simulator. Both sides stream their half
+of the same simulated entangled pair source, with configurable pair rate,
+QBER, background rate, and clock drift and offset of bob relative to alice.
+
+Once both engines are connected, alice starts key generation, and the
+following are measured from the engine status, the first two from the start:
+
+    pfind_s       time until the initial time difference is found
+    first_key_s   time until the first error corrected key bits
+    key_rate_bps  steady-state final key rate over '--duration' seconds
+    restart_s     time until the process killed by '--restart' runs again
+    recovery_s    time from the kill until key bits are generated again
+
+Results are printed as JSON, and the engine logs remain in the working
+directory. Requires root for 'unshare', as well as 'openssl'.
+
+Examples:
+    sudo python3 ./simulate_two_nodes.py --qcrypto ~/qcrypto/remotecrypto
+    sudo python3 ./simulate_two_nodes.py --qcrypto bin --qber 0.08 --drift 1e-7
+    python3 ./simulate_two_nodes.py --prepare_only --workdir /tmp/two_nodes
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_CONFIG = REPO_ROOT / "S15qkd" / "configs" / "qkd_engine_config.default.json"
+SIMULATOR = REPO_ROOT / "S15qkd" / "timestampsimulator" / "readevents_simulator.py"
+NODES = ("alice", "bob")
+QCRYPTO_PROGRAMS = (
+    "transferd",
+    "chopper",
+    "chopper2",
+    "costream",
+    "splicer",
+    "pfind",
+    "errcd",
+    "getrate",
+)
+NODE_COMMANDS = (
+    "start_service_mode",
+    "start_key_generation",
+    "stop_key_gen",
+    "restart_transferd",
+    "restart_connection",
+)
+STATUS_INTERVAL = 0.5  # seconds
+POLL_INTERVAL = 0.2  # seconds
+
+READEVENTS = """#!/bin/sh
+# Stand-in for readevents, generated by simulate_two_nodes.py.
+# Hardware options are ignored, and flush calls with '-q1' exit immediately.
+for arg in "$@"; do
+    [ "$arg" = "-q1" ] && exit 0
+done
+exec {command}
+"""
+
+
+# Node process, started by the harness in its own PID namespace
+
+
+def write_json(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, default=str)
+    os.replace(tmp, path)
+
+
+def collect_status(controller):
+    """Returns engine status, with errors recorded instead of raised."""
+    status = {"time": time.time()}
+    getters = {
+        "status": controller.get_status_info,
+        "processes": controller.get_process_states,
+        "errc": controller.get_error_corr_info,
+    }
+    for key, getter in getters.items():
+        try:
+            status[key] = getter()
+        except Exception as e:  # engine may be partially started
+            status[key] = {"error": repr(e)}
+    return status
+
+
+def serve_commands(controller, qkd_globals):
+    """Executes commands from stdin, e.g. 'start_key_generation' or 'kill costream'."""
+    for line in sys.stdin:
+        command, _, arg = line.strip().partition(" ")
+        qkd_globals.logger.info(f"Simulation harness command: {line.strip()}")
+        if command == "kill":
+            qkd_globals.kill_process_by_name(arg)
+        elif command in NODE_COMMANDS:
+            threading.Thread(target=getattr(controller, command), daemon=True).start()
+
+
+def run_node(node_dir):
+    os.chdir(node_dir)
+    from S15qkd import controller, qkd_globals  # noqa: PLC0415, starts the engine
+
+    commands = threading.Thread(
+        target=serve_commands, args=(controller, qkd_globals), daemon=True
+    )
+    commands.start()
+    while commands.is_alive():
+        write_json(Path(node_dir) / "status.json", collect_status(controller))
+        time.sleep(STATUS_INTERVAL)
+    controller.stop()
+
+
+# Harness
+
+
+def generate_certificate(directory):
+    """Returns paths to a self-signed certificate and its private key."""
+    cert = Path(directory) / "cert.pem"
+    key = Path(directory) / "key.pem"
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-keyout",
+            key,
+            "-out",
+            cert,
+            "-days",
+            "1",
+            "-subj",
+            "/CN=localhost",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return cert, key
+
+
+def simulator_command(args, side, start_ns):
+    options = {
+        "-rate": args.rate,
+        "-side": side,
+        "-seed": args.seed,
+        "-start_ns": start_ns,
+        "-qber": args.qber,
+        "-drift": args.drift,
+        "-offset": args.offset,
+        "-background": args.background,
+    }
+    command = [sys.executable, str(SIMULATOR)]
+    for option, value in options.items():
+        command += [option, str(value)]
+    return " ".join(command)
+
+
+def prepare_programs(args, node_dir, side, start_ns):
+    """Links qcrypto programs into the node, with readevents as simulator."""
+    bin_dir = node_dir / "bin"
+    bin_dir.mkdir()
+    for program in QCRYPTO_PROGRAMS:
+        target = Path(args.qcrypto or "qcrypto").resolve() / program
+        (bin_dir / program).symlink_to(target)
+    readevents = bin_dir / "readevents"
+    command = simulator_command(args, side, start_ns)
+    readevents.write_text(READEVENTS.format(command=command))
+    readevents.chmod(0o755)
+
+
+def node_config(args, node_dir, index, credentials):
+    """Returns the engine configuration of the node with 'index' in NODES."""
+    cert, key = credentials
+    config = json.loads(DEFAULT_CONFIG.read_text())
+    config.update(
+        identity=NODES[index],
+        target_hostname="127.0.0.1",
+        local_authd_ip="127.0.0.1",
+        remote_cert=str(cert),
+        local_cert=str(cert),
+        local_key=str(key),
+        port_authd=args.port,
+        port_transd=args.port + 1 + 2 * index,
+        port_authd_control=args.port + 2 + 2 * index,
+        data_root=str(node_dir / "data"),
+        program_root=str(node_dir / "bin"),
+        final_keys_root=str(node_dir / "epoch_files"),
+        history_root=str(node_dir / "history"),
+    )
+    config["qcrypto"]["readevents"]["use_blinding_countermeasure"] = False
+    config["qcrypto"]["pfind"]["frequency_search"] = False
+    config["qcrypto"]["frequency_correction"]["enable"] = False
+    config["ENVIRONMENT"]["raise_readevents_priority"] = False
+    return config
+
+
+def prepare_nodes(args, workdir):
+    """Creates node directories, returns their paths."""
+    credentials = generate_certificate(workdir)
+    start_ns = time.time_ns()
+    node_dirs = []
+    for index, side in enumerate(NODES):
+        node_dir = workdir / side
+        node_dir.mkdir()
+        prepare_programs(args, node_dir, side, start_ns)
+        config = node_config(args, node_dir, index, credentials)
+        write_json(node_dir / "config.json", config)
+        node_dirs.append(node_dir)
+    return node_dirs
+
+
+def start_node(node_dir):
+    env = dict(os.environ)
+    pythonpath = [str(REPO_ROOT), str(REPO_ROOT / "S15qkd"), env.get("PYTHONPATH", "")]
+    env["PYTHONPATH"] = os.pathsep.join(pythonpath)
+    env["QKD_ENGINE_CONFIG"] = str(node_dir / "config.json")
+    command = ["unshare", "--pid", "--mount-proc", "--kill-child"]
+    command += [sys.executable, str(Path(__file__).resolve()), "--node", str(node_dir)]
+    log = open(node_dir / "node.log", "w")
+    return subprocess.Popen(
+        command,
+        cwd=node_dir,
+        env=env,
+        stdin=subprocess.PIPE,
+        stdout=log,
+        stderr=log,
+        text=True,
+    )
+
+
+class Nodes:
+    """Running nodes, with commands and status by node name."""
+
+    def __init__(self, node_dirs):
+        self.dirs = dict(zip(NODES, node_dirs))
+        self.procs = {}
+
+    def start(self, delay):
+        # First authd fails to connect as client, and falls back to server
+        for name, node_dir in self.dirs.items():
+            self.procs[name] = start_node(node_dir)
+            time.sleep(delay)
+
+    def stop(self):
+        for proc in self.procs.values():
+            proc.terminate()
+            proc.wait()
+
+    def send(self, name, command):
+        self.procs[name].stdin.write(f"{command}\n")
+        self.procs[name].stdin.flush()
+
+    def status(self, name):
+        try:
+            with open(self.dirs[name] / "status.json") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def wait_for(self, predicate, timeout, names=NODES, since=None):
+        """Returns seconds until 'predicate(status)' holds for any node, or None.
+
+        Seconds are counted from the monotonic time 'since', default now.
+        """
+        start = time.monotonic()
+        if since is None:
+            since = start
+        while time.monotonic() - start < timeout:
+            for name, proc in self.procs.items():
+                if proc.poll() is not None:
+                    raise RuntimeError(f"Node {name} exited, see its node.log")
+                if name in names and predicate(self.status(name)):
+                    return time.monotonic() - since
+            time.sleep(POLL_INTERVAL)
+        return None
+
+
+def field(status, key, name):
+    value = status.get(key, {}).get(name)
+    return None if value in ("", None) else value
+
+
+def key_bits(status):
+    return field(status, "errc", "total_ec_key_bits") or 0
+
+
+def measure_key_rate(nodes, duration):
+    """Returns the final key rate of alice in bits/s, averaged over 'duration'."""
+    start, bits = time.monotonic(), key_bits(nodes.status("alice"))
+    time.sleep(duration)
+    elapsed = time.monotonic() - start
+    return (key_bits(nodes.status("alice")) - bits) / elapsed
+
+
+def measure_recovery(nodes, process, timeout):
+    """Kills 'process' in alice, returns seconds until it and key generation resume."""
+    bits = key_bits(nodes.status("alice"))
+    start = time.monotonic()
+    nodes.send("alice", f"kill {process}")
+    time.sleep(STATUS_INTERVAL * 2)
+    running = nodes.wait_for(
+        lambda s: field(s, "processes", process) is True, timeout, ["alice"]
+    )
+    resumed = nodes.wait_for(lambda s: key_bits(s) > bits, timeout, ["alice"])
+    if running is None:
+        return None, None
+    restart = running + STATUS_INTERVAL * 2
+    return restart, None if resumed is None else time.monotonic() - start
+
+
+def measure(args, nodes):
+    results = {}
+    connected = nodes.wait_for(lambda s: field(s, "status", "connection_status"), 60)
+    if connected is None:
+        raise RuntimeError("Nodes failed to connect through authd")
+    start = time.monotonic()
+    nodes.send("alice", args.start)
+    results["pfind_s"] = nodes.wait_for(
+        lambda s: field(s, "status", "init_time_diff") is not None,
+        args.timeout,
+        since=start,
+    )
+    results["first_key_s"] = nodes.wait_for(
+        lambda s: key_bits(s) > 0, args.timeout, since=start
+    )
+    if results["first_key_s"] is None:
+        return results
+    results["key_rate_bps"] = measure_key_rate(nodes, args.duration)
+    results["qber"] = field(nodes.status("alice"), "errc", "ec_err_fraction")
+    if args.restart != "none":
+        recovery = measure_recovery(nodes, args.restart, args.timeout)
+        results["restart_s"], results["recovery_s"] = recovery
+    return results
+
+
+def main(args):
+    if args.node:
+        run_node(args.node)
+        return
+    if args.seed is None:
+        args.seed = random.getrandbits(32)
+    if not args.prepare_only:
+        missing = [p for p in QCRYPTO_PROGRAMS if not (args.qcrypto / p).exists()]
+        if missing:
+            raise SystemExit(f"Missing qcrypto programs in {args.qcrypto}: {missing}")
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="two_nodes_"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    nodes = Nodes(prepare_nodes(args, workdir))
+    if args.prepare_only:
+        print(f"Prepared nodes in {workdir}")
+        return
+
+    try:
+        nodes.start(args.node_delay)
+        results = measure(args, nodes)
+    finally:
+        nodes.stop()
+    parameters = {k: v for k, v in vars(args).items() if k not in ("node", "qcrypto")}
+    report = {"parameters": parameters, "workdir": workdir, "results": results}
+    print(json.dumps(report, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.partition("\n")[0])
+    parser.add_argument("--qcrypto", type=Path, help="Directory of qcrypto programs")
+    parser.add_argument("--workdir", help="Directory for nodes, temporary if unset")
+    parser.add_argument(
+        "--rate", type=float, default=20000, help="Detected pair rate, in 1/s"
+    )
+    parser.add_argument(
+        "--qber", type=float, default=0.03, help="Bit error probability"
+    )
+    parser.add_argument(
+        "--background",
+        type=float,
+        default=10000,
+        help="Uncorrelated event rate per side, in 1/s",
+    )
+    parser.add_argument(
+        "--drift", type=float, default=0.0, help="Relative clock drift of bob"
+    )
+    parser.add_argument(
+        "--offset", type=float, default=1e-3, help="Clock offset of bob, in seconds"
+    )
+    parser.add_argument("--seed", type=int, help="Seed of simulated source")
+    parser.add_argument(
+        "--start",
+        choices=("start_key_generation", "start_service_mode"),
+        default="start_key_generation",
+        help="Command sent to alice once connected",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=60,
+        help="Seconds over which the steady-state key rate is measured",
+    )
+    parser.add_argument(
+        "--restart",
+        choices=("none", "costream", "chopper", "chopper2", "splicer", "transferd"),
+        default="costream",
+        help="Process killed in alice to measure recovery",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=300, help="Timeout of each stage, in seconds"
+    )
+    parser.add_argument(
+        "--node_delay", type=float, default=5, help="Seconds between node starts"
+    )
+    parser.add_argument(
+        "--port", type=int, default=55600, help="Base port, five consecutive are used"
+    )
+    parser.add_argument(
+        "--prepare_only",
+        action="store_true",
+        help="Only create node directories, e.g. to inspect configuration",
+    )
+    parser.add_argument("--node", help=argparse.SUPPRESS)  # internal, runs node
+    args = parser.parse_args()
+    if not (args.qcrypto or args.prepare_only or args.node):
+        parser.error("--qcrypto is required unless --prepare_only")
+    main(args)
@@ -0,0 +1,180 @@
+"""Channel prioritization of the authd link, with two authd instances over loopback."""
+
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+AUTHD = REPO_ROOT / "S15qkd" / "authd.py"
+HIGH_WATERMARK = 1 << 20
+LOW_WATERMARK = 1 << 18
+
+pytestmark = pytest.mark.skipif(
+    shutil.which("openssl") is None, reason="openssl not available"
+)
+
+
+def free_port_base(count: int = 4) -> int:
+    """Returns a port with 'count' consecutive ports free."""
+    for _ in range(100):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            base = s.getsockname()[1]
+        if base + count > 65535:
+            continue
+        try:
+            for port in range(base, base + count):
+                with socket.socket() as s:
+                    s.bind(("127.0.0.1", port))
+        except OSError:
+            continue
+        return base
+    raise RuntimeError("No free ports.")
+
+
+def connect(port: int, timeout: float = 10) -> socket.socket:
+    """Connects as a local client of authd, retrying until authd listens."""
+    end = time.monotonic() + timeout
+    while True:
+        try:
+            s = socket.create_connection(("127.0.0.1", port))
+            if s.getsockname() != s.getpeername():
+                return s
+            s.close()  # connected to itself, since the port is in the ephemeral range
+        except ConnectionRefusedError:
+            if time.monotonic() > end:
+                raise
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def authd_pair(tmp_path):
+    """Starts two linked authd instances, returns their (transferd, control) ports."""
+    cert, key = tmp_path / "cert.pem", tmp_path / "key.pem"
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-keyout",
+            key,
+            "-out",
+            cert,
+            "-days",
+            "1",
+            "-subj",
+            "/CN=localhost",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([str(REPO_ROOT), str(REPO_ROOT / "S15qkd")])
+    base = free_port_base(5)
+    link_port, sides = base, ((base + 1, base + 2), (base + 3, base + 4))
+    procs = []
+    with open(tmp_path / "authd.log", "w") as log:
+        try:
+            for i, (port_td, _) in enumerate(sides):
+                procs.append(
+                    subprocess.Popen(
+                        [
+                            sys.executable,
+                            str(AUTHD),
+                            "-H",
+                            "127.0.0.1",
+                            "-p",
+                            str(link_port),
+                            "-P",
+                            str(port_td),
+                            "-r",
+                            str(cert),
+                            "-c",
+                            str(cert),
+                            "-k",
+                            str(key),
+                            "--high_watermark",
+                            str(HIGH_WATERMARK),
+                            "--low_watermark",
+                            str(LOW_WATERMARK),
+                            "--stats_file",
+                            str(tmp_path / f"stats_{i}.json"),
+                        ],
+                        stdout=log,
+                        stderr=log,
+                        env=env,
+                        cwd=tmp_path,
+                    )
+                )
+                if i == 0:
+                    connect(link_port).close()  # first instance listens as server
+            yield sides, tmp_path
+        finally:
+            for p in procs:
+                p.terminate()
+                p.wait()
+
+
+def test_control_not_delayed_by_slow_transferd(authd_pair):
+    ((td_a, control_a), (td_b, control_b)), tmp_path = authd_pair
+    sender, slow_receiver = connect(td_a), connect(td_b)  # 'slow_receiver' never reads
+    control_sender, control_receiver = connect(control_a), connect(control_b)
+    control_receiver.settimeout(10)
+    lines = control_receiver.makefile("r")
+
+    control_sender.sendall(b"ready\n")
+    assert lines.readline() == "ready\n"
+
+    stop = threading.Event()
+
+    def flood():
+        block = os.urandom(65536)
+        try:
+            while not stop.is_set():
+                sender.sendall(block)
+        except OSError:
+            pass
+
+    threading.Thread(target=flood, daemon=True).start()
+    try:
+        # Wait until the sending authd runs out of credit for transferd and buffers
+        # up to the high watermark
+        end = time.monotonic() + 20
+        while True:
+            assert time.monotonic() < end, (
+                "transferd channel never filled up:\n"
+                + (tmp_path / "authd.log").read_text()[-4000:]
+            )
+            try:
+                stats = json.loads((tmp_path / "stats_0.json").read_text())
+                if stats["channels"]["authd (transferd)"]["buffered"] >= HIGH_WATERMARK:
+                    break
+            except (OSError, ValueError, KeyError):
+                pass
+            time.sleep(0.1)
+        time.sleep(1)
+
+        start = time.monotonic()
+        control_sender.sendall(b"st1:abc\n")
+        assert lines.readline() == "st1:abc\n"
+        assert time.monotonic() - start < 1
+
+        # Data for the slow transferd remains within the credit granted
+        time.sleep(1.5)
+        stats = json.loads((tmp_path / "stats_1.json").read_text())
+        assert stats["channels"]["transferd"]["buffered"] <= HIGH_WATERMARK
+    finally:
+        stop.set()
+        for s in (sender, slow_receiver, control_sender, control_receiver):
+            s.close()
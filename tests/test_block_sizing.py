@@ -0,0 +1,59 @@
+"""Block sizing policies replayed against a recorded ecnote log."""
+
+from pathlib import Path
+
+import pytest
+
+from S15qkd.modules.errc.block_sizing import (
+    MAXIMUM_BLOCK_EPOCHS,
+    MAXIMUM_BLOCK_SIZE,
+    AdaptiveBlockSizing,
+    StaticBlockSizing,
+)
+from scripts.replay_block_sizing import empirical_model, parse_ecnotes, replay
+
+# '[ecnote]' lines of blocks dispatched with 'minimal_block_size' 20000, 80000
+# and 320000 raw bits in turn, see header of the file
+ECNOTES = Path(__file__).parent / "data" / "ecnotes.log"
+MINIMAL_BLOCK_SIZE = 20000
+
+
+@pytest.fixture(scope="module")
+def records():
+    return parse_ecnotes([ECNOTES])
+
+
+def test_model_reproduces_recorded_final_bits(records):
+    model = empirical_model(records)
+    predicted = sum(model(raw, err) for raw, _, err, _ in records)
+    recorded = sum(final for _, final, _, _ in records)
+    assert predicted == pytest.approx(recorded, rel=0.02)
+
+
+def test_static_replay_matches_recorded_blocks(records):
+    recorded = [r for r in records if r[0] < 4 * MINIMAL_BLOCK_SIZE]
+    blocks = replay(StaticBlockSizing(MINIMAL_BLOCK_SIZE), recorded, lambda n, q: 0)
+    assert all(
+        raw > MINIMAL_BLOCK_SIZE and epochs % 2 == 1 for raw, epochs, _ in blocks
+    )
+    assert len(blocks) == pytest.approx(len(recorded), rel=0.1)
+    mean_raw = sum(b[0] for b in blocks) / len(blocks)
+    assert mean_raw == pytest.approx(
+        sum(r[0] for r in recorded) / len(recorded), rel=0.05
+    )
+
+
+def test_adaptive_sizes_blocks_from_recorded_ecnotes(records):
+    policy = AdaptiveBlockSizing(MINIMAL_BLOCK_SIZE)
+    for raw, final, err, _ in records:
+        policy.update(raw, final, err, err)
+    # Recorded finite-size penalty at the minimal block size exceeds the tolerance
+    assert MINIMAL_BLOCK_SIZE < policy.block_size <= MAXIMUM_BLOCK_SIZE
+
+
+def test_adaptive_yields_more_final_bits_than_static(records):
+    model = empirical_model(records)
+    static = replay(StaticBlockSizing(MINIMAL_BLOCK_SIZE), records, model)
+    adaptive = replay(AdaptiveBlockSizing(MINIMAL_BLOCK_SIZE), records, model)
+    assert sum(b[2] for b in adaptive) > 1.02 * sum(b[2] for b in static)
+    assert max(b[1] for b in adaptive) <= MAXIMUM_BLOCK_EPOCHS + 1
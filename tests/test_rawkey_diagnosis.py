@@ -0,0 +1,37 @@
+"""Parity of the in-process raw key diagnosis with the qcrypto 'diagnosis' program."""
+
+import os
+import struct
+
+import numpy as np
+import pytest
+
+from S15qkd.rawkey_diagnosis import RawKeyDiagnosis, prog_diagnosis
+
+pytestmark = pytest.mark.skipif(
+    not os.access(prog_diagnosis, os.X_OK), reason=f"{prog_diagnosis} not available"
+)
+
+
+def write_service_T3(path, epoch: int, entries: np.ndarray):
+    """Writes a service mode T3 file with one byte per entry."""
+    body = entries.astype(np.uint8).tobytes()
+    body += bytes(-len(body) % 4)
+    with open(path / f"{epoch:x}", "wb") as f:
+        f.write(struct.pack("iIIi", 0x103, epoch, len(entries), 8))
+        # entries are stored in 32-bit little-endian words, most significant byte first
+        f.write(np.frombuffer(body, dtype=">u4").astype("<u4").tobytes())
+    return str(path / f"{epoch:x}")
+
+
+@pytest.mark.parametrize("length", [1, 5, 1000])
+def test_diagnosis_matches_subprocess(tmp_path, length):
+    rng = np.random.default_rng(length)
+    # mostly valid one-hot nibbles, with some garbage in either nibble
+    valid = np.array([1, 2, 4, 8])
+    entries = rng.choice(valid, length) | (rng.choice(valid, length) << 4)
+    garbage = rng.random(length) < 0.1
+    entries[garbage] = rng.integers(0, 256, garbage.sum())
+    path = write_service_T3(tmp_path, 0xB2331BEF + length, entries)
+
+    assert RawKeyDiagnosis.diagnosis(path) == RawKeyDiagnosis.diagnosis_subprocess(path)